@@ -0,0 +1,120 @@
+# Import necessary libraries
+import io
+import os
+import time
+import zlib
+import tarfile
+import zipfile
+import logging
+from datetime import datetime
+from collections import namedtuple
+from header_reader import HEAD_SIZE
+from sidecars import described_name, sidecar_date, MAX_SIDECAR_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Archives that can be organized without extracting them first
+ARCHIVE_TYPES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Extensions a scanner has to let through so archives can be recognized among the files it finds
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.gz', '.tgz', '.bz2', '.tbz2', '.xz', '.txz')
+
+# Errors that mean an archive or one of its members cannot be read
+ARCHIVE_ERRORS = (OSError, EOFError, RuntimeError, zlib.error, zipfile.BadZipFile, tarfile.TarError)
+
+# Member of an archive, ready to be placed
+# path is '<archive>/<member name>' and is what the member is planned and logged as; staged is the
+# streamed copy in the staging folder (see staging.Stager; None in dry runs); date_source is 'exif', 'video', 'sidecar' or 'mtime'
+ArchiveMember = namedtuple('ArchiveMember', 'path staged st_size st_mtime_ns date_taken date_source')
+
+# Function to check whether a path names an archive
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_TYPES)
+
+# Function to iterate over the files of a ZIP archive as (name, size, mtime, file)
+# Members are visited in the order they are stored, so the archive is read front to back
+def _zip_members(path):
+    with zipfile.ZipFile(path) as archive:
+        for info in sorted(archive.infolist(), key=lambda info: info.header_offset):
+            if info.is_dir():
+                continue
+            # ZIP times are local times without a time zone
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            with archive.open(info) as file:
+                yield info.filename, info.file_size, mtime, file
+
+# Function to iterate over the files of a TAR archive; stream mode never seeks, compressed or not
+def _tar_members(path):
+    with tarfile.open(path, 'r|*') as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, info.size, info.mtime, archive.extractfile(info)
+
+# Reads archives member by member in a single sequential pass each
+# Dates come from the members' header bytes; members without one wait for their Google Takeout sidecar,
+# which may come later in the archive, and fall back to their modification time when there is none
+class ArchiveReader:
+    # stager, a staging.Stager, streams members to the destination (their hashes with them); without one,
+    # as in dry runs, only headers are read. wanted(name) picks the members to organize; read_date(file, name)
+    # reads a date from an open member, returning (date_taken, source) or (None, None)
+    def __init__(self, stager, wanted, read_date):
+        self.stager = stager
+        self.wanted = wanted
+        self.read_date = read_date
+
+    # Function to yield the wanted members of an archive as ArchiveMember tuples
+    # The caller places or removes each staged file before asking for the next member
+    def members(self, archive_path):
+        iterate = _zip_members if archive_path.lower().endswith('.zip') else _tar_members
+        # Sidecar dates and the members waiting for one, by (folder inside the archive, file name)
+        sidecars = {}
+        waiting = {}
+        try:
+            for name, size, mtime, file in iterate(archive_path):
+                folder, _, filename = name.replace('\\', '/').rpartition('/')
+                if not self.wanted(filename):
+                    described = described_name(filename)
+                    if described is not None and size <= MAX_SIDECAR_SIZE:
+                        date_taken = sidecar_date(file.read(MAX_SIDECAR_SIZE))
+                        if date_taken is not None:
+                            sidecars[(folder, described)] = date_taken
+                            for member in waiting.pop((folder, described), ()):
+                                yield member._replace(date_taken=date_taken, date_source='sidecar')
+                    continue
+                member = self._stage(archive_path, name, size, mtime, file)
+                if member is None:
+                    continue
+                if member.date_source == 'mtime':
+                    date_taken = sidecars.get((folder, filename))
+                    if date_taken is None:
+                        waiting.setdefault((folder, filename), []).append(member)
+                        continue
+                    member = member._replace(date_taken=date_taken, date_source='sidecar')
+                yield member
+        except ARCHIVE_ERRORS as e:
+            logger.error(f"Unable to read archive {archive_path}: {e}")
+        # Members whose sidecar never turned up keep their modification time
+        for members in waiting.values():
+            yield from members
+
+    # Function to stream a member into the staging folder and read its date on the way
+    def _stage(self, archive_path, name, size, mtime, file):
+        path = os.path.join(archive_path, *name.replace('\\', '/').split('/'))
+        mtime_ns = int(mtime * 1e9)
+        staged = None
+        try:
+            if self.stager is None:
+                date_taken, source = self.read_date(io.BytesIO(file.read(HEAD_SIZE)), path)
+            else:
+                staged = self.stager.stage(file, path, mtime_ns, 'extract')
+                # The header is still in the page cache, so this does not touch the disk again
+                with open(staged, 'rb') as staged_file:
+                    date_taken, source = self.read_date(staged_file, path)
+        except ARCHIVE_ERRORS as e:
+            logger.error(f"Unable to extract {path}: {e}")
+            if staged is not None and os.path.exists(staged):
+                os.remove(staged)
+            return None
+        if date_taken is None:
+            date_taken, source = datetime.fromtimestamp(mtime).strftime('%Y:%m:%d %H:%M:%S'), 'mtime'
+        return ArchiveMember(path, staged, size, mtime_ns, date_taken, source)
@@ -0,0 +1,141 @@
+# Deterministic synthetic media corpus for the benchmarks
+# The same arguments always produce the same tree: names, contents, sizes and modification times
+import os
+import sys
+import json
+import struct
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# Seconds between 1904-01-01 (the MP4 epoch) and 1970-01-01
+MP4_EPOCH_OFFSET = 2082844800
+
+# Size of an oversized image: just above the limit where file_organizer stops handing images to PIL
+OVERSIZED_SIZE = 90 * 1024 * 1024
+
+# Kinds of file in the corpus: (weight, extensions, smallest size, largest size)
+KINDS = {
+    'jpeg_exif': (35, ('.jpg', '.jpeg'), 20 * 1024, 512 * 1024),
+    'jpeg_plain': (15, ('.jpg',), 20 * 1024, 512 * 1024),
+    'mp4': (10, ('.mp4',), 256 * 1024, 4 * 1024 * 1024),
+    'mov': (5, ('.mov',), 256 * 1024, 4 * 1024 * 1024),
+    'audio': (15, ('.mp3', '.wav'), 64 * 1024, 1024 * 1024),
+    'document': (20, ('.pdf', '.txt', '.docx'), 1024, 64 * 1024),
+}
+
+# Function to build an ISO-BMFF box
+def _box(box_type, payload):
+    return struct.pack('>I', 8 + len(payload)) + box_type + payload
+
+# Function to build a little-endian TIFF block holding only DateTimeOriginal
+def _tiff(date):
+    value = date.strftime('%Y:%m:%d %H:%M:%S').encode() + b'\x00'
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, 26) + struct.pack('<I', 0)
+    exif = struct.pack('<H', 1) + struct.pack('<HHII', 0x9003, 2, len(value), 44) + struct.pack('<I', 0)
+    return b'II' + struct.pack('<HI', 42, 8) + ifd0 + exif + value
+
+# Function to build the header of a JPEG, with or without an EXIF APP1 segment
+def jpeg_header(date=None):
+    header = b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    if date is not None:
+        app1 = b'Exif\x00\x00' + _tiff(date)
+        header += b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1
+    return header + b'\xff\xda\x00\x02'
+
+# Function to build the header of an MP4 or MOV file whose moov/mvhd records date
+def movie_header(date, brand):
+    creation_time = int(date.timestamp()) + MP4_EPOCH_OFFSET
+    mvhd = _box(b'mvhd', bytes(4) + struct.pack('>IIII', creation_time, creation_time, 1000, 1000) + bytes(80))
+    return _box(b'ftyp', brand + bytes(4) + brand) + _box(b'moov', mvhd)
+
+# Function to build a file's contents: a real header for its kind, then random bytes
+def _contents(rng, kind, date, size):
+    if kind == 'jpeg_exif':
+        header = jpeg_header(date)
+    elif kind == 'jpeg_plain':
+        header = jpeg_header()
+    elif kind == 'mp4':
+        header = movie_header(date, b'isom')
+    elif kind == 'mov':
+        header = movie_header(date, b'qt  ')
+    else:
+        header = b''
+    body = rng.randbytes(max(0, size - len(header)))
+    if kind in ('mp4', 'mov'):
+        # Close the header with an mdat box around the payload, as a muxer would
+        body = struct.pack('>I', len(body)) + b'mdat' + body[8:] if len(body) >= 8 else body
+    elif kind.startswith('jpeg'):
+        body = body[:-2] + b'\xff\xd9' if len(body) >= 2 else body
+    return header + body
+
+# Function to pick a folder at a random depth, creating the tree lazily
+def _folder(rng, root, depth, fanout):
+    parts = [f"dir{rng.randrange(fanout):02d}" for _ in range(rng.randint(0, depth))]
+    return os.path.join(root, *parts)
+
+# Function to generate a corpus under root
+# files: number of files; duplicate_ratio: share of files that repeat an earlier file's contents under another name;
+# depth and fanout shape the folder tree; oversized: number of sparse images above OVERSIZED_SIZE
+# Returns a manifest describing what was written
+def generate_corpus(root, files=1000, seed=0, duplicate_ratio=0.1, depth=3, fanout=4, oversized=1):
+    rng = random.Random(seed)
+    kinds = list(KINDS)
+    weights = [KINDS[kind][0] for kind in kinds]
+    start = datetime(2005, 1, 1)
+    written = []
+    manifest = {"root": root, "files": files, "seed": seed, "duplicate_ratio": duplicate_ratio, "depth": depth, "fanout": fanout,
+                "oversized": oversized, "bytes": 0, "duplicates": 0, "kinds": {}}
+
+    for i in range(files):
+        folder = _folder(rng, root, depth, fanout)
+        os.makedirs(folder, exist_ok=True)
+        date = start + timedelta(seconds=rng.randrange(20 * 365 * 24 * 3600))
+        if i < oversized:
+            kind = 'oversized'
+            path = os.path.join(folder, f"IMG_{i:06d}.jpg")
+            with open(path, 'wb') as file:
+                file.write(jpeg_header(date))
+                # Sparse: the size matters to the organizer, the bytes do not need to hit the disk
+                file.truncate(OVERSIZED_SIZE)
+            size = OVERSIZED_SIZE
+        elif written and rng.random() < duplicate_ratio:
+            kind = 'duplicate'
+            source = rng.choice(written)
+            path = os.path.join(folder, f"copy_{i:06d}{os.path.splitext(source)[1]}")
+            with open(source, 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+            size = os.path.getsize(path)
+            manifest["duplicates"] += 1
+        else:
+            kind = rng.choices(kinds, weights)[0]
+            _, extensions, smallest, largest = KINDS[kind]
+            path = os.path.join(folder, f"{kind.split('_')[0].upper()}_{i:06d}{rng.choice(extensions)}")
+            size = rng.randint(smallest, largest)
+            with open(path, 'wb') as file:
+                file.write(_contents(rng, kind, date, size))
+            written.append(path)
+        timestamp = date.timestamp() + rng.randrange(3600)
+        os.utime(path, (timestamp, timestamp))
+        manifest["bytes"] += size
+        manifest["kinds"][kind] = manifest["kinds"].get(kind, 0) + 1
+
+    return manifest
+
+# Generate a corpus from the command line: python benchmarks/corpus.py ROOT --files 1000
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic media corpus.")
+    parser.add_argument('root', help="folder to generate the corpus in")
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--oversized', type=int, default=1)
+    args = parser.parse_args(argv)
+    manifest = generate_corpus(args.root, args.files, args.seed, args.duplicate_ratio, args.depth, args.fanout, args.oversized)
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
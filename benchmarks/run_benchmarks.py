@@ -0,0 +1,194 @@
+# Benchmark suite: throughput of each organizer stage over synthetic corpora
+# python benchmarks/run_benchmarks.py --sizes 200,2000 [--compare benchmarks/results/earlier.json]
+# Results are written as JSON; stages run on a warm page cache, so they measure the code rather than the disk
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import file_organizer
+from corpus import generate_corpus
+from scanner import Scanner
+from hashing import HashEngine
+from hash_index import DestinationIndex
+
+# Format version of the results file
+RESULTS_VERSION = 1
+
+# Option combinations the end-to-end organize runs are measured with
+OPTION_SETS = {
+    'default': {},
+    'eliminate_duplicates': {'eliminate_duplicates': True},
+    'organize_by_size': {'organize_by_size': True},
+    'eliminate_duplicates+organize_by_size': {'eliminate_duplicates': True, 'organize_by_size': True},
+}
+
+# Function to time a benchmark body, keeping the fastest of repeat runs
+# setup() runs untimed before each run and its result is passed to body
+def _best_time(body, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        body(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Function to build one result record
+def _result(stage, options, manifest, files, nbytes, seconds):
+    return {
+        "stage": stage,
+        "options": options,
+        "corpus_files": manifest["files"],
+        "files": files,
+        "bytes": nbytes,
+        "seconds": round(seconds, 6),
+        "files_per_sec": round(files / seconds, 2) if seconds else None,
+        "mb_per_sec": round(nbytes / seconds / (1024 * 1024), 2) if seconds else None,
+    }
+
+# Function to make an empty scratch folder
+def _fresh(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+# Function to run every stage benchmark over one corpus
+def benchmark_corpus(corpus, manifest, workdir, repeat, io_workers, metadata_workers):
+    entries = list(Scanner(corpus))
+    paths = [entry.path for entry in entries]
+    nbytes = sum(entry.st_size for entry in entries)
+    results = []
+
+    # Scan: the streaming os.scandir walk
+    seconds = _best_time(lambda _: sum(1 for _ in Scanner(corpus)), repeat)
+    results.append(_result('scan', 'default', manifest, len(entries), nbytes, seconds))
+
+    # Metadata: date extraction in this process, without the metadata cache
+    seconds = _best_time(lambda _: file_organizer.read_dates_taken(paths), repeat)
+    results.append(_result('metadata', 'default', manifest, len(paths), nbytes, seconds))
+
+    # Hashing: full-content hashes with a fresh (unmemoized) engine each run
+    seconds = _best_time(lambda engine: [engine.full_hash(path) for path in paths], repeat, HashEngine)
+    results.append(_result('hashing', 'default', manifest, len(paths), nbytes, seconds))
+
+    # Dedupe: tiered claims of every file against an in-memory destination index
+    def dedupe(index):
+        for entry in entries:
+            duplicate, hashes = index.claim(entry.path, entry)
+            if duplicate is None:
+                index.add(entry.path, entry.st_size, hashes)
+            else:
+                index.release(entry.st_size)
+        index.close()
+
+    def new_index():
+        index = DestinationIndex(_fresh(os.path.join(workdir, 'index')), HashEngine(), in_memory=True)
+        index.build()
+        return index
+    seconds = _best_time(dedupe, repeat, new_index)
+    results.append(_result('dedupe', 'default', manifest, len(entries), nbytes, seconds))
+
+    # process_file: the one-file-at-a-time path, copying
+    def process_files(dest):
+        for dirpath, _, filenames in os.walk(corpus):
+            for filename in filenames:
+                file_organizer.process_file(filename, dirpath, [''], dest, False, False, False, False, False, False, False, False, False, False, [], False, False, False)
+    seconds = _best_time(process_files, repeat, lambda: _fresh(os.path.join(workdir, 'dest')))
+    results.append(_result('process_file', 'default', manifest, len(paths), nbytes, seconds))
+
+    # Copy: complete organize runs through the pipeline, once per option combination
+    for name, options in OPTION_SETS.items():
+        def organize(dest):
+            file_organizer.organize_files_by_date(corpus, dest, move_files=False, metadata_cache_path=None, metadata_workers=metadata_workers, io_workers=io_workers, show_progress=False, **options)
+        seconds = _best_time(organize, repeat, lambda: _fresh(os.path.join(workdir, 'dest')))
+        results.append(_result('copy', name, manifest, len(paths), nbytes, seconds))
+
+    # Move: organize a scratch copy of the corpus, so the corpus itself stays put
+    def scratch():
+        source = os.path.join(workdir, 'move-source')
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.copytree(corpus, source)
+        return source, _fresh(os.path.join(workdir, 'dest'))
+    def move(folders):
+        file_organizer.organize_files_by_date(folders[0], folders[1], move_files=True, metadata_cache_path=None, metadata_workers=metadata_workers, io_workers=io_workers, show_progress=False)
+    seconds = _best_time(move, repeat, scratch)
+    results.append(_result('move', 'default', manifest, len(paths), nbytes, seconds))
+
+    return results
+
+# Function to describe the machine and checkout the results came from
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(), "commit": commit}
+
+# Function to print how results compare with an earlier results file
+def compare(results, previous_path):
+    with open(previous_path, encoding='utf-8') as file:
+        previous = {(r["stage"], r["options"], r["corpus_files"]): r for r in json.load(file)["results"]}
+    print(f"{'stage':<14}{'options':<40}{'files':>8}{'before':>12}{'after':>12}{'change':>9}")
+    for result in results:
+        before = previous.get((result["stage"], result["options"], result["corpus_files"]))
+        if before is None or not before["files_per_sec"] or not result["files_per_sec"]:
+            continue
+        change = (result["files_per_sec"] / before["files_per_sec"] - 1) * 100
+        print(f"{result['stage']:<14}{result['options']:<40}{result['corpus_files']:>8}{before['files_per_sec']:>12.1f}{result['files_per_sec']:>12.1f}{change:>+8.1f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the organizer's stages over synthetic corpora.")
+    parser.add_argument('--sizes', default='200,2000', help="comma-separated corpus sizes in files")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--oversized', type=int, default=1, help="sparse images above the PIL size limit per corpus")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the fastest is kept")
+    parser.add_argument('--io-workers', type=int)
+    parser.add_argument('--metadata-workers', type=int)
+    parser.add_argument('--workdir', help="folder for corpora and scratch output (default: a temporary folder)")
+    parser.add_argument('--output', help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', metavar='PATH', help="earlier results file to compare with")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pixjinx-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    file_organizer.setup_logging(os.path.join(workdir, 'benchmark.log'))
+
+    started = datetime.now(timezone.utc)
+    results = []
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            corpus = _fresh(os.path.join(workdir, f"corpus-{size}-{args.seed}"))
+            manifest = generate_corpus(corpus, size, args.seed, args.duplicate_ratio, args.depth, oversized=args.oversized)
+            print(f"Corpus of {size} files ({manifest['bytes'] / (1024 * 1024):.0f} MB)", file=sys.stderr)
+            for result in benchmark_corpus(corpus, manifest, workdir, args.repeat, args.io_workers, args.metadata_workers):
+                results.append(result)
+                print(f"  {result['stage']:<14}{result['options']:<40}{result['files_per_sec']:>10.1f} files/s{result['mb_per_sec']:>10.1f} MB/s", file=sys.stderr)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"{started.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump({"version": RESULTS_VERSION, "started": started.isoformat(), "environment": environment(), "config": vars(args), "results": results}, file, indent=2)
+    print(f"Wrote {output}", file=sys.stderr)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
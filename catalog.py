@@ -0,0 +1,227 @@
+# Import necessary libraries
+import os
+import time
+import calendar
+import logging
+from array import array
+from layout import SIZE_CLASSES
+
+logger = logging.getLogger(__name__)
+
+# NumPy is imported on first use, so filling a catalog never loads it; only grouping and reports need it
+
+# Where dates came from, stored as one byte per file; 0 means the file has no date yet
+DATE_SOURCES = (None, 'exif', 'video', 'sidecar', 'mtime')
+
+# Dates taken are stored as seconds since 1970 of the local date and time read as UTC, so calendar fields
+# come straight out of NumPy's datetime64 without time zones getting involved; NO_DATE marks undated files
+NO_DATE = -(2 ** 63)
+
+# Bytes kept of each content hash; the first 128 bits tell files apart as well as the whole digest
+HASH_BYTES = 16
+
+# Date partitions, as NumPy datetime64 units
+DATE_PARTITIONS = {'year': 'Y', 'month': 'M', 'day': 'D'}
+
+# Function to split indices into groups of equal keys; returns (keys, groups) with the groups in key order
+def _group(np, keys, indices):
+    if not len(keys):
+        return keys, []
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return sorted_keys[starts], np.split(indices[order], starts[1:])
+
+# Compact catalog of scanned files, stored column by column in arrays rather than as an object per file
+# Folder paths and extensions are interned, names share one buffer, and each file takes well under
+# 100 bytes: path id, size, modification time, inode, date taken and hash. Files are numbered in the
+# order they were added. Fill a catalog from a single thread; numpy_columns() views must be dropped
+# before more files are added, since arrays cannot grow while NumPy holds their buffers
+class Catalog:
+    def __init__(self):
+        self.folders = []
+        self.folder_ids = {}
+        self.extensions = []
+        self.extension_ids = {}
+        self.folder = array('I')
+        self.extension = array('H')
+        self.name_end = array('Q')
+        self.names = bytearray()
+        self.size = array('q')
+        self.mtime_ns = array('q')
+        self.inode = array('Q')
+        self.taken = array('q')
+        self.source = array('B')
+        self.hashes = bytearray()
+
+    def __len__(self):
+        return len(self.size)
+
+    # Function to intern a value in a table, returning its id
+    def _intern(self, table, ids, value):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(table)
+            table.append(value)
+        return value_id
+
+    # Function to add a file; returns its number
+    def add(self, path, size, mtime_ns, inode=0, date_taken=None, source=None):
+        folder, name = os.path.split(path)
+        self.folder.append(self._intern(self.folders, self.folder_ids, folder))
+        self.extension.append(self._intern(self.extensions, self.extension_ids, os.path.splitext(name)[1].lower() or '(none)'))
+        self.names += name.encode('utf-8', 'surrogateescape')
+        self.name_end.append(len(self.names))
+        self.size.append(size)
+        self.mtime_ns.append(mtime_ns)
+        self.inode.append(inode)
+        self.taken.append(NO_DATE)
+        self.source.append(0)
+        self.hashes += bytes(HASH_BYTES)
+        index = len(self.size) - 1
+        if date_taken is not None:
+            self.set_date(index, date_taken, source)
+        return index
+
+    # Function to add a scanner.ScanEntry
+    def add_entry(self, entry, date_taken=None, source=None):
+        return self.add(entry.path, entry.st_size, entry.st_mtime_ns, entry.st_ino, date_taken, source)
+
+    # Function to record a file's date taken, given as 'YYYY:MM:DD HH:MM:SS'; malformed dates leave it undated
+    def set_date(self, index, date_taken, source=None):
+        try:
+            date, clock = date_taken.split(' ')
+            fields = [int(part) for part in date.split(':')] + [int(part) for part in clock.split(':')]
+            if len(fields) != 6 or not (1 <= fields[1] <= 12 and 1 <= fields[2] <= calendar.monthrange(fields[0], fields[1])[1]):
+                raise ValueError(date_taken)
+            self.taken[index] = calendar.timegm(fields)
+        except (ValueError, OverflowError):
+            logger.debug(f"Invalid date taken {date_taken!r} for {self.path(index)}")
+            return
+        self.source[index] = DATE_SOURCES.index(source) if source in DATE_SOURCES else 0
+
+    # Function to record a file's content hash, as a hex digest like hashing.HashEngine returns
+    def set_hash(self, index, digest):
+        self.hashes[index * HASH_BYTES:(index + 1) * HASH_BYTES] = bytes.fromhex(digest)[:HASH_BYTES].ljust(HASH_BYTES, b'\0')
+
+    # Function to get the path of a file
+    def path(self, index):
+        start = self.name_end[index - 1] if index else 0
+        name = self.names[start:self.name_end[index]].decode('utf-8', 'surrogateescape')
+        return os.path.join(self.folders[self.folder[index]], name)
+
+    # Function to get the date taken of a file in the EXIF format, or None
+    def date_taken(self, index):
+        taken = self.taken[index]
+        if taken == NO_DATE:
+            return None
+        return time.strftime('%Y:%m:%d %H:%M:%S', time.gmtime(taken))
+
+    # Function to get where a file's date came from, or None
+    def date_source(self, index):
+        return DATE_SOURCES[self.source[index]]
+
+    # Function to get the hash recorded for a file (its first HASH_BYTES bytes, in hex), or None
+    def hash(self, index):
+        digest = bytes(self.hashes[index * HASH_BYTES:(index + 1) * HASH_BYTES])
+        return digest.hex() if any(digest) else None
+
+    # Function to count the bytes the catalog takes, interned tables included
+    def memory_bytes(self):
+        columns = (self.folder, self.extension, self.name_end, self.size, self.mtime_ns, self.inode, self.taken, self.source)
+        total = sum(len(column) * column.itemsize for column in columns) + len(self.names) + len(self.hashes)
+        return total + sum(len(folder) for folder in self.folders) + sum(len(extension) for extension in self.extensions)
+
+    # Function to view the columns as NumPy arrays without copying them
+    def numpy_columns(self):
+        import numpy as np
+        return {
+            'folder': np.frombuffer(self.folder, dtype=np.uint32),
+            'extension': np.frombuffer(self.extension, dtype=np.uint16),
+            'size': np.frombuffer(self.size, dtype=np.int64),
+            'mtime_ns': np.frombuffer(self.mtime_ns, dtype=np.int64),
+            'inode': np.frombuffer(self.inode, dtype=np.uint64),
+            'taken': np.frombuffer(self.taken, dtype=np.int64),
+            'source': np.frombuffer(self.source, dtype=np.uint8),
+            'hash': np.frombuffer(self.hashes, dtype=np.uint8).reshape(-1, HASH_BYTES),
+        }
+
+    # Function to group files by size class (see layout.size_class); returns {class: file numbers}
+    def by_size_class(self):
+        import numpy as np
+        size = np.frombuffer(self.size, dtype=np.int64)
+        classes = np.searchsorted(np.array([limit for limit, _ in SIZE_CLASSES], dtype=np.int64), size, side='right')
+        names = [name for _, name in SIZE_CLASSES] + ['Large']
+        return {names[key]: group for key, group in zip(*_group(np, classes, np.arange(len(size))))}
+
+    # Function to group dated files by year, month or day; returns {'2021' / '2021-07' / '2021-07-04': file numbers}
+    def by_date(self, partition='month'):
+        import numpy as np
+        if partition not in DATE_PARTITIONS:
+            raise ValueError(f"Unknown date partition {partition}; expected one of {', '.join(DATE_PARTITIONS)}")
+        taken = np.frombuffer(self.taken, dtype=np.int64)
+        dated = np.flatnonzero(taken != NO_DATE)
+        keys = taken[dated].astype('datetime64[s]').astype(f'datetime64[{DATE_PARTITIONS[partition]}]')
+        return {str(key): group for key, group in zip(*_group(np, keys, dated))}
+
+    # Function to find duplicate candidates: groups of two or more files of the same size, largest files first
+    # Only these ever need hashing; see fill_hashes and duplicates
+    def duplicate_candidates(self):
+        import numpy as np
+        size = np.frombuffer(self.size, dtype=np.int64)
+        _, groups = _group(np, -size, np.arange(len(size)))
+        return [group for group in groups if len(group) > 1]
+
+    # Function to hash the given files (e.g. the duplicate candidates) with a hashing.HashEngine
+    # Files that cannot be read keep no hash
+    def fill_hashes(self, hash_engine, indices):
+        for index in indices:
+            index = int(index)
+            path = self.path(index)
+            try:
+                self.set_hash(index, hash_engine.full_hash(path))
+            except OSError as e:
+                logger.error(f"Unable to hash {path}: {e}")
+
+    # Function to find groups of identical files among the hashed ones: equal size and equal hash
+    def duplicates(self):
+        import numpy as np
+        hashes = np.frombuffer(self.hashes, dtype=np.uint8).reshape(-1, HASH_BYTES)
+        hashed = np.flatnonzero(hashes.any(axis=1))
+        # One comparable key per file: its size followed by its hash bytes
+        keys = np.empty(len(hashed), dtype=[('size', '<i8'), ('hash', f'V{HASH_BYTES}')])
+        keys['size'] = np.frombuffer(self.size, dtype=np.int64)[hashed]
+        keys['hash'] = np.ascontiguousarray(hashes[hashed]).view(f'V{HASH_BYTES}')[:, 0]
+        _, inverse = np.unique(keys, return_inverse=True)
+        _, groups = _group(np, inverse.reshape(-1), hashed)
+        return [group for group in groups if len(group) > 1]
+
+    # Function to summarize the catalog before anything is moved: files and bytes per year, month,
+    # extension and size class, undated files, and duplicate candidates (confirmed duplicates where hashed)
+    def summary(self):
+        import numpy as np
+        size = np.frombuffer(self.size, dtype=np.int64)
+
+        def totals(groups):
+            return {key: {"files": len(group), "bytes": int(size[group].sum())} for key, group in groups.items()}
+
+        extension = np.frombuffer(self.extension, dtype=np.uint16)
+        files_per_type = np.bincount(extension, minlength=len(self.extensions))
+        bytes_per_type = np.bincount(extension, weights=size, minlength=len(self.extensions))
+        candidates = self.duplicate_candidates()
+        duplicates = self.duplicates()
+        summary = {
+            "files": len(self),
+            "bytes": int(size.sum()),
+            "undated": int((np.frombuffer(self.taken, dtype=np.int64) == NO_DATE).sum()),
+            "years": totals(self.by_date('year')),
+            "months": totals(self.by_date('month')),
+            "extensions": {name: {"files": int(files), "bytes": int(nbytes)} for name, files, nbytes in sorted(zip(self.extensions, files_per_type, bytes_per_type), key=lambda item: -item[2])},
+            "size_classes": totals(self.by_size_class()),
+            "duplicate_candidates": {"groups": len(candidates), "files": sum(len(group) for group in candidates), "bytes": sum(int(size[group].sum()) for group in candidates)},
+        }
+        if duplicates:
+            # Everything but one file of each group could go
+            summary["duplicates"] = {"groups": len(duplicates), "files": sum(len(group) for group in duplicates), "redundant_bytes": sum(int(size[group[1:]].sum()) for group in duplicates)}
+        summary["catalog_bytes"] = self.memory_bytes()
+        return summary
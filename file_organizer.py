@@ -1,220 +1,915 @@
 # Import necessary libraries
 import os
+import time
 import shutil
+import atexit
+import queue
 import logging
-from PIL import Image, ExifTags
 from datetime import datetime
-from tqdm import tqdm
+from hashing import HashEngine, hash_file
+from hash_index import DestinationIndex, INDEX_FILENAME
+from metadata_cache import MetadataCache, default_cache_path
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
-import hashlib
+from pipeline import OrganizePipeline, QUEUE_SIZE, default_io_workers
+from planner import NameReserver, PlanWriter, read_plan, count_plan, create_folders
+from scanner import Scanner
+from journal import Journal, recover_journal
+from transfer import Transfer, TargetExistsError
+from io_scheduler import IOScheduler, REORDER_WINDOW, device_of_path
+from header_reader import read_exif_date, read_video_date, exif_date_from_file, video_date_from_file, TAG_DATE_TIME_ORIGINAL
+from sidecars import read_sidecar_date
+from archives import ArchiveReader, ARCHIVE_EXTENSIONS, is_archive
+from staging import Stager, STAGING_FOLDER
+from itertools import chain
+from metrics import Metrics
+from catalog import Catalog
+from layout import compile_layout
+from perceptual import NearDuplicateIndex, DEFAULT_THRESHOLD, PERCEPTUAL_INDEX_FILENAME, pixels
+from watcher import Watcher, SETTLE_SECONDS, POLL_INTERVAL
+# PIL, hachoir and tqdm are imported on first use: they are slow to load and many runs never need them
 
-# Set up logging
-logging.basicConfig(filename='file_organizer.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-from hachoir.parser import createParser
-from hachoir.metadata import extractMetadata
+# Messages about individual files go to their own logger, so large runs can leave them out
+file_logger = logger.getChild('files')
+
+# Log line format shared by the GUI and the command line
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Verbosity levels: 'debug' logs everything, 'files' logs every file, 'summary' logs run summaries
+# and per-file errors only, 'errors' logs nothing but errors
+VERBOSITY_LEVELS = ('debug', 'files', 'summary', 'errors')
+
+# File types that are organized
+FILE_TYPES = ['.jpg', '.png', '.jpeg', '.mp4', '.avi', '.mov', '.mkv', '.dng', '.gif', '.bmp', '.heic', '.tiff', '.webp', '.raw', '.indd', '.ai', '.eps', '.pdf', '.svg', '.psd', '.flv', '.m2ts', '.mts', '.ts', '.m4v', '.wmv', '.ogv', '.3gp', '.3g2', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt', '.rtf', '.csv', '.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.wma']
+
+# Seconds between progress callbacks; files finish far faster than anyone can watch
+PROGRESS_INTERVAL = 0.1
+
+# Function to change how much is logged, also while a run is going
+def set_verbosity(verbosity):
+    levels = {'debug': logging.DEBUG, 'files': logging.INFO, 'summary': logging.INFO, 'errors': logging.ERROR}
+    logging.getLogger().setLevel(levels[verbosity])
+    file_logger.setLevel(logging.ERROR if verbosity == 'summary' else logging.NOTSET)
+
+# Function to set up logging; called by the entry points, never on import
+# Records are queued and written by a listener thread, so threads doing file work never wait on the log file;
+# extra handlers (such as the GUI's log view) are fed by the same listener. filename=None logs to stderr
+def setup_logging(filename='file_organizer.log', verbosity='files', handlers=()):
+    from logging.handlers import QueueHandler, QueueListener
+    handlers = [logging.FileHandler(filename) if filename is not None else logging.StreamHandler(), *handlers]
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    logging.getLogger().addHandler(QueueHandler(log_queue))
+    set_verbosity(verbosity)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Stopping the listener writes out whatever is still queued
+    atexit.register(listener.stop)
+    return listener
+
+# Progress callback wrapper delivering at most one update per interval; finish() always delivers the last one
+class ProgressThrottle:
+    def __init__(self, callback, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.last = 0
+
+    def update(self, processed, total):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.callback(processed, total)
+
+    def finish(self, processed, total):
+        if self.callback is not None:
+            self.callback(processed, total)
+
+# Video types, and the ISO-BMFF subset whose headers we read without hachoir
+VIDEO_TYPES = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.3gp', '.3g2')
+ISO_BMFF_TYPES = ('.mp4', '.mov', '.m4v', '.3gp', '.3g2')
+
+# Image types PIL may find a date in; for anything else (documents, audio) the date is the modification time
+IMAGE_TYPES = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.heic', '.dng', '.raw')
 
 # Function to get creation date of a video file
 def get_video_date_taken(path):
+    # Read moov/mvhd directly when we can; hachoir is only needed for other containers
+    if path.lower().endswith(ISO_BMFF_TYPES):
+        date_taken, parsed = read_video_date(path)
+        if parsed:
+            return date_taken
     try:
+        from hachoir.parser import createParser
+        from hachoir.metadata import extractMetadata
         parser = createParser(path)
         if not parser:
-            logger.error(f"Unable to parse video {path}")
+            file_logger.error(f"Unable to parse video {path}")
             return None
         with parser:
             metadata = extractMetadata(parser)
         if not metadata:
-            logger.error(f"Unable to extract metadata from video {path}")
+            file_logger.error(f"Unable to extract metadata from video {path}")
             return None
         return metadata.get('creation_date')
     except Exception as e:
-        logger.error(f"Error reading creation date from video {path}: {e}")
+        file_logger.error(f"Error reading creation date from video {path}: {e}")
         return None
 
-# Function to get creation date of a file
-def get_date_taken(path):
+# Function to read the creation date of a file and where it came from ('exif', 'video', 'sidecar' or 'mtime')
+# A Google Takeout sidecar next to the file, when there is one, stands in for the modification time
+def read_date_taken(path):
     try:
         # If file is a video file
-        if path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
+        if path.lower().endswith(VIDEO_TYPES):
             date_taken = get_video_date_taken(path)
             if date_taken is not None:
-                return date_taken.strftime('%Y:%m:%d %H:%M:%S')
+                return date_taken.strftime('%Y:%m:%d %H:%M:%S'), 'video'
             else:
                 timestamp = os.path.getmtime(path)
         else:
-            # If file is an image file
-            if os.path.getsize(path) > 89478485:
-                logger.warning(f"Skipping large image {path}")
+            # If file is an image file, read the date straight from the EXIF header when we understand the container
+            date_taken, parsed = read_exif_date(path)
+            if date_taken is not None:
+                return date_taken, 'exif'
+            if parsed or not path.lower().endswith(IMAGE_TYPES):
+                timestamp = os.path.getmtime(path)
+            elif os.path.getsize(path) > 89478485:
+                file_logger.warning(f"Skipping large image {path}")
                 timestamp = os.path.getmtime(path)
             else:
+                # Fall back to PIL for formats the header reader cannot walk
+                from PIL import Image
                 image = Image.open(path)
                 if hasattr(image, '_getexif'):
                     exif_data = image._getexif()
                     if exif_data is not None:
-                        for tag, value in exif_data.items():
-                            if ExifTags.TAGS.get(tag) == 'DateTimeOriginal':
-                                return value
+                        date_taken = exif_data.get(TAG_DATE_TIME_ORIGINAL)
+                        if date_taken is not None:
+                            return date_taken, 'exif'
                 timestamp = os.path.getmtime(path)
-    except (KeyError, TypeError, AttributeError, IOError) as e:
-        logger.error(f"Error reading EXIF data from {path}: {e}")
+    except (KeyError, TypeError, AttributeError, IOError, ImportError) as e:
+        file_logger.error(f"Error reading EXIF data from {path}: {e}")
         timestamp = os.path.getmtime(path)
 
-    return datetime.fromtimestamp(timestamp).strftime('%Y:%m:%d %H:%M:%S')
+    date_taken = read_sidecar_date(path)
+    if date_taken is not None:
+        return date_taken, 'sidecar'
+    return datetime.fromtimestamp(timestamp).strftime('%Y:%m:%d %H:%M:%S'), 'mtime'
+
+# Function to read the date of an archive member from its header bytes; see archives.ArchiveReader
+# Returns (date_taken, source), or (None, None) when the header holds no date
+def read_member_date(file, name):
+    lower = name.lower()
+    if lower.endswith(ISO_BMFF_TYPES):
+        date_taken, parsed = video_date_from_file(file, name)
+        if date_taken is not None:
+            return date_taken.strftime('%Y:%m:%d %H:%M:%S'), 'video'
+    elif not lower.endswith(VIDEO_TYPES):
+        date_taken, parsed = exif_date_from_file(file, name)
+        if date_taken is not None:
+            return date_taken, 'exif'
+    return None, None
+
+# Stands for the metadata cache's default location, which is only resolved when a run opens the cache,
+# so it follows XDG_CACHE_HOME and HOME as they are then rather than as they were on import
+DEFAULT_CACHE_PATH = object()
+
+# Function to open the metadata cache at path, or at its default location for DEFAULT_CACHE_PATH
+# Returns None when path is None, i.e. caching is disabled
+def open_metadata_cache(path=DEFAULT_CACHE_PATH):
+    if path is None:
+        return None
+    return MetadataCache(default_cache_path() if path is DEFAULT_CACHE_PATH else path)
+
+# Function to get creation date of a file, answering from the metadata cache when the file is unchanged
+def get_date_taken(path, metadata_cache=None):
+    if metadata_cache is None:
+        return read_date_taken(path)[0]
+
+    stat = os.stat(path)
+    cached = metadata_cache.get(stat)
+    if cached is not None:
+        return cached[0]
+    date_taken, source = read_date_taken(path)
+    metadata_cache.put(stat, date_taken, source)
+    return date_taken
+
+# Shared hashing engine; memoizes hashes so each file is read at most once per run
+hash_engine = HashEngine()
 
 # Function to get hash of a file
 def get_file_hash(path):
-    hasher = hashlib.md5()
-    with open(path, 'rb') as file:
-        buf = file.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+    return hash_engine.full_hash(path)
 
 # Function to compare two files
 def compare_files(file1, file2):
-    return os.path.getsize(file1) == os.path.getsize(file2) and get_file_hash(file1) == get_file_hash(file2)
+    return hash_engine.same_content(file1, file2)
 
-# Function to process a file
-def process_file(filename, dirpath, file_types, dest_folder, move_files, delete_files, dry_run, year_only, day_only, month_only, rename_files, skip_existing, maintain_metadata, organize_by_type, ignore_types, organize_by_size, organize_by_name, eliminate_duplicates):
-    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
-
-    # If file is of the specified types and not of the ignored types
-    if filename.lower().endswith(tuple(file_types)) and not filename.lower().endswith(tuple(ignore_types)):
-        full_path = os.path.join(dirpath, filename)
-        date_taken = get_date_taken(full_path)
+# Function to read dates for a batch of files; runs in the metadata worker processes
+# Returns (date_taken, source, seconds) per file, seconds being how long the file took, or None for a file
+# that could not be read, e.g. one removed since the scan, so only that file is skipped
+def read_dates_taken(paths):
+    results = []
+    for path in paths:
+        start = time.perf_counter()
         try:
-            year, month, day_time = date_taken.split(':', 2)
-            day, time = day_time.split(' ')
-            time = time.replace(':', '_')
-            month_name = datetime(year=int(year), month=int(month), day=int(day)).strftime('%B')
-        except ValueError as e:
-            logger.error(f"Invalid date format in {full_path}: {e}")
-            return result
+            date_taken, source = read_date_taken(path)
+        except OSError as e:
+            file_logger.error(f"Error reading {path}: {e}")
+            results.append(None)
+            continue
+        results.append((date_taken, source, time.perf_counter() - start))
+    return results
 
-        # Rename file if rename_files is True
-        new_filename = f"{day}_{month_name}_{time}{os.path.splitext(filename)[1]}" if rename_files else filename
-        year_folder = os.path.join(dest_folder, year)
-        month_folder = os.path.join(year_folder, f"{month}.{month_name}") if not year_only else year_folder
-        day_folder = os.path.join(month_folder, day) if day_only else month_folder
-        final_folder = os.path.join(day_folder, os.path.splitext(filename)[1][1:]) if organize_by_type else day_folder
-
-        if month_only:
-            final_folder = month_folder
-
-        # Organize by size if organize_by_size is True
-        if organize_by_size:
-            size = os.path.getsize(full_path)
-            if size < 1024 * 1024:
-                final_folder = os.path.join(final_folder, 'Small')
-            elif size < 1024 * 1024 * 1024:
-                final_folder = os.path.join(final_folder, 'Medium')
-            else:
-                final_folder = os.path.join(final_folder, 'Large')
+# Function to work out the folder and name a file should get
+# Returns (final_folder, new_filename), or None when the date cannot be used
+# layout, a layout.Layout compiled once per run, replaces the organize options
+def plan_target(full_path, date_taken, dest_folder, year_only, day_only, month_only, rename_files, organize_by_type, organize_by_size, organize_by_name, size=None, layout=None):
+    # Without a compiled layout the organize options pick a preset one; presets are compiled once and reused
+    if layout is None:
+        layout = compile_layout(None, rename_files, year_only, day_only, month_only, organize_by_type, organize_by_size, organize_by_name)
+    try:
+        return layout.target(full_path, date_taken, dest_folder, size)
+    except ValueError as e:
+        file_logger.error(f"Invalid date format in {full_path}: {e}")
+        return None
 
-        # Organize by name if organize_by_name is True
-        if organize_by_name:
-            initial = filename[0].upper()
-            final_folder = os.path.join(final_folder, initial)
+# Default transfer strategy: reflinks where the file system allows them, in-kernel copies otherwise
+default_transfer = Transfer()
 
+# Function to move or copy a file to its target path
+# Copies keep the source's metadata like shutil.copy2 did, so maintain_metadata needs no extra copystat
+# An exclusive transfer raises TargetExistsError when the target name was taken by another process
+# With metrics, successful transfers are timed as the move or copy stage
+def transfer_file(full_path, target_path, move_files, delete_files, dry_run, rename_files, maintain_metadata, transfer=None, stat=None, metrics=None):
+    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    if transfer is None:
+        transfer = default_transfer
+    start = time.perf_counter()
+
+    # Move files if move_files is True
+    if move_files:
         if dry_run:
-            logger.info(f"Would create folder {final_folder}")
+            file_logger.info(f"Would move {full_path} to {target_path}")
         else:
             try:
-                os.makedirs(final_folder, exist_ok=True)
-            except PermissionError as e:
-                logger.error(f"Permission denied: {e}")
+                method = transfer.move(full_path, target_path, stat)
+                if metrics is not None:
+                    metrics.observe('move', time.perf_counter() - start, 0 if method == 'rename' else stat.st_size if stat else 0)
+                file_logger.info(f"Moved {full_path} to {target_path} ({method})")
+                result["moved"] += 1
+                if rename_files:
+                    result["renamed"] += 1
+            except TargetExistsError:
+                raise
+            except Exception as e:
+                file_logger.error(f"Error moving {full_path} to {target_path}: {e}")
                 return result
-
-        # Skip duplicate files if eliminate_duplicates is True
-        if eliminate_duplicates:
-            for root, dirs, files in os.walk(dest_folder):
-                for file in files:
-                    if compare_files(os.path.join(root, file), full_path):
-                        logger.info(f"Duplicate file {full_path} skipped")
-                        return result
-
-        # Skip existing files if skip_existing is True
-        if os.path.exists(os.path.join(final_folder, new_filename)):
-            if skip_existing:
-                logger.info(f"Skipping existing file {os.path.join(final_folder, new_filename)}")
+    else:
+        # Copy files if move_files is False
+        if dry_run:
+            file_logger.info(f"Would copy {full_path} to {target_path}")
+        else:
+            try:
+                method = transfer.copy(full_path, target_path, stat)
+                if metrics is not None:
+                    metrics.observe('copy', time.perf_counter() - start, stat.st_size if stat else 0)
+                file_logger.info(f"Copied {full_path} to {target_path} ({method})")
+                result["copied"] += 1
+                if rename_files:
+                    result["renamed"] += 1
+            except TargetExistsError:
+                raise
+            except Exception as e:
+                file_logger.error(f"Error copying {full_path} to {target_path}: {e}")
                 return result
-            i = 1
-            while os.path.exists(os.path.join(final_folder, f"{new_filename.split('.')[0]}({i}).{new_filename.split('.')[1]}")):
-                i += 1
-            new_filename = f"{new_filename.split('.')[0]}({i}).{new_filename.split('.')[1]}"
-
-        # Move files if move_files is True
-        if move_files:
-            if dry_run:
-                logger.info(f"Would move {full_path} to {os.path.join(final_folder, new_filename)}")
+
+    # Delete files if delete_files is True and move_files is False
+    if delete_files and not move_files:
+        if dry_run:
+            file_logger.info(f"Would delete {full_path}")
+        else:
+            try:
+                os.remove(full_path)
+                file_logger.info(f"Deleted {full_path}")
+                result["deleted"] += 1
+            except Exception as e:
+                file_logger.error(f"Error deleting {full_path}: {e}")
+
+    return result
+
+# Function to rename a copy streamed from origin (a scanner.ScanEntry) into place, counted as origin's operation
+# When moving or deleting, origin is removed only once the placed copy reads back with the hash its bytes were
+# streamed with (see staging.Stager), and only if origin has not changed since it was read; a copy that reads
+# back differently is removed again and the operation fails, so a resumed run tries it anew
+def place_streamed(staged, origin, target_path, move_files, delete_files, rename_files, maintain_metadata, transfer=None, metrics=None):
+    staged_stat = os.stat(staged)
+    expected = hash_engine.known(staged_stat)
+    result = transfer_file(staged, target_path, True, False, False, rename_files, maintain_metadata, transfer, staged_stat, metrics)
+    if not result["moved"]:
+        return result
+    result = dict(result, moved=0, copied=1)
+    if not (move_files or delete_files):
+        return result
+    try:
+        if expected is None or hash_file(target_path, hash_engine.algorithm) != expected:
+            file_logger.error(f"Keeping {origin.path}: its copy {target_path} does not match the data read from it")
+            os.remove(target_path)
+            return {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+        current = os.stat(origin.path)
+        if (current.st_size, current.st_mtime_ns) != (origin.st_size, origin.st_mtime_ns):
+            file_logger.warning(f"Keeping {origin.path}: it changed while it was copied to {target_path}")
+            return result
+        os.remove(origin.path)
+    except OSError as e:
+        file_logger.error(f"Error deleting {origin.path}: {e}")
+        return result
+    file_logger.info(f"Deleted {origin.path} after verifying its copy {target_path}")
+    return dict(result, moved=1, copied=0) if move_files else dict(result, deleted=1)
+
+# Function to move or copy a file to its planned target
+# Target names are reserved in memory by reserver, so collisions never need os.path.exists probes;
+# in a dry run with a plan_writer the operation is recorded instead of performed
+# near_index, a perceptual.NearDuplicateIndex, catches resized or re-encoded copies of images already placed
+# origin, the scanner.ScanEntry a staged full_path was streamed from, is what the operation is journaled and
+# counted as; see place_streamed
+def place_file(full_path, final_folder, new_filename, move_files, delete_files, dry_run, rename_files, skip_existing, maintain_metadata, eliminate_duplicates, dest_index=None, stat=None, reserver=None, plan_writer=None, journal=None, transfer=None, metrics=None, near_index=None, origin=None):
+    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    if reserver is None:
+        reserver = NameReserver()
+    if stat is None:
+        try:
+            stat = os.stat(full_path)
+        except OSError as e:
+            file_logger.error(f"Unable to stat {full_path}: {e}")
+            if near_index is not None:
+                near_index.discard(full_path)
+            return result
+
+    # Skip duplicate files if eliminate_duplicates is True
+    claimed = False
+    if eliminate_duplicates and dest_index is not None:
+        try:
+            if metrics is not None:
+                with metrics.timer('dedupe'):
+                    duplicate, hashes = dest_index.claim(full_path, stat)
             else:
-                try:
-                    shutil.move(full_path, os.path.join(final_folder, new_filename))
-                    logger.info(f"Moved {full_path} to {os.path.join(final_folder, new_filename)}")
-                    result["moved"] += 1
-                    if rename_files:
-                        result["renamed"] += 1
-                except Exception as e:
-                    logger.error(f"Error moving {full_path} to {os.path.join(final_folder, new_filename)}: {e}")
+                duplicate, hashes = dest_index.claim(full_path, stat)
+        except OSError as e:
+            file_logger.error(f"Error checking {full_path} for duplicates: {e}")
+            if near_index is not None:
+                near_index.discard(full_path)
+            return result
+        if duplicate is not None:
+            file_logger.info(f"Duplicate file {full_path} skipped (same as {duplicate})")
+            if metrics is not None:
+                metrics.count('duplicates')
+            if near_index is not None:
+                near_index.discard(full_path)
+            return result
+        claimed = True
+
+    # Look for near-duplicates: the same picture resized or re-encoded
+    fingerprint = None
+    superseded = None
+    if near_index is not None:
+        if metrics is not None:
+            with metrics.timer('perceptual'):
+                match, fingerprint = near_index.claim(full_path)
         else:
-            # Copy files if move_files is False
-            if dry_run:
-                logger.info(f"Would copy {full_path} to {os.path.join(final_folder, new_filename)}")
+            match, fingerprint = near_index.claim(full_path)
+        if match is not None:
+            match_path, distance, width, height = match
+            if metrics is not None:
+                metrics.count('near_duplicates')
+            if near_index.policy == 'report':
+                file_logger.warning(f"Near-duplicate {full_path} ({fingerprint[1]}x{fingerprint[2]}) looks like {match_path} ({width}x{height}, distance {distance})")
+            elif near_index.policy == 'skip' or pixels(fingerprint) <= (width or 0) * (height or 0):
+                file_logger.info(f"Near-duplicate {full_path} skipped (looks like {match_path}, distance {distance})")
+                near_index.release(full_path, fingerprint)
+                if claimed:
+                    dest_index.release(stat.st_size)
+                return result
             else:
-                try:
-                    shutil.copy2(full_path, os.path.join(final_folder, new_filename))
-                    if maintain_metadata:
-                        shutil.copystat(full_path, os.path.join(final_folder, new_filename))
-                    logger.info(f"Copied {full_path} to {os.path.join(final_folder, new_filename)}")
-                    result["copied"] += 1
-                    if rename_files:
-                        result["renamed"] += 1
-                except Exception as e:
-                    logger.error(f"Error copying {full_path} to {os.path.join(final_folder, new_filename)}: {e}")
-
-        # Delete files if delete_files is True and move_files is False
-        if delete_files and not move_files:
-            if dry_run:
-                logger.info(f"Would delete {full_path}")
+                # keep-highest: this copy has more pixels, so it replaces the one already placed
+                superseded = match_path
+
+    # Reserve the target name; skip existing files if skip_existing is True
+    # Shards sharing the destination may take a name after the folder was listed; the name is then
+    # reserved again, which moves on to the next free one
+    while True:
+        reserved = reserver.reserve(final_folder, new_filename, skip_existing)
+        if reserved is None:
+            file_logger.info(f"Skipping existing file {os.path.join(final_folder, new_filename)}")
+            if metrics is not None:
+                metrics.count('skipped_existing')
+            if claimed:
+                dest_index.release(stat.st_size)
+            if fingerprint is not None:
+                near_index.release(full_path, fingerprint)
+            return result
+        target_path = os.path.join(final_folder, reserved)
+
+        if not reserver.ensure_folder(final_folder, dry_run):
+            reserver.release(final_folder, reserved)
+            if claimed:
+                dest_index.release(stat.st_size)
+            if fingerprint is not None:
+                near_index.release(full_path, fingerprint)
+            return result
+
+        if dry_run and plan_writer is not None:
+            plan_writer.add(full_path, target_path, stat.st_size, stat.st_mtime_ns)
+
+        # Journal the operation so an interrupted run can be resumed
+        operation_id = None
+        if journal is not None and not dry_run:
+            if origin is not None:
+                operation_id = journal.planned(origin.path, target_path, move_files, delete_files, origin)
+            else:
+                operation_id = journal.planned(full_path, target_path, move_files, delete_files, stat)
+            journal.record("started", operation_id)
+        try:
+            if origin is not None:
+                result = place_streamed(full_path, origin, target_path, move_files, delete_files, rename_files, maintain_metadata, transfer, metrics)
             else:
-                try:
-                    os.remove(full_path)
-                    logger.info(f"Deleted {full_path}")
-                    result["deleted"] += 1
-                except Exception as e:
-                    logger.error(f"Error deleting {full_path}: {e}")
+                result = transfer_file(full_path, target_path, move_files, delete_files, dry_run, rename_files, maintain_metadata, transfer, stat, metrics)
+        except TargetExistsError:
+            file_logger.debug(f"{target_path} was taken by another process; reserving another name")
+            if operation_id is not None:
+                journal.record("failed", operation_id)
+            continue
+        if operation_id is not None:
+            journal.record("completed" if result["moved"] or result["copied"] else "failed", operation_id)
+        break
+
+    # Record placed files in the destination index; a dry run records the source in their place
+    if claimed:
+        if dry_run:
+            dest_index.add(full_path, stat.st_size, hashes)
+        elif result["moved"] or result["copied"]:
+            dest_index.add(target_path, stat.st_size, hashes)
+        else:
+            dest_index.release(stat.st_size)
+    if fingerprint is not None:
+        if dry_run:
+            near_index.add(full_path, full_path, fingerprint)
+        elif result["moved"] or result["copied"]:
+            near_index.add(full_path, target_path, fingerprint)
+        else:
+            near_index.release(full_path, fingerprint)
+            superseded = None
+    if superseded is not None:
+        try:
+            set_aside = near_index.set_aside(superseded, dry_run)
+        except OSError as e:
+            file_logger.error(f"Unable to set aside {superseded}: {e}")
+        else:
+            if set_aside is not None:
+                file_logger.info(f"{'Would move' if dry_run else 'Moved'} lower-resolution {superseded} to {set_aside}")
+    if not dry_run and not (result["moved"] or result["copied"]):
+        reserver.release(final_folder, reserved)
+
+    return result
+
+# Function to describe a run's result in one line for the log
+def summarize(processed, result):
+    return f"{processed} files processed, " + ", ".join(f"{count} {operation}" for operation, count in result.items())
+
+# Function to apply a plan written by a dry run
+# The plan is decoded once: each target folder is created when its first operation is read, before that
+# operation is handed to the I/O threads; files whose source changed since planning are skipped
+# max_reads, max_writes and bytes_per_sec limit the I/O per device (see io_scheduler.IOScheduler)
+# metrics, a metrics.Metrics, gets the transfer timings
+def execute_plan(plan_path, io_workers=None, progress_callback=None, copy_mode='reflink', max_reads=None, max_writes=None, bytes_per_sec=None, metrics=None):
+    transfer = Transfer(copy_mode)
+    scheduler = IOScheduler(max_reads, max_writes, bytes_per_sec)
+    header, operations = read_plan(plan_path)
+    dest_device = device_of_path(header["dest_folder"])
+    total = count_plan(plan_path)
+    folders = set()
+    failed_folders = set()
+
+    def execute(operation):
+        source, target = operation["src"], operation["dst"]
+        if os.path.dirname(target) in failed_folders:
+            return None
+        try:
+            stat = os.stat(source)
+        except OSError as e:
+            file_logger.error(f"Planned source {source} is gone: {e}")
+            return None
+        if (stat.st_size, stat.st_mtime_ns) != (operation["size"], operation["mtime_ns"]):
+            file_logger.warning(f"Skipping {source}: it changed after the plan was made")
+            return None
+        if os.path.lexists(target):
+            file_logger.warning(f"Skipping {source}: {target} already exists")
+            return None
+        nbytes = 0 if header["move_files"] and stat.st_dev == dest_device else stat.st_size
+        with scheduler.slot(stat.st_dev, dest_device, nbytes):
+            return transfer_file(source, target, header["move_files"], header["delete_files"], False, header["rename_files"], header["maintain_metadata"], transfer, stat, metrics)
+
+    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    processed = 0
+    progress = ProgressThrottle(progress_callback)
+
+    def collect(file_result):
+        nonlocal processed
+        processed += 1
+        if file_result is not None:
+            for key in result:
+                result[key] += file_result[key]
+        progress.update(processed, total)
+
+    # Keep a bounded window of operations in flight rather than one future per file
+    io_workers = io_workers or default_io_workers()
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=io_workers) as executor:
+        for operation in operations:
+            folder = os.path.dirname(operation["dst"])
+            if folder not in folders:
+                folders.add(folder)
+                failed_folders.update(create_folders([folder]))
+            in_flight.append(executor.submit(execute, operation))
+            if len(in_flight) >= io_workers * 2:
+                collect(in_flight.popleft().result())
+        while in_flight:
+            collect(in_flight.popleft().result())
+    progress.finish(processed, total)
+
+    logger.info(f"Executed plan {plan_path}: {summarize(processed, result)}")
+    return result
+
+# Function to process a file
+def process_file(filename, dirpath, file_types, dest_folder, move_files, delete_files, dry_run, year_only, day_only, month_only, rename_files, skip_existing, maintain_metadata, organize_by_type, ignore_types, organize_by_size, organize_by_name, eliminate_duplicates, dest_index=None, metadata_cache=None):
+    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+
+    # If file is of the specified types and not of the ignored types
+    if filename.lower().endswith(tuple(file_types)) and not filename.lower().endswith(tuple(ignore_types)):
+        full_path = os.path.join(dirpath, filename)
+        date_taken = get_date_taken(full_path, metadata_cache)
+        target = plan_target(full_path, date_taken, dest_folder, year_only, day_only, month_only, rename_files, organize_by_type, organize_by_size, organize_by_name)
+        if target is None:
+            return result
+        result = place_file(full_path, target[0], target[1], move_files, delete_files, dry_run, rename_files, skip_existing, maintain_metadata, eliminate_duplicates, dest_index)
 
     return result
 
 # Function to organize files by date
-def organize_files_by_date(source_folder, dest_folder, move_files=True, delete_files=False, dry_run=False, year_only=False, day_only=False, month_only=False, rename_files=False, skip_existing=False, maintain_metadata=False, organize_by_type=False, ignore_types=[], organize_by_size=False, organize_by_name=False, eliminate_duplicates=False, progress_callback=None):
+# progress_callback(processed, estimated_total) is called at most every PROGRESS_INTERVAL seconds and once at the end
+# Metadata is extracted in metadata_workers processes (0 keeps it in this process) and
+# files are moved or copied by io_workers threads; see pipeline.OrganizePipeline
+# A dry run with plan_path writes the planned operations there for execute_plan to apply later
+# fused=True reads each file on another device than the destination once, streaming it to the destination while
+# it is hashed and then dating the copy, instead of reading it for its date, its hashes and the copy in turn
+# source_folder may also be a ZIP/TAR archive; archives in the source are organized member by member
+# without extracting them first (see archives.ArchiveReader). Members are not journaled or written to plans
+# copy_mode picks how copies are made: 'reflink', 'hardlink' or 'copy' (see transfer.COPY_MODES)
+# max_reads and max_writes cap concurrent reads and writes per device (spinning disks default to one),
+# bytes_per_sec throttles each device; see io_scheduler.IOScheduler
+# show_progress=False leaves out the tqdm progress bar
+# metrics (a metrics.Metrics, created when not given) collects per-stage timings and counters; they are
+# also written to metrics_json and metrics_prometheus when given. profile_path samples every thread of the
+# run, metadata worker processes included, with profiling.SamplingProfiler and writes the stacks there
+# layout_template, e.g. "{year}/{month:02}.{month_name}/{ext}", places files instead of the organize options
+# (see layout.FIELDS); rename_files still applies
+# near_duplicates ('skip', 'keep-highest' or 'report'; see perceptual.POLICIES) also compares images by
+# perceptual_hash ('phash' or 'dhash'), treating those within near_duplicate_threshold bits as the same picture
+# With journal_path every operation is journaled; resume=True first finishes (or, with rollback=True,
+# rolls back) the operations an interrupted run left in flight and then skips everything it completed
+# paths organizes just those files instead of walking the source; batches, an iterable of path lists,
+# organizes each list in turn in one run, so the journal, indexes, cache and worker processes are set up once
+def organize_files_by_date(source_folder, dest_folder, move_files=True, delete_files=False, dry_run=False, year_only=False, day_only=False, month_only=False, rename_files=False, skip_existing=False, maintain_metadata=False, organize_by_type=False, ignore_types=[], organize_by_size=False, organize_by_name=False, eliminate_duplicates=False, progress_callback=None, metadata_cache_path=DEFAULT_CACHE_PATH, metadata_workers=None, io_workers=None, queue_size=QUEUE_SIZE, plan_path=None, journal_path=None, resume=False, rollback=False, copy_mode='reflink', max_reads=None, max_writes=None, bytes_per_sec=None, show_progress=True, metrics=None, metrics_json=None, metrics_prometheus=None, profile_path=None, near_duplicates=None, near_duplicate_threshold=DEFAULT_THRESHOLD, perceptual_hash='phash', layout_template=None, fused=False, paths=None, batches=None, shard=None):
     if source_folder == dest_folder:
         logger.error("Source and destination folders cannot be the same.")
         return
 
-    # Define file types
-    file_types = ['.jpg', '.png', '.jpeg', '.mp4', '.avi', '.mov', '.mkv', '.dng', '.gif', '.bmp', '.heic', '.tiff', '.webp', '.raw', '.indd', '.ai', '.eps', '.pdf', '.svg', '.psd', '.flv', '.m2ts', '.mts', '.ts', '.m4v', '.wmv', '.ogv', '.3gp', '.3g2', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt', '.rtf', '.csv', '.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.wma']
-    total_files = sum([len(files) for r, d, files in os.walk(source_folder)])
-    progress_bar = tqdm(total=total_files, ncols=70)
+    file_types = FILE_TYPES
+
+    # Each shard only checks for duplicates among the files it sees, which covers every copy of a file
+    # only when the source is sliced by size
+    if eliminate_duplicates and shard is not None and shard.mode != 'size':
+        raise ValueError(f"Eliminating duplicates across shards requires shards by size, not by {shard.mode}")
+
+    # Compile the layout before touching any file, so a bad template fails the run up front
+    layout = compile_layout(layout_template, rename_files, year_only, day_only, month_only, organize_by_type, organize_by_size, organize_by_name)
 
+    # Shards share the destination, so placing a file must never replace one another shard just placed
+    transfer = Transfer(copy_mode, exclusive=shard is not None)
+    scheduler = IOScheduler(max_reads, max_writes, bytes_per_sec)
+    dest_device = device_of_path(dest_folder)
+    if metrics is None:
+        metrics = Metrics()
+
+    # Replay the journal of an interrupted run before anything else touches the files
+    completed = set()
+    next_id = 0
+    recovered = None
+    if resume and journal_path is not None and os.path.exists(journal_path):
+        redo = lambda source, target, move, delete, keep_metadata: transfer_file(source, target, move, delete, False, False, keep_metadata, transfer)
+        next_id, completed, recovered = recover_journal(journal_path, redo, rollback)
+        logger.info(f"Resuming: {len(completed)} files were already done")
+
+    # Scan stage: a single streaming walk, or just the given paths; the destination is pruned when it sits inside the source
+    # Archives found on the way are set aside and organized member by member once the loose files are done
+    # A shard (see shards.Shard) only sees its own slice of the source
+    scanner = Scanner(source_folder, file_types + list(ARCHIVE_EXTENSIONS), ignore_types, exclude=[dest_folder], shard=shard)
+    media_types = tuple(file_types)
+    archives = []
+    def loose_files(entries):
+        for entry in entries:
+            if is_archive(entry.path):
+                archives.append(entry.path)
+            elif entry.path.lower().endswith(media_types):
+                if (entry.path, entry.st_size, entry.st_mtime_ns) not in completed:
+                    yield entry
+
+    # Function to yield the scanned files of each batch: one for a run, one per path list of batches
+    def scanned_batches():
+        if batches is not None:
+            for batch in batches:
+                yield loose_files(scanner.entries(batch))
+        elif os.path.isfile(source_folder) and is_archive(source_folder):
+            if shard is None or shard.owns(source_folder, os.path.getsize(source_folder)):
+                archives.append(source_folder)
+            yield iter(())
+        else:
+            yield loose_files(scanner if paths is None else scanner.entries(paths))
+    progress_bar = None
+    if show_progress:
+        from tqdm import tqdm
+        progress_bar = tqdm(total=0, ncols=70)
+
+    # Work redone while recovering the journal counts towards this run
     result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    if recovered is not None:
+        result.update(recovered)
 
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = []
-        for dirpath, dirnames, filenames in os.walk(source_folder):
-            for filename in filenames:
-                futures.append(executor.submit(process_file, filename, dirpath, file_types, dest_folder, move_files, delete_files, dry_run, year_only, day_only, month_only, rename_files, skip_existing, maintain_metadata, organize_by_type, ignore_types, organize_by_size, organize_by_name, eliminate_duplicates))
+    # Index the destination once so duplicate checks are lookups instead of walks
+    dest_index = None
+    if eliminate_duplicates:
+        dest_index = DestinationIndex(dest_folder, hash_engine, in_memory=dry_run, filename=shard.sidecar_name(INDEX_FILENAME) if shard is not None else INDEX_FILENAME)
+        with metrics.timer('index_build'):
+            dest_index.build()
+    near_index = None
+    if near_duplicates is not None:
+        near_index = NearDuplicateIndex(dest_folder, perceptual_hash, near_duplicate_threshold, near_duplicates, metadata_workers, in_memory=dry_run, filename=shard.sidecar_name(PERCEPTUAL_INDEX_FILENAME) if shard is not None else PERCEPTUAL_INDEX_FILENAME)
+        with metrics.timer('index_build'):
+            near_index.build()
 
-        for future in concurrent.futures.as_completed(futures):
-            file_result = future.result()
-            progress_bar.update()
-            for key in result:
-                result[key] += file_result[key]
+    # Reuse dates extracted by earlier runs; pass metadata_cache_path=None to disable
+    metadata_cache = open_metadata_cache(metadata_cache_path)
 
-            if progress_callback is not None:
-                progress_callback()
+    # Target names are reserved in memory for the whole run
+    reserver = NameReserver()
+    plan_writer = None
+    if dry_run and plan_path is not None:
+        plan_writer = PlanWriter(plan_path, source_folder, dest_folder, move_files, delete_files, rename_files, maintain_metadata)
+    journal = None
+    if journal_path is not None and not dry_run:
+        journal = Journal(journal_path, {"source_folder": source_folder, "dest_folder": dest_folder, "maintain_metadata": maintain_metadata, "part_tag": transfer.part_tag}, append=resume, next_id=next_id)
+
+    def plan(entry, date_taken, source=None):
+        target = plan_target(entry.path, date_taken, dest_folder, year_only, day_only, month_only, rename_files, organize_by_type, organize_by_size, organize_by_name, entry.st_size, layout)
+        if target is None:
+            return None
+        # Images start hashing in batches now, while they wait for an I/O thread
+        if near_index is not None:
+            near_index.prefetch(entry.path)
+        return (entry.path,) + target + (entry,)
+
+    # Each operation holds a read slot on its source's device and a write slot on the destination's
+    def execute(task):
+        full_path, final_folder, new_filename, entry = task
+        nbytes = 0 if dry_run or (move_files and entry.st_dev == dest_device) else entry.st_size
+        with scheduler.slot(entry.st_dev, dest_device, nbytes):
+            return place_file(full_path, final_folder, new_filename, move_files, delete_files, dry_run, rename_files, skip_existing, maintain_metadata, eliminate_duplicates, dest_index, entry, reserver, plan_writer, journal, transfer, metrics, near_index)
+
+    # Streamed files are staged on the destination and hashed on the way, so duplicate checks never read
+    # them again and placed copies can be verified before their sources are removed
+    stager = None if dry_run else Stager(dest_folder, hash_engine, metrics, shard.sidecar_name(STAGING_FOLDER) if shard is not None else STAGING_FOLDER)
+
+    # Function to rename a staged copy into place
+    # A copy streamed from origin (the fused pass) is journaled and counted as origin's move, copy or delete;
+    # an archive member's copy has no source to remove or recover from, so it is not journaled and counts as copied
+    def place_staged(staged, target, origin=None):
+        try:
+            if origin is not None:
+                return place_file(staged, target[0], target[1], move_files, delete_files, False, rename_files, skip_existing, maintain_metadata, eliminate_duplicates, dest_index, os.stat(staged), reserver, plan_writer, journal, transfer, metrics, near_index, origin)
+            file_result = place_file(staged, target[0], target[1], True, False, False, rename_files, skip_existing, maintain_metadata, eliminate_duplicates, dest_index, os.stat(staged), reserver, None, None, transfer, metrics, near_index)
+        finally:
+            if os.path.lexists(staged):
+                os.remove(staged)
+        return dict(file_result, moved=0, copied=file_result["moved"] + file_result["copied"])
+
+    # Archive members are streamed into the staging folder and renamed into place
+    def place_member(member):
+        metrics.file(member.path, member.st_size, member.date_source)
+        target = plan_target(member.path, member.date_taken, dest_folder, year_only, day_only, month_only, rename_files, organize_by_type, organize_by_size, organize_by_name, member.st_size, layout)
+        if target is None:
+            if member.staged is not None:
+                os.remove(member.staged)
+            return None
+        if member.staged is None:
+            return place_file(member.path, target[0], target[1], False, False, True, rename_files, skip_existing, maintain_metadata, False, stat=member, reserver=reserver)
+        return place_staged(member.staged, target)
+
+    def ingest():
+        if not archives:
+            return
+        ignored = tuple(t.lower() for t in ignore_types if t)
+        wanted = lambda name: name.lower().endswith(media_types) and not (ignored and name.lower().endswith(ignored))
+        reader = ArchiveReader(stager, wanted, read_member_date)
+        for archive_path in archives:
+            logger.info(f"Organizing the members of {archive_path}")
+            for member in reader.members(archive_path):
+                yield place_member(member)
+
+    # Function to get a file's date from the metadata cache, or read it from path: the file or its staged copy
+    # Raises OSError when the file cannot be read, e.g. after it was removed
+    def cached_date(entry, path):
+        cached = metadata_cache.get(entry) if metadata_cache is not None else None
+        if cached is not None:
+            metrics.count('metadata_cache_hits')
+            date_taken, source = cached
+        else:
+            start = time.perf_counter()
+            date_taken, source = read_date_taken(path)
+            if source == 'mtime' and path != entry.path:
+                sidecar = read_sidecar_date(entry.path)
+                if sidecar is not None:
+                    date_taken, source = sidecar, 'sidecar'
+            metrics.observe('metadata', time.perf_counter() - start)
+            if metadata_cache is not None:
+                metadata_cache.put(entry, date_taken, source)
+        metrics.file(entry.path, entry.st_size, source)
+        return date_taken
+
+    # Fused pass: a file whose bytes have to cross devices is read once, each chunk feeding the staged copy
+    # and its hashes, and is then dated from the staged copy; files on the destination's device are renamed
+    # or cloned without reading them, so they take the usual steps
+    def fused_file(entry):
+        if stager is None or entry.st_dev == dest_device:
+            try:
+                task = plan(entry, cached_date(entry, entry.path))
+            except OSError as e:
+                file_logger.error(f"Error reading {entry.path}: {e}")
+                return None
+            return execute(task) if task is not None else None
+        with scheduler.slot(entry.st_dev, dest_device, entry.st_size):
+            try:
+                with open(entry.path, 'rb', buffering=0) as file:
+                    staged = stager.stage(file, entry.path, entry.st_mtime_ns)
+                shutil.copystat(entry.path, staged)
+            except OSError as e:
+                file_logger.error(f"Error reading {entry.path}: {e}")
+                return None
+            task = plan(entry, cached_date(entry, staged))
+            if task is None:
+                os.remove(staged)
+                return None
+            # The source goes once its copy is in place and verified, as after a copy between devices
+            return place_staged(staged, task[1:3], entry)
 
-    progress_bar.close()
+    # Function to run the fused pass over the scanned files with a bounded window of files in flight
+    def fused_run(entries):
+        workers = io_workers or default_io_workers()
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for entry in entries:
+                in_flight.append(executor.submit(fused_file, entry))
+                if len(in_flight) >= workers * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
 
+    # Operations waiting for a spinning disk are reordered by inode to cut seeks
+    order_key = lambda task: scheduler.order_key(task[3])
+    progress = ProgressThrottle(progress_callback)
+
+    # Instrument the run: the hash engine reports into metrics, and the profiler samples every thread
+    # of this process and of the metadata worker processes
+    metrics.start()
+    hash_engine.metrics = metrics
+    profiler = None
+    if profile_path is not None:
+        from profiling import SamplingProfiler
+        profiler = SamplingProfiler().start()
+    pipeline = OrganizePipeline(read_dates_taken, plan, execute, metadata_cache, metadata_workers, io_workers, queue_size, order_key=order_key, reorder_window=REORDER_WINDOW, metrics=metrics, profiler=profiler)
+    processed = 0
+    try:
+        for entries in scanned_batches():
+            for file_result in chain(fused_run(entries) if fused else pipeline.run(entries), ingest()):
+                processed += 1
+                # The total is an estimate until the scan finishes
+                total = max(scanner.estimated_total(), processed)
+                if progress_bar is not None:
+                    progress_bar.total = total
+                    progress_bar.update()
+                if file_result is not None:
+                    for key in result:
+                        result[key] += file_result[key]
+                progress.update(processed, total)
+            progress.finish(processed, max(scanner.estimated_total(), processed))
+            # Hashes memoized for this batch's files are not needed by the next one
+            archives.clear()
+            hash_engine.clear()
+    finally:
+        pipeline.close()
+        if progress_bar is not None:
+            progress_bar.close()
+        if dest_index is not None:
+            dest_index.close()
+        if near_index is not None:
+            near_index.close()
+        if metadata_cache is not None:
+            metadata_cache.close()
+        if plan_writer is not None:
+            plan_writer.close()
+        if journal is not None:
+            journal.close()
+        if stager is not None:
+            stager.close()
+        hash_engine.clear()
+        hash_engine.metrics = None
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(profile_path)
+        metrics.count('files', processed)
+        metrics.finish()
+        if metrics_json is not None:
+            metrics.write_json(metrics_json)
+        if metrics_prometheus is not None:
+            metrics.write_prometheus(metrics_prometheus)
+
+    logger.info(f"Organized {source_folder}{f' (shard {shard})' if shard is not None else ''} into {dest_folder}: {summarize(processed, result)}")
     return result
+
+# Function to organize a folder and then keep organizing whatever arrives in it until stop (a threading.Event) is set
+# Everything already there is organized first; after that only new or changed files are, once they have settled
+# (see watcher.Watcher). Files still being written when the watch begins wait until they settle too.
+# The whole watch is one organize_files_by_date run fed the settled files batch by batch, so it takes the
+# same options and returns the totals of the watch
+def watch_and_organize(source_folder, dest_folder, *args, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, stop=None, use_inotify=True, **options):
+    if source_folder == dest_folder:
+        logger.error("Source and destination folders cannot be the same.")
+        return
+    if not os.path.isdir(source_folder):
+        logger.error(f"Only folders can be watched: {source_folder}")
+        return
+
+    watcher = Watcher(source_folder, settle=settle, poll_interval=poll_interval, exclude=[dest_folder], use_inotify=use_inotify)
+    batches = watcher.batches(stop)
+    try:
+        return organize_files_by_date(source_folder, dest_folder, *args, batches=batches, **options)
+    finally:
+        batches.close()
+
+# Function to catalog a folder without moving anything, e.g. to report on it first
+# Dates are read as an organize run reads them, through the metadata cache and worker processes, but each
+# file only becomes a row of a catalog.Catalog: no plans, results or futures are kept per file.
+# With hash_duplicates, files of equal size are hashed, so the catalog knows the actual duplicates
+def catalog_folder(source_folder, ignore_types=[], metadata_cache_path=DEFAULT_CACHE_PATH, metadata_workers=None, queue_size=QUEUE_SIZE, progress_callback=None, hash_duplicates=False, exclude=(), shard=None, metrics=None):
+    # As when organizing, duplicate candidates are only complete within a shard sliced by size
+    if hash_duplicates and shard is not None and shard.mode != 'size':
+        raise ValueError(f"Hashing duplicates across shards requires shards by size, not by {shard.mode}")
+    catalog = Catalog()
+    if metrics is None:
+        metrics = Metrics()
+    scanner = Scanner(source_folder, FILE_TYPES, ignore_types, exclude=exclude, shard=shard)
+    metadata_cache = open_metadata_cache(metadata_cache_path)
+
+    # Planning a file only records it, with where its date came from, so the I/O stage never runs
+    def plan(entry, date_taken, source):
+        catalog.add_entry(entry, date_taken, source)
+        return None
+
+    pipeline = OrganizePipeline(read_dates_taken, plan, None, metadata_cache, metadata_workers, 1, queue_size, metrics=metrics)
+    progress = ProgressThrottle(progress_callback)
+    processed = 0
+    metrics.start()
+    hash_engine.metrics = metrics
+    try:
+        for _ in pipeline.run(scanner):
+            processed += 1
+            progress.update(processed, max(scanner.estimated_total(), processed))
+        progress.finish(processed, processed)
+        if hash_duplicates:
+            catalog.fill_hashes(hash_engine, chain.from_iterable(catalog.duplicate_candidates()))
+    finally:
+        pipeline.close()
+        if metadata_cache is not None:
+            metadata_cache.close()
+        hash_engine.clear()
+        hash_engine.metrics = None
+        metrics.count('files', processed)
+        metrics.finish()
+
+    logger.info(f"Cataloged {len(catalog)} files in {source_folder} using {catalog.memory_bytes()} bytes")
+    return catalog
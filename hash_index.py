@@ -0,0 +1,182 @@
+# Import necessary libraries
+import os
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Name of the index file kept inside the destination folder
+INDEX_FILENAME = '.pixjinx_index.sqlite'
+
+# Prefix shared by every index, sidecar and staging folder kept in the destination; they are never indexed
+SIDECAR_PREFIX = '.pixjinx_'
+
+# Bump when the layout of the index changes; older indexes are rebuilt
+SCHEMA_VERSION = 2
+
+# Number of index changes to batch before committing
+COMMIT_INTERVAL = 500
+
+# Persistent index of the destination folder keyed by size, then partial hash, then full hash
+# filename lets processes sharing a destination keep separate indexes (see shards.Shard)
+class DestinationIndex:
+    def __init__(self, dest_folder, hash_engine, in_memory=False, filename=INDEX_FILENAME):
+        self.dest_folder = dest_folder
+        self.hash_engine = hash_engine
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.changes = 0
+
+        if in_memory:
+            self.path = ':memory:'
+        else:
+            os.makedirs(dest_folder, exist_ok=True)
+            self.path = os.path.join(dest_folder, filename)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._check_schema()
+
+    # Drop indexes written with another layout or hash algorithm
+    def _check_schema(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        expected = {'schema': str(SCHEMA_VERSION), 'algorithm': self.hash_engine.algorithm, 'partial_size': str(self.hash_engine.partial_size)}
+        if meta != expected:
+            if meta:
+                logger.info(f"Rebuilding destination index {self.path}")
+            self.conn.execute('DROP TABLE IF EXISTS files')
+            self.conn.execute('DELETE FROM meta')
+            self.conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', expected.items())
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, partial TEXT, hash TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS files_size ON files (size)')
+        self.conn.commit()
+
+    # Bring the index in line with the destination folder with a single walk
+    def build(self):
+        with self.lock:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute('SELECT path, size, mtime_ns FROM files')}
+        seen = set()
+        updates = []
+        for root, dirs, files in os.walk(self.dest_folder):
+            dirs[:] = [folder for folder in dirs if not folder.startswith(SIDECAR_PREFIX)]
+            for file in files:
+                if file.startswith(SIDECAR_PREFIX):
+                    continue
+                full_path = os.path.join(root, file)
+                try:
+                    stat = os.stat(full_path)
+                except OSError as e:
+                    logger.error(f"Unable to index {full_path}: {e}")
+                    continue
+                rel_path = os.path.relpath(full_path, self.dest_folder)
+                seen.add(rel_path)
+                if known.get(rel_path) != (stat.st_size, stat.st_mtime_ns):
+                    updates.append((rel_path, stat.st_size, stat.st_mtime_ns))
+
+        stale = [(path,) for path in known if path not in seen]
+        with self.lock:
+            # Changed files lose their hashes and are re-hashed only when a same-size candidate shows up
+            self.conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime_ns, partial, hash) VALUES (?, ?, ?, NULL, NULL)', updates)
+            self.conn.executemany('DELETE FROM files WHERE path = ?', stale)
+            self.conn.commit()
+        logger.info(f"Indexed {len(seen)} destination files ({len(updates)} new or changed, {len(stale)} removed)")
+
+    # Function to get a hash of an indexed file, computing and storing it when missing
+    def _row_hash(self, rel_path, column, value):
+        if value is not None:
+            return value
+        path = os.path.join(self.dest_folder, rel_path)
+        try:
+            if column == 'partial':
+                value = self.hash_engine.partial_hash(path)
+            else:
+                value = self.hash_engine.full_hash(path)
+        except OSError as e:
+            logger.error(f"Unable to hash {path}: {e}")
+            return None
+        with self.lock:
+            self.conn.execute(f'UPDATE files SET {column} = ? WHERE path = ?', (value, rel_path))
+            self._changed(1)
+        return value
+
+    # Look up a duplicate of a source file among indexed files of the same size
+    def _find_duplicate(self, path, stat, hashes):
+        with self.lock:
+            rows = self.conn.execute('SELECT path, partial, hash FROM files WHERE size = ?', (stat.st_size,)).fetchall()
+        if not rows:
+            return None
+
+        hashes['partial'] = self.hash_engine.partial_hash(path, stat)
+        matching = [(rel_path, full) for rel_path, partial, full in rows if self._row_hash(rel_path, 'partial', partial) == hashes['partial']]
+        if not matching:
+            return None
+
+        hashes['hash'] = self.hash_engine.full_hash(path, stat)
+        for rel_path, full in matching:
+            if self._row_hash(rel_path, 'hash', full) == hashes['hash']:
+                return os.path.join(self.dest_folder, rel_path)
+        return None
+
+    # Look up a duplicate of a source file, reserving its size when none is found
+    # Returns the path of the duplicate (or None) and the hashes computed for the source file
+    # Files of the same size are claimed one at a time; the owner must call add() or release()
+    def claim(self, path, stat=None):
+        if stat is None:
+            stat = os.stat(path)
+
+        while True:
+            with self.lock:
+                event = self.pending.get(stat.st_size)
+                if event is None:
+                    self.pending[stat.st_size] = threading.Event()
+                    break
+            event.wait()
+
+        hashes = {}
+        try:
+            duplicate = self._find_duplicate(path, stat, hashes)
+        except Exception:
+            self.release(stat.st_size)
+            raise
+        if duplicate is not None:
+            self.release(stat.st_size)
+        return duplicate, hashes
+
+    # Record a placed file and release its size
+    # In a dry run the source path stands in for the file that would have been placed
+    # Hashes the engine already knows, such as those of a file hashed while it was streamed, are recorded too
+    def add(self, placed_path, size, hashes):
+        try:
+            stat = os.stat(placed_path)
+            rel_path = os.path.relpath(placed_path, self.dest_folder)
+            if rel_path.startswith(os.pardir):
+                rel_path = os.path.abspath(placed_path)
+            partial = hashes.get('partial') or self.hash_engine.known(stat, 'partial')
+            full = hashes.get('hash') or self.hash_engine.known(stat, 'full')
+            with self.lock:
+                self.conn.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, partial, hash) VALUES (?, ?, ?, ?, ?)', (rel_path, stat.st_size, stat.st_mtime_ns, partial, full))
+                self._changed(1)
+        finally:
+            self.release(size)
+
+    # Release a claimed size without placing a file
+    def release(self, size):
+        with self.lock:
+            event = self.pending.pop(size, None)
+        if event is not None:
+            event.set()
+
+    # Commit once enough changes have accumulated; the caller must hold the lock
+    def _changed(self, count):
+        self.changes += count
+        if self.changes >= COMMIT_INTERVAL:
+            self.conn.commit()
+            self.changes = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
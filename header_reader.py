@@ -0,0 +1,325 @@
+# Import necessary libraries
+import re
+import struct
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Number of bytes read up front; enough for the metadata of nearly every image
+HEAD_SIZE = 64 * 1024
+
+# EXIF tags holding the capture date, in order of preference
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_DATE_TIME_DIGITIZED = 0x9004
+
+# ISO-BMFF timestamps count seconds from midnight, January 1, 1904 (UTC)
+MP4_EPOCH = datetime(1904, 1, 1)
+
+# Top-level boxes a QuickTime file may start with when it has no ftyp box
+QUICKTIME_BOXES = (b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+
+# Valid EXIF date strings look like '2023:06:01 12:30:00'
+EXIF_DATE = re.compile(rb'(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})')
+
+# Random access reader that answers from the head of the file and seeks only beyond it
+class HeaderReader:
+    def __init__(self, file, head_size=HEAD_SIZE):
+        self.file = file
+        self.head = file.read(head_size)
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0:
+            raise ValueError(f"Invalid read of {length} bytes at {offset}")
+        end = offset + length
+        if end <= len(self.head):
+            return self.head[offset:end]
+        self.file.seek(offset)
+        data = self.file.read(length)
+        if len(data) != length:
+            raise ValueError(f"Unexpected end of file reading {length} bytes at {offset}")
+        return data
+
+    def unpack(self, fmt, offset):
+        return struct.unpack(fmt, self.read(offset, struct.calcsize(fmt)))
+
+# Function to iterate over the ISO-BMFF boxes between start and end as (type, payload offset, box end)
+def iter_boxes(reader, start, end=None):
+    offset = start
+    while end is None or offset + 8 <= end:
+        try:
+            size, box_type = reader.unpack('>I4s', offset)
+        except ValueError:
+            return
+        header = 8
+        if size == 1:
+            size = reader.unpack('>Q', offset + 8)[0]
+            header = 16
+        elif size == 0:
+            # The box runs to the end of its parent (or of the file)
+            if end is None:
+                reader.file.seek(0, 2)
+                size = reader.file.tell() - offset
+            else:
+                size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, offset + size
+        offset += size
+
+# Function to find the first box of a type among the children of a box
+def find_box(reader, box_type, start, end=None):
+    for child_type, payload, child_end in iter_boxes(reader, start, end):
+        if child_type == box_type:
+            return payload, child_end
+    return None
+
+# Function to check and normalize an EXIF date string
+def _clean_date(value):
+    match = EXIF_DATE.match(value)
+    if match is None or match.group(1) == b'0000' or match.group(2) == b'00' or match.group(3) == b'00':
+        return None
+    return match.group(0).decode('ascii')
+
+# Function to read the entries of a TIFF IFD as {tag: (type, count, value field offset)}
+def _read_ifd(reader, base, offset, order):
+    count = reader.unpack(order + 'H', base + offset)[0]
+    entries = {}
+    for i in range(count):
+        entry = base + offset + 2 + i * 12
+        tag, field_type, value_count = reader.unpack(order + 'HHI', entry)
+        entries[tag] = (field_type, value_count, entry + 8)
+    return entries
+
+# Function to read an ASCII tag from an IFD
+def _read_ascii(reader, base, entry, order):
+    field_type, count, field = entry
+    if field_type != 2 or count == 0:
+        return None
+    if count <= 4:
+        return reader.read(field, count)
+    return reader.read(base + reader.unpack(order + 'I', field)[0], count)
+
+# Function to read the capture date from a TIFF structure starting at base
+def _date_from_tiff(reader, base):
+    byte_order = reader.read(base, 2)
+    if byte_order == b'II':
+        order = '<'
+    elif byte_order == b'MM':
+        order = '>'
+    else:
+        raise ValueError("Not a TIFF header")
+    magic, ifd0 = reader.unpack(order + 'HI', base + 2)
+    # 42 is TIFF; Panasonic RW2 (0x55) and Olympus ORF (0x4F52, 0x5352) use the same layout
+    if magic not in (42, 0x55, 0x4F52, 0x5352):
+        raise ValueError(f"Unsupported TIFF variant {magic}")
+
+    entries = _read_ifd(reader, base, ifd0, order)
+    exif_ifd = entries.get(TAG_EXIF_IFD)
+    if exif_ifd is None:
+        return None
+    exif_entries = _read_ifd(reader, base, reader.unpack(order + 'I', exif_ifd[2])[0], order)
+    for tag in (TAG_DATE_TIME_ORIGINAL, TAG_DATE_TIME_DIGITIZED):
+        if tag in exif_entries:
+            value = _read_ascii(reader, base, exif_entries[tag], order)
+            if value is not None:
+                date_taken = _clean_date(value)
+                if date_taken is not None:
+                    return date_taken
+    return None
+
+# Function to read the capture date from an EXIF payload, with or without the 'Exif\0\0' prefix
+def _date_from_exif_payload(reader, offset):
+    if reader.read(offset, 6) == b'Exif\x00\x00':
+        offset += 6
+    return _date_from_tiff(reader, offset)
+
+# JPEG: walk the marker segments up to the first APP1 Exif segment
+def _date_from_jpeg(reader):
+    offset = 2
+    while True:
+        marker, segment_type = reader.unpack('BB', offset)
+        if marker != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        if segment_type == 0xFF:
+            offset += 1
+            continue
+        if segment_type in (0xD8, 0x01) or 0xD0 <= segment_type <= 0xD7:
+            offset += 2
+            continue
+        if segment_type in (0xDA, 0xD9):
+            return None
+        length = reader.unpack('>H', offset + 2)[0]
+        if segment_type == 0xE1 and reader.read(offset + 4, 6) == b'Exif\x00\x00':
+            return _date_from_tiff(reader, offset + 10)
+        offset += 2 + length
+
+# HEIC/HEIF/AVIF: locate the Exif item through meta/iinf and meta/iloc
+def _date_from_heif(reader):
+    meta = find_box(reader, b'meta', 0)
+    if meta is None:
+        return None
+    # meta is a full box: skip version and flags
+    meta_start, meta_end = meta[0] + 4, meta[1]
+
+    exif_item = None
+    iinf = find_box(reader, b'iinf', meta_start, meta_end)
+    if iinf is None:
+        return None
+    version = reader.read(iinf[0], 1)[0]
+    entries_start = iinf[0] + 4 + (2 if version == 0 else 4)
+    for box_type, payload, box_end in iter_boxes(reader, entries_start, iinf[1]):
+        if box_type != b'infe':
+            continue
+        infe_version = reader.read(payload, 1)[0]
+        if infe_version < 2:
+            continue
+        if infe_version == 2:
+            item_id, item_type = reader.unpack('>H2x4s', payload + 4)
+        else:
+            item_id, item_type = reader.unpack('>I2x4s', payload + 4)
+        if item_type == b'Exif':
+            exif_item = item_id
+            break
+    if exif_item is None:
+        return None
+
+    iloc = find_box(reader, b'iloc', meta_start, meta_end)
+    if iloc is None:
+        return None
+    offset = iloc[0]
+    version = reader.read(offset, 1)[0]
+    sizes = reader.unpack('>H', offset + 4)[0]
+    offset_size, length_size, base_offset_size = sizes >> 12, (sizes >> 8) & 0xF, (sizes >> 4) & 0xF
+    index_size = sizes & 0xF if version in (1, 2) else 0
+    offset += 6
+
+    def read_uint(position, size):
+        if size == 0:
+            return 0, position
+        fmt = {4: '>I', 8: '>Q'}.get(size)
+        if fmt is None:
+            raise ValueError(f"Unsupported iloc field size {size}")
+        return reader.unpack(fmt, position)[0], position + size
+
+    if version < 2:
+        item_count, offset = reader.unpack('>H', offset)[0], offset + 2
+    else:
+        item_count, offset = reader.unpack('>I', offset)[0], offset + 4
+    for _ in range(item_count):
+        if version < 2:
+            item_id, offset = reader.unpack('>H', offset)[0], offset + 2
+        else:
+            item_id, offset = reader.unpack('>I', offset)[0], offset + 4
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, offset = reader.unpack('>H', offset)[0] & 0xF, offset + 2
+        offset += 2
+        base_offset, offset = read_uint(offset, base_offset_size)
+        extent_count, offset = reader.unpack('>H', offset)[0], offset + 2
+        extents = []
+        for _ in range(extent_count):
+            offset += index_size
+            extent_offset, offset = read_uint(offset, offset_size)
+            extent_length, offset = read_uint(offset, length_size)
+            extents.append((extent_offset, extent_length))
+        if item_id != exif_item:
+            continue
+        if construction_method != 0 or not extents:
+            raise ValueError("Exif item is not stored at a file offset")
+        start = base_offset + extents[0][0]
+        # The item starts with the offset of the TIFF header within it
+        tiff_offset = reader.unpack('>I', start)[0]
+        return _date_from_exif_payload(reader, start + 4 + tiff_offset)
+    return None
+
+# WebP: walk the RIFF chunks looking for EXIF
+def _date_from_webp(reader):
+    riff_end = 8 + reader.unpack('<I', 4)[0]
+    offset = 12
+    while offset + 8 <= riff_end:
+        chunk_type, size = reader.unpack('<4sI', offset)
+        if chunk_type == b'EXIF':
+            return _date_from_exif_payload(reader, offset + 8)
+        offset += 8 + size + (size & 1)
+    return None
+
+# PNG: walk the chunks before the image data looking for eXIf
+def _date_from_png(reader):
+    offset = 8
+    while True:
+        size, chunk_type = reader.unpack('>I4s', offset)
+        if chunk_type == b'eXIf':
+            return _date_from_exif_payload(reader, offset + 8)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        offset += 12 + size
+
+# Function to pick the parser for a file from its leading bytes
+def _header_parser(head):
+    if head.startswith(b'\xff\xd8'):
+        return _date_from_jpeg
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'IIU\x00', b'IIRO', b'IIRS'):
+        return lambda reader: _date_from_tiff(reader, 0)
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'):
+        return _date_from_heif
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _date_from_webp
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return _date_from_png
+    return None
+
+# Function to read the EXIF capture date of an image with a few small reads
+# Returns (date, parsed): parsed is False when the format is not one this reader understands,
+# in which case the caller should fall back to a full decoder
+def read_exif_date(path):
+    with open(path, 'rb') as file:
+        return exif_date_from_file(file, path)
+
+# Function to read the EXIF capture date from an open binary file, such as an archive member; name is for the log
+def exif_date_from_file(file, name):
+    reader = HeaderReader(file)
+    parser = _header_parser(reader.head)
+    if parser is None:
+        return None, False
+    try:
+        return parser(reader), True
+    except (ValueError, IndexError, struct.error) as e:
+        logger.debug(f"Unable to parse EXIF header of {name}: {e}")
+        return None, False
+
+# Function to read the creation time of an MP4/MOV/3GP file from moov/mvhd
+# Top-level boxes are skipped by seeking, so files with moov at the end cost a few extra small reads
+# Returns (date, parsed) like read_exif_date
+def read_video_date(path):
+    with open(path, 'rb') as file:
+        return video_date_from_file(file, path)
+
+# Function to read the creation time of a movie from an open binary file; name is for the log
+def video_date_from_file(file, name):
+    reader = HeaderReader(file, head_size=4096)
+    if reader.head[4:8] != b'ftyp' and reader.head[4:8] not in QUICKTIME_BOXES:
+        return None, False
+    try:
+        moov = find_box(reader, b'moov', 0)
+        if moov is None:
+            return None, False
+        mvhd = find_box(reader, b'mvhd', *moov)
+        if mvhd is None:
+            return None, False
+        version = reader.read(mvhd[0], 1)[0]
+        if version == 1:
+            creation_time = reader.unpack('>Q', mvhd[0] + 4)[0]
+        else:
+            creation_time = reader.unpack('>I', mvhd[0] + 4)[0]
+    except (ValueError, IndexError, struct.error) as e:
+        logger.debug(f"Unable to parse movie header of {name}: {e}")
+        return None, False
+    # Zero means the muxer did not record a time
+    if creation_time == 0:
+        return None, True
+    try:
+        return MP4_EPOCH + timedelta(seconds=creation_time), True
+    except OverflowError:
+        return None, True
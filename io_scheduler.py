@@ -0,0 +1,133 @@
+# Import necessary libraries
+import os
+import sys
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Concurrent reads and writes allowed on a spinning disk unless configured otherwise; more just adds seeks
+ROTATIONAL_LIMIT = 1
+
+# Number of planned operations the I/O stage may reorder at once on rotational media
+REORDER_WINDOW = 256
+
+# Function to get the device of a path, using its nearest existing ancestor if it does not exist yet
+def device_of_path(path):
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+# Function to check whether a device is a spinning disk
+# Returns True or False on Linux when sysfs knows the device, None when it cannot tell (network shares, other platforms)
+def is_rotational(device):
+    if not sys.platform.startswith('linux'):
+        return None
+    block = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    # A partition has no queue of its own; its parent disk does
+    for folder in (block, os.path.join(block, '..')):
+        try:
+            with open(os.path.join(folder, 'queue', 'rotational')) as file:
+                return file.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+# Token bucket limiting the bytes per second moved through one device
+# A transfer larger than a second's worth runs into debt that later transfers wait off
+class Throttle:
+    def __init__(self, bytes_per_sec):
+        self.rate = bytes_per_sec
+        self.lock = threading.Lock()
+        self.allowance = bytes_per_sec
+        self.last = time.monotonic()
+
+    # Function to take nbytes from the bucket, sleeping until they are allowed
+    def consume(self, nbytes):
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= nbytes
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+# Per-device I/O scheduler: limits concurrent reads and writes on each device and optionally their bandwidth
+# max_reads / max_writes: concurrent operations reading from / writing to one device; None picks
+#   ROTATIONAL_LIMIT for spinning disks and leaves other devices to the I/O thread pool
+# bytes_per_sec: bandwidth allowed through each device, or None for no throttle
+class IOScheduler:
+    def __init__(self, max_reads=None, max_writes=None, bytes_per_sec=None):
+        self.max_reads = max_reads
+        self.max_writes = max_writes
+        self.bytes_per_sec = bytes_per_sec
+        self.lock = threading.Lock()
+        self.rotational = {}
+        self.read_slots = {}
+        self.write_slots = {}
+        self.throttles = {}
+
+    # Function to check (once per device) whether a device is a spinning disk
+    def _is_rotational(self, device):
+        with self.lock:
+            if device not in self.rotational:
+                self.rotational[device] = is_rotational(device)
+                logger.debug(f"Device {device} rotational: {self.rotational[device]}")
+            return self.rotational[device]
+
+    # Semaphore limiting one kind of access to a device, or None when it is unlimited
+    def _slots(self, slots, device, limit):
+        rotational = self._is_rotational(device)
+        with self.lock:
+            if device not in slots:
+                if limit is None and rotational:
+                    limit = ROTATIONAL_LIMIT
+                slots[device] = threading.BoundedSemaphore(limit) if limit else None
+            return slots[device]
+
+    def _throttle(self, device):
+        with self.lock:
+            if device not in self.throttles:
+                self.throttles[device] = Throttle(self.bytes_per_sec)
+            return self.throttles[device]
+
+    # Sort key ordering operations to cut seeks: by device, then by inode on spinning disks
+    # Inode numbers roughly follow on-disk layout; other devices keep the order they were planned in
+    def order_key(self, stat):
+        if self._is_rotational(stat.st_dev):
+            return (stat.st_dev, stat.st_ino)
+        return (stat.st_dev, 0)
+
+    # Context manager holding a read slot on the source device and a write slot on the target device
+    # nbytes is what the operation will move through both devices (0 for a rename)
+    # Read slots are always taken before write slots, so operations cannot deadlock each other
+    @contextmanager
+    def slot(self, source_device, target_device, nbytes=0):
+        if self.bytes_per_sec and nbytes:
+            self._throttle(source_device).consume(nbytes)
+            if target_device != source_device:
+                self._throttle(target_device).consume(nbytes)
+        read = self._slots(self.read_slots, source_device, self.max_reads)
+        write = self._slots(self.write_slots, target_device, self.max_writes)
+        if read is not None:
+            read.acquire()
+        try:
+            if write is not None:
+                write.acquire()
+            try:
+                yield
+            finally:
+                if write is not None:
+                    write.release()
+        finally:
+            if read is not None:
+                read.release()
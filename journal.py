@@ -0,0 +1,179 @@
+# Import necessary libraries
+import os
+import json
+import shutil
+import time
+import threading
+import logging
+from transfer import part_path
+
+logger = logging.getLogger(__name__)
+
+# Records are fsynced in batches: at most this many records or this many seconds apart
+FSYNC_BATCH = 256
+FSYNC_INTERVAL = 0.5
+
+# Function to end a journal a crash left with a torn last line, so appended records start on a line of their own
+def _terminate_last_line(path):
+    with open(path, 'rb+') as file:
+        file.seek(0, os.SEEK_END)
+        if file.tell() == 0:
+            return
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b'\n':
+            file.write(b'\n')
+
+# Append-only journal of the operations of a run, written as JSON Lines
+# Each operation is logged as planned, started and then completed (or failed)
+class Journal:
+    def __init__(self, path, options, append=False, next_id=0):
+        self.path = path
+        self.lock = threading.Lock()
+        if append and os.path.exists(path):
+            _terminate_last_line(path)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8')
+        self.next_id = next_id
+        self.unsynced = 0
+        self.closed = threading.Event()
+        self._write({"event": "run", "time": time.time(), **options})
+        self._sync()
+        self.flusher = threading.Thread(target=self._flush_periodically, name="journal-flusher", daemon=True)
+        self.flusher.start()
+
+    # Write a record; the caller must hold the lock unless no other thread can be writing
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.unsynced += 1
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def _flush_periodically(self):
+        while not self.closed.wait(FSYNC_INTERVAL):
+            with self.lock:
+                if self.unsynced:
+                    self._sync()
+
+    # Function to append a record, syncing once a batch has built up
+    def record(self, event, operation_id, **fields):
+        with self.lock:
+            self._write({"event": event, "id": operation_id, **fields})
+            if self.unsynced >= FSYNC_BATCH:
+                self._sync()
+
+    # Function to log a planned operation and return its id
+    def planned(self, source, target, move, delete, stat):
+        with self.lock:
+            operation_id = self.next_id
+            self.next_id += 1
+        self.record("planned", operation_id, src=source, dst=target, move=move, delete=delete, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        return operation_id
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        with self.lock:
+            self._write({"event": "finished", "time": time.time()})
+            self._sync()
+            self.file.close()
+
+# Function to read a journal
+# Returns the next free operation id, the operations that never completed (with their run's options)
+# and the set of (source, size, mtime_ns) of completed operations
+def read_journal(path):
+    options = {}
+    operations = {}
+    completed = set()
+    next_id = 0
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line torn by a crash; the records around it are intact
+                logger.warning(f"Ignoring damaged journal record in {path}")
+                continue
+            event = record.get("event")
+            if event == "run":
+                options = {key: value for key, value in record.items() if key not in ("event", "time")}
+            elif event == "planned":
+                record["options"] = options
+                operations[record["id"]] = record
+                next_id = max(next_id, record["id"] + 1)
+            elif event in ("completed", "failed"):
+                operation = operations.pop(record["id"], None)
+                if operation is not None and event == "completed":
+                    completed.add((operation["src"], operation["size"], operation["mtime_ns"]))
+    return next_id, list(operations.values()), completed
+
+# Function to finish or roll back one operation a crash left in flight
+# transfer(source, target, move, delete, maintain_metadata) performs the operation again and returns its
+# result counts. Returns (completed, result): whether the operation ended up completed, and what recovering
+# it did, counted like a run's result
+def recover_operation(operation, transfer, rollback=False):
+    source, target = operation["src"], operation["dst"]
+    result = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    # Only the interrupted run's own part file is touched; other processes sharing the destination may be
+    # writing theirs next to it
+    part = part_path(target, operation["options"].get("part_tag"))
+    source_exists = os.path.lexists(source)
+
+    if os.path.lexists(target):
+        # The operation finished but its completion was not synced; only a copy's delete step may be missing
+        if operation["delete"] and not operation["move"] and source_exists and not rollback:
+            os.remove(source)
+            logger.info(f"Recovered: deleted {source}")
+            result["deleted"] += 1
+        return True, result
+
+    if os.path.lexists(part):
+        if source_exists:
+            # Interrupted copy: the partial file is worthless either way
+            os.remove(part)
+            logger.info(f"Recovered: removed partial copy {part}")
+        elif rollback:
+            # A cross-device move removed the source after copying; put the file back
+            shutil.move(part, source)
+            logger.info(f"Rolled back: restored {source}")
+            return False, result
+        else:
+            os.replace(part, target)
+            logger.info(f"Recovered: completed {target}")
+            result["moved"] += 1
+            return True, result
+
+    if rollback:
+        return False, result
+    if not source_exists:
+        logger.error(f"Cannot recover operation {operation['id']}: neither {source} nor {target} exists")
+        return False, result
+    result = transfer(source, target, operation["move"], operation["delete"], operation["options"].get("maintain_metadata", False))
+    return os.path.lexists(target), result
+
+# Function to replay a journal after a crash, finishing (or rolling back) every in-flight operation
+# Returns the next free operation id and the completed set as read_journal does, and the result counts
+# of the work recovery did
+def recover_journal(path, transfer, rollback=False):
+    next_id, pending, completed = read_journal(path)
+    recovered = {"moved": 0, "copied": 0, "renamed": 0, "deleted": 0}
+    if pending:
+        logger.info(f"Recovering {len(pending)} interrupted operations from {path}")
+    _terminate_last_line(path)
+    with open(path, 'a', encoding='utf-8') as file:
+        for operation in pending:
+            try:
+                done, result = recover_operation(operation, transfer, rollback)
+                for key in recovered:
+                    recovered[key] += result[key]
+            except OSError as e:
+                logger.error(f"Error recovering operation {operation['id']}: {e}")
+                done = False
+            event = "completed" if done else "failed"
+            file.write(json.dumps({"event": event, "id": operation["id"]}) + '\n')
+            if done:
+                completed.add((operation["src"], operation["size"], operation["mtime_ns"]))
+        file.flush()
+        os.fsync(file.fileno())
+    return next_id, completed, recovered
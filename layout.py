@@ -0,0 +1,146 @@
+# Import necessary libraries
+import os
+import string
+from datetime import datetime
+from functools import lru_cache
+
+# Fields a layout template can use, with an example value each; the examples also validate format specs
+# Dates come from the date taken: year, month and day are numbers, so "{month:02}" pads them
+FIELDS = {
+    'year': 2021,
+    'month': 7,
+    'day': 4,
+    'month_name': 'July',
+    'hour': 10,
+    'minute': 30,
+    'second': 0,
+    'time': '10_30_00',
+    'stem': 'IMG_0001',
+    'ext': 'jpg',
+    'suffix': '.jpg',
+    'initial': 'I',
+    'size_class': 'Small',
+}
+
+# Fields that only depend on the date taken
+DATE_FIELDS = ('year', 'month', 'day', 'month_name', 'hour', 'minute', 'second', 'time')
+
+# Size classes: (upper bound in bytes, name); anything larger is 'Large'
+SIZE_CLASSES = ((1024 * 1024, 'Small'), (1024 * 1024 * 1024, 'Medium'))
+
+# Month names in the current locale, looked up once instead of through strftime('%B') per file
+MONTH_NAMES = [datetime(2000, month, 1).strftime('%B') for month in range(1, 13)]
+
+# Name template used by the rename option: 04_July_10_30_00.jpg
+RENAME_TEMPLATE = '{day:02}_{month_name}_{time}{suffix}'
+
+# Largest number of rendered folders kept per layout; most runs only see a few thousand distinct ones
+RENDER_CACHE_SIZE = 65536
+
+# Function to get a file's size class
+def size_class(size):
+    for limit, name in SIZE_CLASSES:
+        if size < limit:
+            return name
+    return 'Large'
+
+# Format template checked once up front; renderings are memoized by the values of the fields it uses
+class Template:
+    def __init__(self, template):
+        self.template = template
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if field is None:
+                continue
+            if field not in FIELDS:
+                raise ValueError(f"Unknown layout field {{{field}}} in {template!r}; expected one of {', '.join(FIELDS)}")
+            if field not in self.fields:
+                self.fields.append(field)
+        # Formatting the examples catches bad format specs before any file is touched
+        try:
+            template.format_map(FIELDS)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid layout template {template!r}: {e}")
+        self.cache = {}
+
+    def render(self, values):
+        key = tuple(values[field] for field in self.fields)
+        rendered = self.cache.get(key)
+        if rendered is None:
+            if len(self.cache) >= RENDER_CACHE_SIZE:
+                self.cache.clear()
+            rendered = self.cache[key] = self.template.format_map(values)
+        return rendered
+
+# Destination layout: a folder template below the destination and an optional file name template,
+# compiled once per run. Only the fields the templates use are computed, and dates are parsed once per distinct day
+class Layout:
+    def __init__(self, folder_template, name_template=None):
+        self.folder = Template(folder_template)
+        # Templates may use '/' on every platform; empty components (such as a missing extension) are dropped
+        parts = folder_template.replace('\\', '/').split('/')
+        if folder_template.startswith(('/', '\\')) or os.pardir in parts:
+            raise ValueError(f"Layout template {folder_template!r} must stay inside the destination folder")
+        self.name = Template(name_template) if name_template else None
+        if self.name is not None and ('/' in name_template or '\\' in name_template):
+            raise ValueError(f"Name template {name_template!r} cannot contain folders")
+        self.fields = set(self.folder.fields) | set(self.name.fields if self.name is not None else ())
+        self.dates = {}
+        self.folders = {}
+
+    # Function to parse a 'YYYY:MM:DD HH:MM:SS' date into its fields, validating each day once
+    # Raises ValueError for malformed dates
+    def _date_fields(self, date_taken):
+        date, time = date_taken.split(' ')
+        fields = self.dates.get(date)
+        if fields is None:
+            year, month, day = date.split(':')
+            # Building the datetime rejects dates such as February 30th
+            datetime(year=int(year), month=int(month), day=int(day))
+            fields = self.dates[date] = {'year': int(year), 'month': int(month), 'day': int(day), 'month_name': MONTH_NAMES[int(month) - 1]}
+        fields = dict(fields, time=time.replace(':', '_'))
+        if self.fields.intersection(('hour', 'minute', 'second')):
+            fields['hour'], fields['minute'], fields['second'] = (int(part) for part in time.split(':'))
+        return fields
+
+    # Function to plan where a file goes: returns (folder, file name)
+    # size is only needed (and only read from disk when missing) if the template uses size_class
+    def target(self, full_path, date_taken, dest_folder, size=None):
+        filename = os.path.basename(full_path)
+        values = self._date_fields(date_taken) if self.fields.intersection(DATE_FIELDS) else {}
+        stem, suffix = os.path.splitext(filename)
+        values.update(stem=stem, suffix=suffix, ext=suffix[1:], initial=filename[:1].upper())
+        if 'size_class' in self.fields:
+            values['size_class'] = size_class(size if size is not None else os.path.getsize(full_path))
+
+        relative = self.folder.render(values)
+        folder = self.folders.get((dest_folder, relative))
+        if folder is None:
+            folder = os.path.join(dest_folder, *[part for part in relative.replace('\\', '/').split('/') if part])
+            if len(self.folders) >= RENDER_CACHE_SIZE:
+                self.folders.clear()
+            self.folders[(dest_folder, relative)] = folder
+        return folder, self.name.render(values) if self.name is not None else filename
+
+# Function to build the folder template equivalent to the organize options
+def preset_template(year_only=False, day_only=False, month_only=False, organize_by_type=False, organize_by_size=False, organize_by_name=False):
+    parts = ['{year}']
+    if not year_only:
+        parts.append('{month:02}.{month_name}')
+    if not month_only:
+        if day_only:
+            parts.append('{day:02}')
+        if organize_by_type:
+            parts.append('{ext}')
+    if organize_by_size:
+        parts.append('{size_class}')
+    if organize_by_name:
+        parts.append('{initial}')
+    return '/'.join(parts)
+
+# Function to compile a layout once per run; a template given as None uses the preset for the organize options
+@lru_cache(maxsize=64)
+def compile_layout(template=None, rename_files=False, year_only=False, day_only=False, month_only=False, organize_by_type=False, organize_by_size=False, organize_by_name=False):
+    if template is None:
+        template = preset_template(year_only, day_only, month_only, organize_by_type, organize_by_size, organize_by_name)
+    return Layout(template, RENAME_TEMPLATE if rename_files else None)
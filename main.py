@@ -1,35 +1,185 @@
 # Import necessary modules
 import time
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QCheckBox, QLineEdit, QFileDialog, QLabel, QMessageBox, QProgressBar, QGroupBox, QHBoxLayout, QTextEdit, QTabWidget, QGridLayout, QSpacerItem, QSizePolicy
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QPushButton, QCheckBox, QLineEdit, QFileDialog, QLabel, QMessageBox, QProgressBar, QGroupBox, QHBoxLayout, QTextEdit, QPlainTextEdit, QTabWidget, QGridLayout, QSpacerItem, QSizePolicy, QTreeView
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import QThread, pyqtSignal, QObject
-from file_organizer import organize_files_by_date
+from PyQt5.QtCore import QThread, pyqtSignal, QObject, QTimer, Qt, QAbstractItemModel, QModelIndex
+from file_organizer import organize_files_by_date, setup_logging, set_verbosity, LOG_FORMAT
+from metrics import Metrics
+from layout import compile_layout, preset_template
+from plan_tree import PlanTree, PlanFolder
+from collections import deque
+import threading
+import tempfile
 import logging
 import os 
 
-# Custom logging handler that emits logs to a QTextEdit widget
-class QTextEditLogger(logging.Handler, QObject):
-    append_signal = pyqtSignal(str)
+# Number of log lines the log view keeps
+LOG_LINES = 5000
+
+# Milliseconds between log view updates
+LOG_REFRESH_MS = 200
+
+# Number of files the preview reads from the plan at a time, as a folder is expanded or scrolled
+PREVIEW_BATCH = 256
+
+# Function to format a byte count for display
+def format_size(nbytes):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if nbytes < 1024 or unit == 'TB':
+            return f"{nbytes} {unit}" if unit == 'B' else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
 
+# Custom logging handler that shows logs in a QPlainTextEdit widget
+# Lines are buffered and appended in one batch per timer tick; the view keeps only the last LOG_LINES
+class QTextEditLogger(logging.Handler, QObject):
     def __init__(self, parent):
         super().__init__()
         QObject.__init__(self)
-        self.widget = QTextEdit(parent)
+        self.widget = QPlainTextEdit(parent)
         self.widget.setReadOnly(True)
-        self.append_signal.connect(self.widget.append)
+        self.widget.setMaximumBlockCount(LOG_LINES)
+        self.pending = deque(maxlen=LOG_LINES)
+        self.dropped = 0
+        self.buffer_lock = threading.Lock()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush_pending)
+        self.timer.start(LOG_REFRESH_MS)
+
+    # Buffer a line; safe to call from any thread
+    def append(self, msg):
+        with self.buffer_lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(msg)
 
-    # Emit log messages as signals that can be received by the QTextEdit widget
     def emit(self, record):
-        msg = self.format(record)
-        self.append_signal.emit(msg)
+        self.append(self.format(record))
+
+    # Append everything buffered since the last tick in a single update
+    def flush_pending(self):
+        with self.buffer_lock:
+            if not self.pending:
+                return
+            lines = list(self.pending)
+            self.pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            lines.insert(0, f"... {dropped} lines skipped")
+        self.widget.appendPlainText('\n'.join(lines))
+
+# Model of a dry run's planned destination tree for a QTreeView
+# Nothing is read until the view asks: a folder's subfolders and its first files are fetched when it is
+# expanded, and further files a batch at a time as the view scrolls to them, so memory and UI time follow
+# what has been shown rather than the size of the library
+class PlanTreeModel(QAbstractItemModel):
+    HEADERS = ('Name', 'Files', 'Size', 'From')
+
+    def __init__(self, tree, parent=None):
+        super().__init__(parent)
+        self.tree = tree
+        # Children fetched so far: folder -> (subfolders, files); subfolders come first in the view
+        self.loaded = {}
+        # Row of each fetched folder under its parent
+        self.rows = {}
+
+    # Function to get the folder whose children an index holds; the invalid index is the destination itself
+    # Only the first column has children
+    def _folder(self, index):
+        if not index.isValid():
+            return self.tree.root
+        item = index.internalPointer()
+        return item if isinstance(item, PlanFolder) and index.column() == 0 else None
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        subfolders, files = self.loaded[self._folder(parent)]
+        item = subfolders[row] if row < len(subfolders) else files[row - len(subfolders)]
+        return self.createIndex(row, column, item)
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        item = index.internalPointer()
+        folder = item.parent if isinstance(item, PlanFolder) else item.folder
+        if folder is self.tree.root:
+            return QModelIndex()
+        return self.createIndex(self.rows[folder], 0, folder)
+
+    def rowCount(self, parent=QModelIndex()):
+        folder = self._folder(parent)
+        if folder not in self.loaded:
+            return 0
+        subfolders, files = self.loaded[folder]
+        return len(subfolders) + len(files)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.HEADERS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        folder = self._folder(parent)
+        return folder is not None and folder.total_files > 0
+
+    def canFetchMore(self, parent):
+        folder = self._folder(parent)
+        if folder is None:
+            return False
+        if folder not in self.loaded:
+            return folder.total_files > 0
+        return len(self.loaded[folder][1]) < len(folder.offsets)
+
+    # Function to fetch a folder's subfolders, the first time, and its next batch of files
+    def fetchMore(self, parent):
+        folder = self._folder(parent)
+        if folder is None:
+            return
+        if folder in self.loaded:
+            subfolders, files = self.loaded[folder]
+            new_subfolders = []
+        else:
+            subfolders, files = [], []
+            new_subfolders = folder.subfolders()
+        new_files = self.tree.files(folder, len(files), PREVIEW_BATCH)
+        first = len(subfolders) + len(files)
+        last = first + len(new_subfolders) + len(new_files) - 1
+        if last < first:
+            return
+        self.beginInsertRows(parent, first, last)
+        for row, subfolder in enumerate(new_subfolders):
+            self.rows[subfolder] = row
+        subfolders += new_subfolders
+        files += new_files
+        self.loaded[folder] = (subfolders, files)
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = index.internalPointer()
+        column = index.column()
+        if role == Qt.TextAlignmentRole and column in (1, 2):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        if isinstance(item, PlanFolder):
+            return (item.name, str(item.total_files), format_size(item.total_bytes), '')[column]
+        return (item.name, '', format_size(item.size), item.source)[column]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
 
 # Thread to handle file organization without blocking the GUI
 class OrganizerThread(QThread):
     progress_signal = pyqtSignal(str)
     log_signal = pyqtSignal(str)
+    metrics_signal = pyqtSignal(str)
+    # A dry run hands over its plan as a plan_tree.PlanTree; whoever receives it closes it and removes its file
+    preview_signal = pyqtSignal(object)
 
     # Initialize thread with all necessary parameters for file organization
-    def __init__(self, source_folder, dest_folder, move_files, delete_files, dry_run, year_only, day_only, month_only, rename_files, skip_existing, maintain_metadata, organize_by_type, ignore_types, organize_by_size, organize_by_name, eliminate_duplicates):
+    def __init__(self, source_folder, dest_folder, move_files, delete_files, dry_run, year_only, day_only, month_only, rename_files, skip_existing, maintain_metadata, organize_by_type, ignore_types, organize_by_size, organize_by_name, eliminate_duplicates, near_duplicates=None, layout_template=None):
         QThread.__init__(self)
         # Assign parameters to instance variables
         self.source_folder = source_folder
@@ -48,26 +198,34 @@ class OrganizerThread(QThread):
         self.organize_by_size = organize_by_size
         self.organize_by_name = organize_by_name
         self.eliminate_duplicates = eliminate_duplicates
+        self.near_duplicates = near_duplicates
+        self.layout_template = layout_template
 
     # Run the file organization process in the thread
     def run(self):
         self.start_time = time.time()
         
-        # Callback function to update progress
-        def progress_callback():
-            self.progress += 1
-            progress_percentage = (self.progress / self.total_files) * 100
+        # Callback function to update progress; the total is estimated while the source is still being scanned
+        # organize_files_by_date already limits how often this is called
+        def progress_callback(progress, total_files):
+            if not progress:
+                return
+            progress_percentage = (progress / total_files) * 100
             elapsed_time = time.time() - self.start_time
-            estimated_total_time = elapsed_time / (self.progress / self.total_files)
+            estimated_total_time = elapsed_time / (progress / total_files)
             remaining_time = estimated_total_time - elapsed_time
-            it_per_s = self.progress / elapsed_time
-            progress_str = f"{progress_percentage:.1f}%|{'█' * int(progress_percentage // 10)}{' ' * (10 - int(progress_percentage // 10))}| {self.progress}/{self.total_files} [{elapsed_time:.0f}s<{remaining_time:.0f}s, {it_per_s:.2f}it/s]"
+            it_per_s = progress / elapsed_time
+            progress_str = f"{progress_percentage:.1f}%|{'█' * int(progress_percentage // 10)}{' ' * (10 - int(progress_percentage // 10))}| {progress}/{total_files} [{elapsed_time:.0f}s<{remaining_time:.0f}s, {it_per_s:.2f}it/s]"
             self.progress_signal.emit(progress_str)
 
-        self.progress = 0
-        self.total_files = sum([len(files) for r, d, files in os.walk(self.source_folder)])
+        # A dry run writes its plan to a temporary file, which the preview reads back
+        plan_path = None
+        if self.dry_run:
+            fd, plan_path = tempfile.mkstemp(prefix='pixjinx-plan-', suffix='.jsonl')
+            os.close(fd)
 
         # Call the file organization function with all parameters
+        metrics = Metrics()
         result = organize_files_by_date(
             self.source_folder,
             self.dest_folder,
@@ -85,12 +243,29 @@ class OrganizerThread(QThread):
             self.organize_by_size,
             self.organize_by_name,
             self.eliminate_duplicates,
-            progress_callback
+            progress_callback,
+            metrics=metrics,
+            near_duplicates=self.near_duplicates,
+            layout_template=self.layout_template,
+            plan_path=plan_path
         )
+        if result is None:
+            if plan_path is not None:
+                os.remove(plan_path)
+            return
 
         # Emit log messages for each operation
         for operation, count in result.items():
             self.log_signal.emit(f"Total files {operation}: {count}")
+        self.metrics_signal.emit('\n'.join(metrics.summary_lines()))
+
+        # Index the plan here rather than in the GUI thread; the tree keeps only offsets into the plan
+        if plan_path is not None:
+            try:
+                self.preview_signal.emit(PlanTree(plan_path))
+            except (OSError, ValueError) as e:
+                self.log_signal.emit(f"Unable to preview the plan: {e}")
+                os.remove(plan_path)
 
 # Main application window
 class App(QWidget):
@@ -102,11 +277,9 @@ class App(QWidget):
         # Set minimum window width
         self.setMinimumWidth(800) 
 
-        # Initialize logger
+        # Initialize logger; main() hands it to the logging listener
         self.logTextBox = QTextEditLogger(self)
-        self.logTextBox.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logging.getLogger().addHandler(self.logTextBox)
-        logging.getLogger().setLevel(logging.INFO)
+        self.logTextBox.setFormatter(logging.Formatter(LOG_FORMAT))
 
         # Initialize user interface
         self.initUI()
@@ -168,7 +341,7 @@ class App(QWidget):
                 left: 10px;
                 padding: 0 5px 0 5px;
             }
-            QTextEdit {
+            QTextEdit, QPlainTextEdit, QTreeView {
                 background-color: #3A3A3A;
                 color: #FFFFFF;
                 border: 1px solid #707070;
@@ -177,6 +350,12 @@ class App(QWidget):
                 font-size: 16px;
                 border-radius: 5px;
             }
+            QHeaderView::section {
+                background-color: #232F34;
+                color: #D2D7D3;
+                font-size: 16px;
+                padding: 4px;
+            }
         """)
 
         # Initialize main layout
@@ -251,6 +430,15 @@ class App(QWidget):
         self.eliminate_duplicates_check = QCheckBox('Eliminate duplicates', self)
         advanced_options_layout.addWidget(self.eliminate_duplicates_check)
 
+        # Skips resized or re-encoded copies of images already in the destination
+        self.eliminate_near_duplicates_check = QCheckBox('Eliminate near-duplicates', self)
+        advanced_options_layout.addWidget(self.eliminate_near_duplicates_check)
+
+        # Large runs log faster than anyone can read; without this only totals and errors are logged
+        self.log_every_file_check = QCheckBox('Log every file', self)
+        self.log_every_file_check.setChecked(True)
+        advanced_options_layout.addWidget(self.log_every_file_check)
+
         # Set layout for advanced options group box
         advanced_options_group.setLayout(advanced_options_layout)
 
@@ -284,6 +472,14 @@ class App(QWidget):
         self.organize_by_name_check = QCheckBox('Organize by name', self)
         organizing_options_layout.addWidget(self.organize_by_name_check)
 
+        # A layout template replaces the check boxes above; the placeholder shows the template they amount to
+        self.layout_entry = QLineEdit(self)
+        organizing_options_layout.addWidget(QLabel("Layout template:"))
+        organizing_options_layout.addWidget(self.layout_entry)
+        for check in (self.year_only_check, self.day_only_check, self.month_only_check, self.organize_by_type_check, self.organize_by_size_check, self.organize_by_name_check):
+            check.toggled.connect(self.update_layout_placeholder)
+        self.update_layout_placeholder()
+
         # Set layout for organizing options group box
         organizing_options_group.setLayout(organizing_options_layout)
 
@@ -313,10 +509,32 @@ class App(QWidget):
         log_layout.addWidget(QLabel("Log:"))
         log_layout.addWidget(self.logTextBox.widget)
 
+        # Initialize metrics view, filled in when a run finishes
+        self.metrics_view = QPlainTextEdit(self)
+        self.metrics_view.setReadOnly(True)
+        log_layout.addWidget(QLabel("Metrics:"))
+        log_layout.addWidget(self.metrics_view)
+
         # Set layout for log tab
         self.log_tab.setLayout(log_layout)
         self.tab_widget.addTab(self.log_tab, "Log")
 
+        # Initialize preview tab, showing the destination tree a dry run planned
+        self.preview_tab = QWidget()
+        preview_layout = QVBoxLayout()
+        self.preview_tree = None
+        self.preview_label = QLabel("Run a dry run to preview the destination.", self)
+        preview_layout.addWidget(self.preview_label)
+
+        # Rows all have the same height, so the view never measures rows it does not show
+        self.preview_view = QTreeView(self)
+        self.preview_view.setUniformRowHeights(True)
+        preview_layout.addWidget(self.preview_view)
+
+        # Set layout for preview tab
+        self.preview_tab.setLayout(preview_layout)
+        self.tab_widget.addTab(self.preview_tab, "Preview")
+
         # Add tab widget to main layout
         layout.addWidget(self.tab_widget)
         self.setLayout(layout)
@@ -331,6 +549,17 @@ class App(QWidget):
         self.dest_folder = QFileDialog.getExistingDirectory(self, 'Select Destination Folder')
         self.dest_folder_label.setText(f"Selected destination folder: {self.dest_folder}")
 
+    # Function to show the template the organizing check boxes amount to
+    def update_layout_placeholder(self):
+        self.layout_entry.setPlaceholderText(preset_template(
+            self.year_only_check.isChecked(),
+            self.day_only_check.isChecked(),
+            self.month_only_check.isChecked(),
+            self.organize_by_type_check.isChecked(),
+            self.organize_by_size_check.isChecked(),
+            self.organize_by_name_check.isChecked()
+        ))
+
     # Function to start file organization
     def organize_files(self):
         # Check if source and destination folders have been selected
@@ -341,8 +570,18 @@ class App(QWidget):
             QMessageBox.critical(self, "Error", "Please select a destination folder.")
             return
 
+        # Check the layout template before starting
+        layout_template = self.layout_entry.text().strip() or None
+        if layout_template is not None:
+            try:
+                compile_layout(layout_template)
+            except ValueError as e:
+                QMessageBox.critical(self, "Error", str(e))
+                return
+
         # Get ignore types from line edit
         ignore_types = self.ignore_types_entry.text().split()
+        set_verbosity('files' if self.log_every_file_check.isChecked() else 'summary')
         self.progress.setValue(0)
         # Initialize and start organizer thread
         self.organizer_thread = OrganizerThread(
@@ -361,16 +600,45 @@ class App(QWidget):
             ignore_types,
             self.organize_by_size_check.isChecked(),
             self.organize_by_name_check.isChecked(),
-            self.eliminate_duplicates_check.isChecked()
+            self.eliminate_duplicates_check.isChecked(),
+            'skip' if self.eliminate_near_duplicates_check.isChecked() else None,
+            layout_template
         )
         self.organizer_thread.progress_signal.connect(self.progress.setFormat)
-        self.organizer_thread.log_signal.connect(self.logTextBox.append_signal.emit)
+        self.organizer_thread.log_signal.connect(self.logTextBox.append)
+        self.organizer_thread.metrics_signal.connect(self.metrics_view.setPlainText)
+        self.organizer_thread.preview_signal.connect(self.show_preview)
         self.organizer_thread.start()
 
+    # Function to show a dry run's plan in the preview tab, replacing the previous one
+    def show_preview(self, tree):
+        self.close_preview()
+        self.preview_tree = tree
+        self.preview_view.setModel(PlanTreeModel(tree, self.preview_view))
+        self.preview_view.setColumnWidth(0, 300)
+        self.preview_label.setText(f"{tree.root.total_files} files, {format_size(tree.root.total_bytes)} planned in {tree.dest_folder}")
+        self.tab_widget.setCurrentWidget(self.preview_tab)
+
+    # Function to drop the previewed plan and its temporary file
+    def close_preview(self):
+        if self.preview_tree is None:
+            return
+        model = self.preview_view.model()
+        self.preview_view.setModel(None)
+        model.deleteLater()
+        self.preview_tree.close()
+        os.remove(self.preview_tree.path)
+        self.preview_tree = None
+
+    def closeEvent(self, event):
+        self.close_preview()
+        super().closeEvent(event)
+
 # Main function to start the application
 def main():
     app = QApplication([])
     ex = App()
+    setup_logging(handlers=[ex.logTextBox])
     ex.show()
     app.exec_()
 
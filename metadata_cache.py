@@ -0,0 +1,63 @@
+# Import necessary libraries
+import os
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of new entries to buffer before writing them out
+FLUSH_INTERVAL = 1000
+
+# Function to get the default location of the metadata cache
+def default_cache_path():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pix-jinx', 'metadata.sqlite')
+
+# Persistent cache of extracted metadata keyed by (device, inode, size, mtime_ns)
+# An entry is only returned while all four still match, so edited or replaced files are re-read
+class MetadataCache:
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self.lock = threading.Lock()
+        self.buffer = {}
+
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS metadata (dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, date_taken TEXT NOT NULL, source TEXT NOT NULL, PRIMARY KEY (dev, ino))')
+        self.conn.commit()
+
+    # Function to look up the cached date and its source for a stat result
+    def get(self, stat):
+        key = (stat.st_dev, stat.st_ino)
+        with self.lock:
+            entry = self.buffer.get(key)
+            if entry is None:
+                entry = self.conn.execute('SELECT size, mtime_ns, date_taken, source FROM metadata WHERE dev = ? AND ino = ?', key).fetchone()
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+        return entry[2], entry[3]
+
+    # Function to store the date and its source for a stat result
+    def put(self, stat, date_taken, source):
+        with self.lock:
+            self.buffer[(stat.st_dev, stat.st_ino)] = (stat.st_size, stat.st_mtime_ns, date_taken, source)
+            if len(self.buffer) >= FLUSH_INTERVAL:
+                self._flush()
+
+    # Write buffered entries; the caller must hold the lock
+    def _flush(self):
+        self.conn.executemany('INSERT OR REPLACE INTO metadata (dev, ino, size, mtime_ns, date_taken, source) VALUES (?, ?, ?, ?, ?, ?)', [key + entry for key, entry in self.buffer.items()])
+        self.conn.commit()
+        self.buffer.clear()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
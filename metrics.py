@@ -0,0 +1,212 @@
+# Import necessary libraries
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets, from 100µs to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of the exported Prometheus metric names
+PROMETHEUS_PREFIX = 'pixjinx'
+
+# Latency histogram with fixed buckets, as Prometheus expects them
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus one for values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimate a quantile as the upper bound of the bucket it falls in
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+# Logging handler counting warnings and errors into a Metrics object
+class _LogCounter(logging.Handler):
+    def __init__(self, metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        self.metrics.count('errors' if record.levelno >= logging.ERROR else 'warnings')
+
+# Run instrumentation: per-stage latency histograms with file and byte counters,
+# event counters, and a per-extension breakdown of files, bytes and dates that fell back to mtime
+# Stages: scan, metadata, extract, stream, index_build, dedupe, perceptual, hash_partial, hash_full, copy, move
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}
+        self.stage_bytes = {}
+        self.counters = {}
+        self.extensions = {}
+        self.log_counter = None
+
+    # Function to record one file passing through a stage
+    def observe(self, stage, seconds, nbytes=0):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + nbytes
+
+    # Context manager timing a block as one observation of a stage
+    @contextmanager
+    def timer(self, stage, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, nbytes)
+
+    # Function to bump an event counter, e.g. 'metadata_cache_hits' or 'duplicates'
+    def count(self, event, n=1):
+        with self.lock:
+            self.counters[event] = self.counters.get(event, 0) + n
+
+    # Function to record a file in the per-extension breakdown; date_source is 'exif', 'video' or 'mtime'
+    def file(self, path, size, date_source):
+        extension = os.path.splitext(path)[1].lower() or '(none)'
+        with self.lock:
+            breakdown = self.extensions.get(extension)
+            if breakdown is None:
+                breakdown = self.extensions[extension] = {"files": 0, "bytes": 0, "mtime_fallbacks": 0}
+            breakdown["files"] += 1
+            breakdown["bytes"] += size
+            if date_source == 'mtime':
+                breakdown["mtime_fallbacks"] += 1
+                self.counters['mtime_fallbacks'] = self.counters.get('mtime_fallbacks', 0) + 1
+
+    # Function to mark the start of a run; warnings and errors logged until finish() are counted
+    def start(self):
+        self.started = time.time()
+        self.log_counter = _LogCounter(self)
+        logging.getLogger().addHandler(self.log_counter)
+
+    def finish(self):
+        self.finished = time.time()
+        if self.log_counter is not None:
+            logging.getLogger().removeHandler(self.log_counter)
+            self.log_counter = None
+
+    # Function to add another run's snapshot, e.g. one shard's --metrics-json
+    # Histograms merge exactly; the merged run spans from the earliest start to the latest finish
+    def merge(self, snapshot):
+        with self.lock:
+            if not self.stages and not self.counters and not self.extensions:
+                self.started = snapshot["started"]
+                self.finished = snapshot["started"] + snapshot["elapsed_seconds"]
+            else:
+                self.started = min(self.started, snapshot["started"])
+                self.finished = max(self.finished or time.time(), snapshot["started"] + snapshot["elapsed_seconds"])
+            for stage, values in snapshot["stages"].items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram()
+                for i, count in enumerate(values["buckets"].values()):
+                    histogram.counts[i] += count
+                histogram.count += values["count"]
+                histogram.sum += values["sum"]
+                self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + values["bytes"]
+            for event, count in snapshot["counters"].items():
+                self.counters[event] = self.counters.get(event, 0) + count
+            for extension, breakdown in snapshot["extensions"].items():
+                total = self.extensions.setdefault(extension, {"files": 0, "bytes": 0, "mtime_fallbacks": 0})
+                for key, value in breakdown.items():
+                    total[key] = total.get(key, 0) + value
+
+    # Function to get all metrics as a JSON-compatible dict
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "elapsed_seconds": round((self.finished or time.time()) - self.started, 3),
+                "stages": {stage: dict(histogram.snapshot(), bytes=self.stage_bytes[stage]) for stage, histogram in self.stages.items()},
+                "counters": dict(self.counters),
+                "extensions": {extension: dict(breakdown) for extension, breakdown in sorted(self.extensions.items())},
+            }
+
+    # Function to write the snapshot as JSON
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.snapshot(), indent=2))
+
+    # Function to write the metrics in the Prometheus text format, e.g. for node_exporter's textfile collector
+    def write_prometheus(self, path):
+        _write_atomically(path, self.prometheus_text())
+
+    def prometheus_text(self):
+        prefix = PROMETHEUS_PREFIX
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent on one file in each stage",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in self.stages.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += [f"# HELP {prefix}_stage_bytes_total Bytes processed in each stage", f"# TYPE {prefix}_stage_bytes_total counter"]
+        lines += [f'{prefix}_stage_bytes_total{{stage="{stage}"}} {values["bytes"]}' for stage, values in snapshot["stages"].items()]
+        lines += [f"# HELP {prefix}_events_total Events counted during the run", f"# TYPE {prefix}_events_total counter"]
+        lines += [f'{prefix}_events_total{{event="{event}"}} {count}' for event, count in snapshot["counters"].items()]
+        for field, help_text in (("files", "Files seen"), ("bytes", "Bytes seen"), ("mtime_fallbacks", "Files dated by modification time")):
+            lines += [f"# HELP {prefix}_extension_{field}_total {help_text} per extension", f"# TYPE {prefix}_extension_{field}_total counter"]
+            lines += [f'{prefix}_extension_{field}_total{{extension="{extension}"}} {values[field]}' for extension, values in snapshot["extensions"].items()]
+        lines += [f"# HELP {prefix}_run_seconds Duration of the run", f"# TYPE {prefix}_run_seconds gauge", f"{prefix}_run_seconds {snapshot['elapsed_seconds']}"]
+        return '\n'.join(lines) + '\n'
+
+    # Function to describe the metrics in a few lines for people, such as the GUI's Log tab
+    def summary_lines(self):
+        snapshot = self.snapshot()
+        lines = [f"Run took {snapshot['elapsed_seconds']:.1f}s"]
+        for stage, values in snapshot["stages"].items():
+            mb_per_sec = values["bytes"] / values["sum"] / (1024 * 1024) if values["sum"] else 0
+            lines.append(f"{stage}: {values['count']} files, {values['sum']:.2f}s busy, mean {values['mean'] * 1000:.2f}ms, p99 <= {values['p99'] * 1000:g}ms, {mb_per_sec:.1f} MB/s")
+        if snapshot["counters"]:
+            lines.append(", ".join(f"{event}: {count}" for event, count in sorted(snapshot["counters"].items())))
+        for extension, values in sorted(snapshot["extensions"].items(), key=lambda item: -item[1]["files"]):
+            lines.append(f"{extension}: {values['files']} files, {values['bytes'] / (1024 * 1024):.1f} MB, {values['mtime_fallbacks']} dated by mtime")
+        return lines
+
+# Function to replace a file in one step, so collectors never read a half-written file
+def _write_atomically(path, text):
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,406 @@
+# Import necessary libraries
+import os
+import signal
+import sqlite3
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+from hash_index import SIDECAR_PREFIX
+from transfer import Transfer, TargetExistsError
+
+logger = logging.getLogger(__name__)
+
+# NumPy and PIL are imported on first use, so runs without near-duplicate detection never load them
+
+# Name of the perceptual index kept inside the destination folder, next to the exact-duplicate index
+PERCEPTUAL_INDEX_FILENAME = '.pixjinx_perceptual.sqlite'
+
+# Bump when the layout of the index changes; older indexes are rebuilt
+SCHEMA_VERSION = 1
+
+# Image types whose pixels are compared
+PERCEPTUAL_TYPES = ('.jpg', '.jpeg', '.png', '.webp', '.tiff', '.bmp', '.gif', '.heic')
+
+# Perceptual hash algorithms: dHash compares neighbouring pixels of a 9x8 thumbnail,
+# pHash thresholds the low frequencies of a 32x32 thumbnail's DCT and survives re-encoding better
+ALGORITHMS = ('phash', 'dhash')
+
+# What to do with a near-duplicate of an image already in the destination:
+# 'skip' leaves it where it is, 'keep-highest' keeps whichever copy has more pixels,
+# 'report' places it as usual and only logs the match
+POLICIES = ('skip', 'keep-highest', 'report')
+
+# Largest Hamming distance (out of 64 bits) at which two images count as the same picture
+DEFAULT_THRESHOLD = 8
+
+# Folder of the destination that 'keep-highest' moves superseded lower-resolution copies into
+NEAR_DUPLICATES_FOLDER = 'NearDuplicates'
+
+# Number of images hashed per task, when the index is built and as source images are prefetched
+BATCH_SIZE = 64
+
+# Thumbnail size (width, height) each algorithm works on
+THUMBNAIL_SIZES = {'dhash': (9, 8), 'phash': (32, 32)}
+
+# Function to decode an image at a reduced resolution into a grayscale thumbnail
+# Returns (pixels, width, height) with the image's full-resolution size
+def _thumbnail(path, size):
+    import numpy as np
+    from PIL import Image, ImageOps
+    with Image.open(path) as image:
+        width, height = image.size
+        # JPEG decodes straight at 1/2, 1/4 or 1/8 scale; other formats ignore the draft
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        image = ImageOps.exif_transpose(image).convert('L')
+        factor = min(image.width // (size[0] * 2), image.height // (size[1] * 2))
+        if factor > 1:
+            image = image.reduce(factor)
+        image = image.resize(size, Image.Resampling.BILINEAR)
+        return np.asarray(image, dtype=np.float32), width, height
+
+# Matrix of the orthonormal DCT-II over n points
+def _dct_matrix(n):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+# Function to pack rows of 64 booleans into integers
+def _pack(bits):
+    import numpy as np
+    return [int(value) for value in np.packbits(bits, axis=1).view('>u8')[:, 0]]
+
+# Vectorized hashes of a stack of thumbnails, shape (N, height, width)
+def dhash_batch(pixels):
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    return _pack(bits.reshape(len(pixels), 64))
+
+def phash_batch(pixels):
+    import numpy as np
+    dct = _dct_matrix(pixels.shape[1])
+    low = (dct @ pixels @ dct.T)[:, :8, :8].reshape(len(pixels), 64)
+    # Compare with the median of the AC coefficients; the DC term only tracks overall brightness
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack(low > median)
+
+HASH_BATCH = {'dhash': dhash_batch, 'phash': phash_batch}
+
+# Function to hash a batch of images; runs in worker processes when an index is built
+# Returns (hash, width, height) per path, or None for images that cannot be decoded
+def perceptual_hashes(paths, algorithm='phash'):
+    import numpy as np
+    thumbnails = []
+    results = [None] * len(paths)
+    decoded = []
+    for i, path in enumerate(paths):
+        try:
+            pixels, width, height = _thumbnail(path, THUMBNAIL_SIZES[algorithm])
+        except Exception as e:
+            logger.debug(f"Unable to decode {path} for perceptual hashing: {e}")
+            continue
+        thumbnails.append(pixels)
+        decoded.append((i, width, height))
+    if thumbnails:
+        hashes = HASH_BATCH[algorithm](np.stack(thumbnails))
+        for (i, width, height), value in zip(decoded, hashes):
+            results[i] = (value, width, height)
+    return results
+
+# Function run in each hashing worker process: Ctrl-C is left to the parent, as for the metadata workers
+def _init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Function to count the bits two hashes differ in; int.bit_count only exists from Python 3.10
+if hasattr(int, 'bit_count'):
+    def hamming(a, b):
+        return (a ^ b).bit_count()
+else:
+    def hamming(a, b):
+        return bin(a ^ b).count('1')
+
+# BK-tree over 64-bit hashes under the Hamming distance
+# A query only descends into children whose edge distance is within the threshold of the query's distance
+# to their parent, so lookups touch a small part of the tree even with millions of images
+# Each node is [hash, paths, children]; images with identical hashes share a node
+class BKTree:
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, path):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [path], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(path)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [path], {}]
+                return
+            node = child
+
+    # Function to forget a path; its node stays behind as a signpost for its children
+    def remove(self, value, path):
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if path in node[1]:
+                    node[1].remove(path)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    # Function to find every path within threshold of value, as (distance, hash, path), nearest first
+    def search(self, value, threshold):
+        matches = []
+        pending = deque([self.root] if self.root is not None else [])
+        while pending:
+            node = pending.popleft()
+            distance = hamming(value, node[0])
+            if distance <= threshold:
+                matches.extend((distance, node[0], path) for path in node[1])
+            for edge in range(max(1, distance - threshold), distance + threshold + 1):
+                child = node[2].get(edge)
+                if child is not None:
+                    pending.append(child)
+        matches.sort()
+        return matches
+
+# Index of the destination's images by perceptual hash, persisted next to the exact-duplicate index
+# Hashes are kept in SQLite so unchanged images are never decoded twice; lookups go through a BK-tree in memory
+# Source images are hashed BATCH_SIZE at a time in worker processes: prefetch() queues an image as soon as
+# it is planned, and claim() only waits for its batch, so placement threads never decode images themselves
+class NearDuplicateIndex:
+    def __init__(self, dest_folder, algorithm='phash', threshold=DEFAULT_THRESHOLD, policy='skip', workers=None, in_memory=False, filename=PERCEPTUAL_INDEX_FILENAME):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown perceptual hash {algorithm}; expected one of {', '.join(ALGORITHMS)}")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown near-duplicate policy {policy}; expected one of {', '.join(POLICIES)}")
+        self.dest_folder = dest_folder
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.policy = policy
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.lock = threading.Lock()
+        self.tree = BKTree()
+        # Fingerprint (hash, width, height) of every image in the tree, by path
+        self.images = {}
+        # Images are set aside without ever replacing one set aside earlier
+        self.transfer = Transfer(exclusive=True)
+        # Source images waiting to be hashed, and (future, position in its batch) of those submitted
+        self.hash_lock = threading.Lock()
+        self.unhashed = []
+        self.hashing = {}
+        self.executor = None
+
+        if in_memory:
+            self.path = ':memory:'
+        else:
+            os.makedirs(dest_folder, exist_ok=True)
+            self.path = os.path.join(dest_folder, filename)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._check_schema()
+
+    # Drop indexes written with another layout or algorithm
+    def _check_schema(self):
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        expected = {'schema': str(SCHEMA_VERSION), 'algorithm': self.algorithm}
+        if meta != expected:
+            if meta:
+                logger.info(f"Rebuilding perceptual index {self.path}")
+            self.conn.execute('DROP TABLE IF EXISTS images')
+            self.conn.execute('DELETE FROM meta')
+            self.conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', expected.items())
+        # Hashes are stored as hex: SQLite integers are signed and 64-bit hashes would overflow them
+        self.conn.execute('CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT, width INTEGER, height INTEGER)')
+        self.conn.commit()
+
+    # Function to start the worker processes that hash images, on first use
+    def _executor(self):
+        if self.executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+        return self.executor
+
+    # Function to hash images in batches, in worker processes when there are enough of them
+    def _hash_all(self, paths):
+        batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+        if self.workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                yield batch, perceptual_hashes(batch, self.algorithm)
+            return
+        futures = [(batch, self._executor().submit(perceptual_hashes, batch, self.algorithm)) for batch in batches]
+        for batch, future in futures:
+            yield batch, future.result()
+
+    # Bring the index in line with the destination folder, hashing only new or changed images
+    def build(self):
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute('SELECT path, size, mtime_ns FROM images')}
+        seen = {}
+        for root, dirs, files in os.walk(self.dest_folder):
+            # Images set aside as near-duplicates are not matched against again, nor are staged files
+            dirs[:] = [folder for folder in dirs if not folder.startswith(SIDECAR_PREFIX) and (root != self.dest_folder or folder != NEAR_DUPLICATES_FOLDER)]
+            for file in files:
+                if not file.lower().endswith(PERCEPTUAL_TYPES):
+                    continue
+                full_path = os.path.join(root, file)
+                try:
+                    stat = os.stat(full_path)
+                except OSError as e:
+                    logger.error(f"Unable to index {full_path}: {e}")
+                    continue
+                seen[os.path.relpath(full_path, self.dest_folder)] = (stat.st_size, stat.st_mtime_ns)
+
+        changed = [path for path, key in seen.items() if known.get(path) != key]
+        stale = [(path,) for path in known if path not in seen]
+        rows = []
+        for batch, hashes in self._hash_all([os.path.join(self.dest_folder, path) for path in changed]):
+            for full_path, fingerprint in zip(batch, hashes):
+                rel_path = os.path.relpath(full_path, self.dest_folder)
+                value, width, height = fingerprint if fingerprint is not None else (None, None, None)
+                rows.append((rel_path, *seen[rel_path], None if value is None else f"{value:016x}", width, height))
+        self.conn.executemany('INSERT OR REPLACE INTO images (path, size, mtime_ns, hash, width, height) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.conn.executemany('DELETE FROM images WHERE path = ?', stale)
+        self.conn.commit()
+
+        for rel_path, value, width, height in self.conn.execute('SELECT path, hash, width, height FROM images WHERE hash IS NOT NULL'):
+            path = os.path.join(self.dest_folder, rel_path)
+            self.tree.add(int(value, 16), path)
+            self.images[path] = (int(value, 16), width, height)
+        logger.info(f"Indexed {self.tree.size} destination images by {self.algorithm} ({len(changed)} new or changed, {len(stale)} removed)")
+
+    # Function to hash the queued source images as one batch; the caller must hold hash_lock
+    # Without worker processes the batch is hashed right here, still in a single vectorized pass
+    def _submit(self):
+        batch, self.unhashed = self.unhashed, []
+        if not batch:
+            return
+        if self.workers > 1:
+            future = self._executor().submit(perceptual_hashes, batch, self.algorithm)
+        else:
+            future = Future()
+            future.set_result(perceptual_hashes(batch, self.algorithm))
+        for i, path in enumerate(batch):
+            self.hashing[path] = (future, i)
+
+    # Function to queue a source image for hashing ahead of claim(), e.g. as soon as it is planned
+    def prefetch(self, path):
+        if not path.lower().endswith(PERCEPTUAL_TYPES):
+            return
+        with self.hash_lock:
+            self.unhashed.append(path)
+            if len(self.unhashed) >= BATCH_SIZE:
+                self._submit()
+
+    # Function to forget a prefetched image that will not be claimed
+    def discard(self, path):
+        with self.hash_lock:
+            self.hashing.pop(path, None)
+            if path in self.unhashed:
+                self.unhashed.remove(path)
+
+    # Function to get a source image's (hash, width, height), waiting for its batch; images that were
+    # not prefetched, or whose batch is not full yet, are submitted now
+    def _fingerprint(self, path):
+        with self.hash_lock:
+            if path not in self.hashing:
+                if path not in self.unhashed:
+                    self.unhashed.append(path)
+                self._submit()
+            future, i = self.hashing.pop(path)
+        return future.result()[i]
+
+    # Function to look up near-duplicates of an image and reserve its place in the index
+    # Returns (match, fingerprint): match is (path, distance, width, height) of the closest image within the
+    # threshold (the largest on ties), or None; fingerprint is (hash, width, height) or None if the image
+    # cannot be decoded. A returned fingerprint is reserved under the source path until add() or release()
+    def claim(self, path):
+        if not path.lower().endswith(PERCEPTUAL_TYPES):
+            return None, None
+        fingerprint = self._fingerprint(path)
+        if fingerprint is None:
+            return None, None
+        with self.lock:
+            matches = self.tree.search(fingerprint[0], self.threshold)
+            match = None
+            if matches:
+                distance, _, match_path = min(matches, key=lambda item: (item[0], -pixels(self.images[item[2]])))
+                match = (match_path, distance) + self.images[match_path][1:]
+            # Reserve the image so near-duplicates processed at the same time find each other
+            self.tree.add(fingerprint[0], path)
+            self.images[path] = fingerprint
+        return match, fingerprint
+
+    # Function to replace a reservation with the placed file
+    def add(self, source_path, placed_path, fingerprint):
+        value, width, height = fingerprint
+        with self.lock:
+            self.tree.remove(value, source_path)
+            self.images.pop(source_path, None)
+            self.tree.add(value, placed_path)
+            self.images[placed_path] = fingerprint
+            try:
+                stat = os.stat(placed_path)
+            except OSError:
+                return
+            self.conn.execute('INSERT OR REPLACE INTO images (path, size, mtime_ns, hash, width, height) VALUES (?, ?, ?, ?, ?, ?)',
+                              (os.path.relpath(placed_path, self.dest_folder), stat.st_size, stat.st_mtime_ns, f"{value:016x}", width, height))
+
+    # Function to drop a reservation that was not placed
+    def release(self, source_path, fingerprint):
+        with self.lock:
+            self.tree.remove(fingerprint[0], source_path)
+            self.images.pop(source_path, None)
+
+    # Function to move an indexed image superseded by a larger copy into the NearDuplicates folder
+    # Only placed files are moved: a match that is still a reservation belongs to the source tree
+    # An image set aside earlier under the same path is kept; this one gets the next free '(n)' name
+    # Returns the new path, or None when nothing was moved
+    def set_aside(self, path, dry_run=False):
+        rel_path = os.path.relpath(path, self.dest_folder)
+        if rel_path.startswith(os.pardir):
+            return None
+        target = os.path.join(self.dest_folder, NEAR_DUPLICATES_FOLDER, rel_path)
+        if dry_run:
+            return target
+        with self.lock:
+            fingerprint = self.images.pop(path, None)
+            if fingerprint is None:
+                return None
+            self.tree.remove(fingerprint[0], path)
+            self.conn.execute('DELETE FROM images WHERE path = ?', (rel_path,))
+        folder = os.path.dirname(target)
+        os.makedirs(folder, exist_ok=True)
+        stem, ext = os.path.splitext(os.path.basename(target))
+        i = 0
+        while True:
+            try:
+                self.transfer.place(path, target)
+                return target
+            except TargetExistsError:
+                i += 1
+                target = os.path.join(folder, f"{stem}({i}){ext}")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+# Function to count an image's pixels from its (hash, width, height) fingerprint
+def pixels(fingerprint):
+    return (fingerprint[1] or 0) * (fingerprint[2] or 0)
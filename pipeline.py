@@ -0,0 +1,280 @@
+# Import necessary libraries
+import os
+import time
+import queue
+import signal
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+DONE = object()
+
+# Number of files sent to a metadata worker process in one task
+METADATA_BATCH_SIZE = 32
+
+# Default size of the queues between stages
+QUEUE_SIZE = 1024
+
+# Default number of metadata worker processes: one per core, since parsing is CPU-bound
+def default_metadata_workers():
+    return os.cpu_count() or 1
+
+# Default number of I/O threads: copying waits on disks, so oversubscribe the cores
+def default_io_workers():
+    return min(32, (os.cpu_count() or 1) * 4)
+
+# Function run in each metadata worker process: send its log records to the parent through log_queue,
+# and sample the worker's stacks every profile_interval seconds when the run is profiled
+# Ctrl-C is left to the parent, which stops after the current batch; the workers keep serving it till then
+def _init_worker(log_queue, level, profile_interval=None):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from logging.handlers import QueueHandler
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    if profile_interval is not None:
+        from profiling import start_worker_profiler
+        start_worker_profiler(profile_interval)
+
+# Handler re-emitting records from worker processes through this process's loggers and their levels
+class _ForwardHandler(logging.Handler):
+    def emit(self, record):
+        target = logging.getLogger(record.name)
+        if target.isEnabledFor(record.levelno):
+            target.handle(record)
+
+# Staged organize run: scan -> extract metadata (process pool) -> plan -> execute I/O (thread pool)
+# Stages are connected by bounded queues, so a slow stage throttles the ones feeding it
+class OrganizePipeline:
+    # Items are scanner.ScanEntry tuples
+    # extract_batch(paths) -> [(date_taken, source, seconds) or None] runs in worker processes and must be picklable;
+    # None skips a file that could not be read
+    # plan(entry, date_taken, source) -> task or None, where source is where the date came from (see catalog.DATE_SOURCES),
+    # execute(task) -> result dict
+    # metadata_workers=0 extracts metadata in a thread of this process instead of a process pool
+    # order_key(task), if given, sorts the planned tasks waiting for the I/O stage, up to reorder_window at a time
+    # metrics, a metrics.Metrics, gets the scan and metadata timings and the per-extension breakdown
+    # profiler, a profiling.SamplingProfiler of this process, also gets the stacks sampled in the worker processes
+    def __init__(self, extract_batch, plan, execute, metadata_cache=None, metadata_workers=None, io_workers=None, queue_size=QUEUE_SIZE, batch_size=METADATA_BATCH_SIZE, order_key=None, reorder_window=1, metrics=None, profiler=None):
+        self.extract_batch = extract_batch
+        self.plan = plan
+        self.execute = execute
+        self.metadata_cache = metadata_cache
+        self.metadata_workers = default_metadata_workers() if metadata_workers is None else metadata_workers
+        self.io_workers = io_workers or default_io_workers()
+        self.batch_size = batch_size
+        self.order_key = order_key
+        self.reorder_window = reorder_window if order_key is not None else 1
+        self.metrics = metrics
+        self.profiler = profiler
+        self.scan_queue = queue.Queue(queue_size)
+        self.plan_queue = queue.Queue(queue_size)
+        self.results = queue.Queue(queue_size)
+        self.errors = []
+        # The metadata worker processes and the listener for their logs, started on the first cache miss
+        # and kept across runs until close()
+        self.executor = None
+        self.log_listener = None
+
+    # Run a stage body, making sure the next stage is told when it stops, even on errors
+    def _stage(self, body, output):
+        def run():
+            try:
+                body()
+            except BaseException as e:
+                logger.error(f"Pipeline stage {body.__name__} failed: {e}")
+                self.errors.append(e)
+            finally:
+                output.put(DONE)
+        thread = threading.Thread(target=run, name=f"pipeline-{body.__name__}", daemon=True)
+        thread.start()
+        return thread
+
+    # Stage 1: feed scanned files into the pipeline; the bounded queue keeps the scan just ahead of the workers
+    def _scan(self, items):
+        def scan():
+            if self.metrics is None:
+                for item in items:
+                    self.scan_queue.put(item)
+                return
+            # Time only the walk itself, not waiting for room in the queue
+            items_iter = iter(items)
+            while True:
+                start = time.perf_counter()
+                item = next(items_iter, DONE)
+                if item is DONE:
+                    break
+                self.metrics.observe('scan', time.perf_counter() - start)
+                self.scan_queue.put(item)
+        return scan
+
+    # Collect up to batch_size entries, waiting only for the first one
+    def _next_batch(self):
+        batch = []
+        item = self.scan_queue.get()
+        while item is not DONE:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, item is DONE
+
+    # Answer from the metadata cache where possible and return the entries that still need parsing
+    # Entries carry their stat data from the scan, so no extra stat() is needed here
+    def _cached(self, batch):
+        misses = []
+        for entry in batch:
+            cached = self.metadata_cache.get(entry) if self.metadata_cache is not None else None
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.count('metadata_cache_hits')
+                    self.metrics.file(entry.path, entry.st_size, cached[1])
+                self.plan_queue.put((entry, cached[0], cached[1]))
+            else:
+                misses.append(entry)
+        return misses
+
+    # Hand extracted dates to the planner and remember them for the next run
+    def _forward(self, misses, dates):
+        for entry, extracted in zip(misses, dates):
+            if extracted is None:
+                self.results.put(None)
+                continue
+            date_taken, source, seconds = extracted
+            if self.metrics is not None:
+                self.metrics.observe('metadata', seconds)
+                self.metrics.file(entry.path, entry.st_size, source)
+            if self.metadata_cache is not None:
+                self.metadata_cache.put(entry, date_taken, source)
+            self.plan_queue.put((entry, date_taken, source))
+
+    # Stage 2: extract metadata in worker processes, keeping a bounded number of batches in flight
+    def _extract(self):
+        if self.metadata_workers == 0:
+            finished = False
+            while not finished:
+                batch, finished = self._next_batch()
+                misses = self._cached(batch)
+                if misses:
+                    self._forward(misses, self.extract_batch([entry.path for entry in misses]))
+            return
+
+        in_flight = deque()
+        finished = False
+        while not finished:
+            batch, finished = self._next_batch()
+            misses = self._cached(batch)
+            if misses:
+                paths = [entry.path for entry in misses]
+                if self.profiler is not None:
+                    from profiling import profiled_call
+                    future = self._executor().submit(profiled_call, self.extract_batch, paths)
+                else:
+                    future = self._executor().submit(self.extract_batch, paths)
+                in_flight.append((misses, future))
+            # Keep every worker busy, but no more than two batches each in flight
+            while in_flight and (len(in_flight) >= self.metadata_workers * 2 or in_flight[0][1].done()):
+                self._collect(*in_flight.popleft())
+        while in_flight:
+            self._collect(*in_flight.popleft())
+
+    # The pool starts on the first cache miss, so empty or fully cached runs never pay for it
+    # Spawn rather than fork: forking while the other stages' threads hold locks can deadlock the children
+    def _executor(self):
+        if self.executor is None:
+            import multiprocessing
+            from logging.handlers import QueueListener
+            from concurrent.futures import ProcessPoolExecutor
+            context = multiprocessing.get_context('spawn')
+            log_queue = context.Queue()
+            self.log_listener = QueueListener(log_queue, _ForwardHandler())
+            self.log_listener.start()
+            profile_interval = self.profiler.interval if self.profiler is not None else None
+            self.executor = ProcessPoolExecutor(max_workers=self.metadata_workers, mp_context=context, initializer=_init_worker, initargs=(log_queue, logging.getLogger().getEffectiveLevel(), profile_interval))
+        return self.executor
+
+    # Forward a finished batch from the worker processes, merging the stacks it sampled when profiling
+    def _collect(self, misses, future):
+        dates = future.result()
+        if self.profiler is not None:
+            dates, stacks = dates
+            self.profiler.merge(stacks, 'metadata-worker')
+        self._forward(misses, dates)
+
+    # Plan the files waiting in the queue, up to reorder_window of them, waiting only for the first one
+    # Returns the planned tasks in execution order and whether the extract stage has finished
+    def _next_tasks(self):
+        tasks = []
+        item = self.plan_queue.get()
+        while item is not DONE:
+            task = self.plan(*item)
+            if task is None:
+                self.results.put(None)
+            else:
+                tasks.append(task)
+            if len(tasks) >= self.reorder_window:
+                break
+            try:
+                item = self.plan_queue.get_nowait()
+            except queue.Empty:
+                break
+        if self.order_key is not None:
+            tasks.sort(key=self.order_key)
+        return tasks, item is DONE
+
+    # Stages 3 and 4: plan each file's target, then execute the I/O in a thread pool
+    # Work only piles up here when I/O is the bottleneck, which is exactly when reordering it pays off
+    def _plan_and_execute(self):
+        window = threading.BoundedSemaphore(self.io_workers * 2)
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            finished = False
+            while not finished:
+                tasks, finished = self._next_tasks()
+                for task in tasks:
+                    window.acquire()
+                    future = executor.submit(self.execute, task)
+                    future.add_done_callback(lambda future: self._finish(future, window))
+
+    # Pass an executed task's result on and free its slot in the window
+    def _finish(self, future, window):
+        window.release()
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Error executing planned operation: {error}")
+            self.results.put(None)
+        else:
+            self.results.put(future.result())
+
+    # Run the pipeline over scanned entries, yielding one result per entry (None for skipped or failed files)
+    # A pipeline may run again once a run is over, e.g. for each batch of a watch, reusing its worker processes
+    def run(self, items):
+        self.errors = []
+        self._stage(self._scan(items), self.scan_queue)
+        self._stage(self._extract, self.plan_queue)
+        self._stage(self._plan_and_execute, self.results)
+
+        while True:
+            result = self.results.get()
+            if result is DONE:
+                break
+            yield result
+
+        if self.errors:
+            raise self.errors[0]
+
+    # Function to stop the metadata worker processes
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        # The workers have exited, so everything they logged is in the queue by now
+        if self.log_listener is not None:
+            self.log_listener.stop()
+            self.log_listener = None
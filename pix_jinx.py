@@ -0,0 +1,267 @@
+# Headless command-line entry point: python -m pix_jinx SOURCE DEST [options]
+# Prints the run's statistics as JSON on stdout; never imports Qt
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from functools import partial
+from transfer import COPY_MODES
+from perceptual import POLICIES, ALGORITHMS, DEFAULT_THRESHOLD
+from layout import compile_layout, FIELDS
+from watcher import SETTLE_SECONDS, POLL_INTERVAL
+from shards import SHARD_MODES, parse_shard as parse_shard_text
+
+# Same as file_organizer.VERBOSITY_LEVELS, repeated so --help does not import the organizer
+VERBOSITY_LEVELS = ('debug', 'files', 'summary', 'errors')
+
+# Exit codes
+EXIT_OK = 0
+EXIT_ERRORS = 1        # the run finished, but some files could not be processed
+EXIT_USAGE = 2         # bad arguments (argparse uses 2 as well)
+EXIT_FAILED = 3        # the run was aborted
+EXIT_INTERRUPTED = 130
+
+# Multipliers for the size suffixes accepted by --bytes-per-sec
+SIZE_SUFFIXES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Logging handler that only counts error records, so the exit code can report failed files
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+# Function to parse a size such as 4096, 512K or 20M
+def parse_size(text):
+    multiplier = SIZE_SUFFIXES.get(text[-1:].lower(), 1)
+    number = text[:-1] if multiplier != 1 else text
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+
+# Function to check a layout template while the arguments are parsed
+def parse_layout(text):
+    try:
+        compile_layout(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+# Function to check a shard given as K/N while the arguments are parsed
+def parse_shard(text):
+    try:
+        return parse_shard_text(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+# Function to end a watch on Ctrl-C or SIGTERM once the current batch is done; a second Ctrl-C interrupts it right away
+def stop_on_signals(stop):
+    def handler(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        stop.set()
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+
+# Function to build the argument parser; every organize_files_by_date option has a flag
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pix_jinx', description="Organize photos and videos into folders by the date they were taken.")
+    parser.add_argument('source_folder', nargs='?', help="folder to organize, or a ZIP/TAR archive")
+    parser.add_argument('dest_folder', nargs='?', help="folder to organize into")
+
+    layout = parser.add_argument_group('layout')
+    layout.add_argument('--year-only', action='store_true', help="one folder per year")
+    layout.add_argument('--month-only', action='store_true', help="stop at month folders")
+    layout.add_argument('--day-only', action='store_true', help="add a folder per day")
+    layout.add_argument('--by-type', dest='organize_by_type', action='store_true', help="add a folder per file extension")
+    layout.add_argument('--by-size', dest='organize_by_size', action='store_true', help="add Small/Medium/Large folders")
+    layout.add_argument('--by-name', dest='organize_by_name', action='store_true', help="add a folder per initial")
+    layout.add_argument('--layout', dest='layout_template', type=parse_layout, metavar='TEMPLATE',
+                        help=f"folder template replacing the options above, e.g. '{{year}}/{{month:02}}.{{month_name}}/{{ext}}'; fields: {', '.join(FIELDS)}")
+    layout.add_argument('--rename', dest='rename_files', action='store_true', help="rename files after the date they were taken")
+    layout.add_argument('--ignore-types', default='', help="comma-separated suffixes to leave alone, e.g. .txt,.csv")
+
+    files = parser.add_argument_group('files')
+    files.add_argument('--copy', dest='move_files', action='store_false', help="copy files instead of moving them")
+    files.add_argument('--delete', dest='delete_files', action='store_true', help="delete the originals after copying")
+    files.add_argument('--skip-existing', action='store_true', help="leave files whose target name is taken")
+    files.add_argument('--maintain-metadata', action='store_true', help="keep timestamps and permissions on copies")
+    files.add_argument('--eliminate-duplicates', action='store_true', help="skip files whose content is already in the destination")
+    files.add_argument('--near-duplicates', choices=POLICIES, help="also catch resized or re-encoded copies of images: skip them, keep the highest resolution, or only report them")
+    files.add_argument('--near-duplicate-threshold', type=int, default=DEFAULT_THRESHOLD, metavar='BITS', help=f"largest perceptual hash distance counted as the same picture (default: {DEFAULT_THRESHOLD})")
+    files.add_argument('--perceptual-hash', choices=ALGORITHMS, default='phash', help="perceptual hash used by --near-duplicates (default: phash)")
+    files.add_argument('--copy-mode', choices=COPY_MODES, default='reflink', help="how copies are made (default: reflink, falling back to a plain copy)")
+
+    runs = parser.add_argument_group('dry runs and recovery')
+    runs.add_argument('--dry-run', action='store_true', help="only log what would be done")
+    runs.add_argument('--report', action='store_true', help="only print files and bytes per year, month, type and size class, and duplicate candidates (hashed with --eliminate-duplicates); no dest_folder needed")
+    runs.add_argument('--plan', dest='plan_path', metavar='PATH', help="with --dry-run, write the planned operations to PATH")
+    runs.add_argument('--apply-plan', metavar='PATH', help="execute a plan written by --dry-run --plan instead of organizing")
+    runs.add_argument('--journal', dest='journal_path', metavar='PATH', help="journal every operation to PATH")
+    runs.add_argument('--resume', action='store_true', help="finish the operations an interrupted run left in its journal")
+    runs.add_argument('--rollback', action='store_true', help="with --resume, undo interrupted operations instead")
+
+    shards = parser.add_argument_group('shards', "split a run across processes or machines sharing the source and destination")
+    shards.add_argument('--shard', type=parse_shard, metavar='K/N', help="only organize the K-th of N slices of the source, e.g. 3/8")
+    shards.add_argument('--shard-by', choices=SHARD_MODES,
+                        help="how the source is sliced: by path hash (default), by top-level folder, or by file size, which keeps --eliminate-duplicates exact across shards and is the default and only choice with it")
+    shards.add_argument('--merge-plans', nargs='+', metavar='PLAN', help="merge the plans shards wrote with --dry-run --plan into the --plan file, instead of organizing")
+    shards.add_argument('--merge-stats', nargs='+', metavar='PATH', help="merge the JSON statistics (or --metrics-json files) of shards and print them, instead of organizing")
+
+    watch = parser.add_argument_group('watch mode')
+    watch.add_argument('--watch', action='store_true', help="after organizing, keep organizing new arrivals in the source folder until Ctrl-C or SIGTERM")
+    watch.add_argument('--settle', type=float, default=SETTLE_SECONDS, metavar='SECONDS', help=f"organize a new file once it has stopped changing for this long (default: {SETTLE_SECONDS:g})")
+    watch.add_argument('--poll', action='store_true', help="poll for changes instead of using inotify")
+    watch.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, metavar='SECONDS', help=f"seconds between polls (default: {POLL_INTERVAL:g})")
+
+    performance = parser.add_argument_group('performance')
+    performance.add_argument('--metadata-cache', metavar='PATH', help="metadata cache file (default: the user cache folder)")
+    performance.add_argument('--no-metadata-cache', action='store_true', help="do not read or write the metadata cache")
+    performance.add_argument('--metadata-workers', type=int, metavar='N', help="metadata worker processes (0 parses in this process)")
+    performance.add_argument('--io-workers', type=int, metavar='N', help="threads moving or copying files")
+    performance.add_argument('--queue-size', type=int, metavar='N', help="size of the queues between pipeline stages")
+    performance.add_argument('--fused', action='store_true', help="read files on other devices (e.g. network shares) once, hashing and copying them in the same pass")
+    performance.add_argument('--max-reads', type=int, metavar='N', help="concurrent reads per device")
+    performance.add_argument('--max-writes', type=int, metavar='N', help="concurrent writes per device")
+    performance.add_argument('--bytes-per-sec', type=parse_size, metavar='SIZE', help="bandwidth limit per device, e.g. 20M")
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--log-file', default='file_organizer.log', metavar='PATH', help="log file, or - for stderr (default: file_organizer.log)")
+    output.add_argument('--verbosity', choices=VERBOSITY_LEVELS, default='files', help="files logs every file (default), summary only totals and errors")
+    output.add_argument('-v', '--verbose', dest='verbosity', action='store_const', const='debug', help="same as --verbosity debug")
+    output.add_argument('-q', '--quiet', action='store_true', help="no progress bar")
+    output.add_argument('--metrics-json', metavar='PATH', help="write per-stage metrics to PATH as JSON")
+    output.add_argument('--metrics-prometheus', metavar='PATH', help="write per-stage metrics to PATH in the Prometheus text format")
+    output.add_argument('--profile', metavar='PATH', help="sample the run's threads and metadata worker processes and write collapsed stacks to PATH")
+    return parser
+
+# Function to run the organizer from the command line; returns the exit code
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    merging = args.merge_plans is not None or args.merge_stats is not None
+    if args.apply_plan is None and not merging and (args.source_folder is None or (args.dest_folder is None and not args.report)):
+        parser.error("source_folder and dest_folder are required unless --apply-plan, --merge-plans or --merge-stats is given (--report needs only source_folder)")
+    if args.report and (args.apply_plan is not None or merging or args.watch):
+        parser.error("--report cannot be combined with --apply-plan, --merge-plans, --merge-stats or --watch")
+    if args.plan_path is not None and not (args.dry_run or args.merge_plans is not None):
+        parser.error("--plan requires --dry-run")
+    if args.merge_plans is not None and args.plan_path is None:
+        parser.error("--merge-plans requires --plan for the merged plan")
+    if args.shard is not None and (args.apply_plan is not None or merging):
+        parser.error("--shard cannot be combined with --apply-plan, --merge-plans or --merge-stats")
+    # Only slicing by size gives each shard every copy of a file, so dedupe stays exact across shards
+    if args.eliminate_duplicates and args.shard is not None and args.shard_by not in (None, 'size'):
+        parser.error("--eliminate-duplicates with --shard requires --shard-by size")
+    if args.shard_by is None:
+        args.shard_by = 'size' if args.eliminate_duplicates else 'path'
+    if args.rollback and not args.resume:
+        parser.error("--rollback requires --resume")
+    if args.watch and (args.apply_plan is not None or args.plan_path is not None):
+        parser.error("--watch cannot be combined with --plan or --apply-plan")
+
+    # Merging only reads the shards' files
+    if merging:
+        import shards
+        try:
+            if args.merge_plans is not None:
+                operations, renamed = shards.merge_plans(args.merge_plans, args.plan_path)
+                print(json.dumps({"plans": len(args.merge_plans), "operations": operations, "renamed": renamed}))
+            if args.merge_stats is not None:
+                print(json.dumps(shards.merge_stats(shards.read_stats(args.merge_stats))))
+        except (OSError, ValueError, KeyError) as e:
+            print(json.dumps({"error": str(e)}))
+            return EXIT_FAILED
+        return EXIT_OK
+
+    # Imported only now, so --help and argument errors stay instant
+    import file_organizer
+    from metrics import Metrics
+    from shards import Shard
+
+    file_organizer.setup_logging(None if args.log_file == '-' else args.log_file, args.verbosity)
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+
+    processed = 0
+    metrics = Metrics()
+
+    def progress_callback(done, total):
+        nonlocal processed
+        processed = done
+
+    start_time = time.time()
+    try:
+        if args.apply_plan is not None:
+            metrics.start()
+            try:
+                result = file_organizer.execute_plan(args.apply_plan, args.io_workers, progress_callback, args.copy_mode, args.max_reads, args.max_writes, args.bytes_per_sec, metrics)
+            finally:
+                metrics.finish()
+            if args.metrics_json is not None:
+                metrics.write_json(args.metrics_json)
+            if args.metrics_prometheus is not None:
+                metrics.write_prometheus(args.metrics_prometheus)
+        else:
+            options = {}
+            if args.no_metadata_cache:
+                options['metadata_cache_path'] = None
+            elif args.metadata_cache is not None:
+                options['metadata_cache_path'] = args.metadata_cache
+            if args.queue_size is not None:
+                options['queue_size'] = args.queue_size
+            if args.shard is not None:
+                options['shard'] = Shard(*args.shard, args.source_folder, args.shard_by)
+            if args.report:
+                catalog = file_organizer.catalog_folder(
+                    args.source_folder, [t.strip() for t in args.ignore_types.split(',') if t.strip()],
+                    metadata_workers=args.metadata_workers, progress_callback=progress_callback,
+                    hash_duplicates=args.eliminate_duplicates, exclude=[args.dest_folder] if args.dest_folder else (),
+                    metrics=metrics, **options)
+                report = dict(catalog.summary(), mtime_fallbacks=metrics.counters.get('mtime_fallbacks', 0), errors=errors.count, elapsed_seconds=round(time.time() - start_time, 3))
+                print(json.dumps(report))
+                return EXIT_ERRORS if errors.count else EXIT_OK
+            organize = file_organizer.organize_files_by_date
+            if args.watch:
+                stop = threading.Event()
+                stop_on_signals(stop)
+                organize = partial(file_organizer.watch_and_organize, settle=args.settle, poll_interval=args.poll_interval, stop=stop, use_inotify=not args.poll)
+            result = organize(
+                args.source_folder, args.dest_folder, args.move_files, args.delete_files, args.dry_run,
+                args.year_only, args.day_only, args.month_only, args.rename_files, args.skip_existing,
+                args.maintain_metadata, args.organize_by_type, [t.strip() for t in args.ignore_types.split(',') if t.strip()],
+                args.organize_by_size, args.organize_by_name, args.eliminate_duplicates,
+                progress_callback=progress_callback, metadata_workers=args.metadata_workers, io_workers=args.io_workers,
+                plan_path=args.plan_path, journal_path=args.journal_path, resume=args.resume, rollback=args.rollback,
+                copy_mode=args.copy_mode, max_reads=args.max_reads, max_writes=args.max_writes,
+                bytes_per_sec=args.bytes_per_sec, show_progress=not args.quiet, metrics=metrics,
+                metrics_json=args.metrics_json, metrics_prometheus=args.metrics_prometheus, profile_path=args.profile,
+                near_duplicates=args.near_duplicates, near_duplicate_threshold=args.near_duplicate_threshold,
+                perceptual_hash=args.perceptual_hash, layout_template=args.layout_template, fused=args.fused, **options)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        logging.getLogger(__name__).exception(f"Run failed: {e}")
+        print(json.dumps({"error": str(e), "elapsed_seconds": round(time.time() - start_time, 3)}))
+        return EXIT_FAILED
+
+    # organize_files_by_date and watch_and_organize return None when they refuse the folders they were given
+    if result is None:
+        print(json.dumps({"error": "invalid source or destination folder"}))
+        return EXIT_USAGE
+
+    stats = dict(result, processed=processed, errors=errors.count, dry_run=args.dry_run, elapsed_seconds=round(time.time() - start_time, 3))
+    snapshot = metrics.snapshot()
+    stats["stages"] = {stage: {key: values[key] for key in ("count", "sum", "p50", "p99", "bytes")} for stage, values in snapshot["stages"].items()}
+    stats["counters"] = snapshot["counters"]
+    print(json.dumps(stats))
+    return EXIT_ERRORS if errors.count else EXIT_OK
+
+if __name__ == '__main__':
+    sys.exit(main())
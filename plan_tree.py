@@ -0,0 +1,103 @@
+# Import necessary libraries
+import os
+import json
+import threading
+from array import array
+from collections import namedtuple
+from planner import PLAN_VERSION
+
+# File of a plan: the folder it goes to, its name there, its size and where it comes from
+PlannedFile = namedtuple('PlannedFile', 'folder name size source')
+
+# Folder of a planned destination tree, with the file and byte counts of everything below it
+# Files are not kept: only where their lines start in the plan, so they can be read back when shown
+class PlanFolder:
+    __slots__ = ('name', 'parent', 'folders', 'offsets', 'total_files', 'total_bytes')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.folders = {}
+        self.offsets = array('Q')
+        self.total_files = 0
+        self.total_bytes = 0
+
+    # Function to get the subfolders in name order
+    def subfolders(self):
+        return sorted(self.folders.values(), key=lambda folder: folder.name.casefold())
+
+# Destination tree of a plan written by a dry run (see planner.PlanWriter)
+# The plan is read once to count files and bytes per folder; each file then costs 8 bytes until it is shown
+class PlanTree:
+    def __init__(self, plan_path):
+        self.path = plan_path
+        self.lock = threading.Lock()
+        self.file = open(plan_path, 'rb')
+        try:
+            header = json.loads(self.file.readline())
+            if header.get("version") != PLAN_VERSION:
+                raise ValueError(f"Unsupported plan version in {plan_path}: {header.get('version')}")
+            self.dest_folder = header["dest_folder"]
+            self.root = PlanFolder(os.path.basename(os.path.normpath(self.dest_folder)) or self.dest_folder)
+            self._read()
+        except BaseException:
+            self.file.close()
+            raise
+
+    # Function to file every operation under its target folder
+    def _read(self):
+        folders = {}
+        offset = self.file.tell()
+        for line in self.file:
+            if line.strip():
+                operation = json.loads(line)
+                target_folder = os.path.dirname(operation["dst"])
+                folder = folders.get(target_folder)
+                if folder is None:
+                    folder = folders[target_folder] = self._folder(target_folder)
+                folder.offsets.append(offset)
+                folder.total_bytes += operation["size"]
+            offset += len(line)
+        for folder in folders.values():
+            folder.total_files = len(folder.offsets)
+        self._add_up(self.root)
+
+    # Function to get the folder node of a target folder, creating it and its parents
+    def _folder(self, target_folder):
+        folder = self.root
+        relative = os.path.relpath(target_folder, self.dest_folder)
+        if relative == os.curdir:
+            return folder
+        for name in relative.split(os.sep):
+            child = folder.folders.get(name)
+            if child is None:
+                child = folder.folders[name] = PlanFolder(name, folder)
+            folder = child
+        return folder
+
+    # Function to add the counts of every folder to its parents, leaves first, without recursion
+    def _add_up(self, root):
+        order = []
+        stack = [root]
+        while stack:
+            folder = stack.pop()
+            order.append(folder)
+            stack.extend(folder.folders.values())
+        for folder in reversed(order):
+            if folder.parent is not None:
+                folder.parent.total_files += folder.total_files
+                folder.parent.total_bytes += folder.total_bytes
+
+    # Function to read count files of a folder from the plan, starting with the start-th
+    def files(self, folder, start, count):
+        files = []
+        with self.lock:
+            for offset in folder.offsets[start:start + count]:
+                self.file.seek(offset)
+                operation = json.loads(self.file.readline())
+                files.append(PlannedFile(folder, os.path.basename(operation["dst"]), operation["size"], operation["src"]))
+        return files
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,148 @@
+# Import necessary libraries
+import os
+import sys
+import json
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Version of the plan file format
+PLAN_VERSION = 1
+
+# Windows and macOS file systems are case-insensitive by default, so names there are compared casefolded
+CASE_INSENSITIVE = sys.platform in ('win32', 'darwin')
+
+# Function to get the key a name is reserved under
+def _name_key(name):
+    return name.casefold() if CASE_INSENSITIVE else name
+
+# In-memory reservation of target names, one table per target folder
+# Each folder is listed once; after that, collisions are resolved without touching the disk
+class NameReserver:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = {}
+        self.counters = {}
+        self.created = set()
+
+    # Names already present in a folder, listed on first use; the caller must hold the lock
+    def _taken(self, folder):
+        taken = self.folders.get(folder)
+        if taken is None:
+            try:
+                with os.scandir(folder) as entries:
+                    taken = {_name_key(entry.name) for entry in entries}
+            except FileNotFoundError:
+                taken = set()
+            self.folders[folder] = taken
+        return taken
+
+    # Function to reserve a name in a folder
+    # Returns the reserved name, which gets a '(n)' suffix when taken, or None if it is taken and skip_existing is set
+    def reserve(self, folder, name, skip_existing=False):
+        with self.lock:
+            taken = self._taken(folder)
+            if _name_key(name) not in taken:
+                taken.add(_name_key(name))
+                return name
+            if skip_existing:
+                return None
+            # Split off only the last extension, so 'a.b.jpg' becomes 'a.b(1).jpg'
+            stem, ext = os.path.splitext(name)
+            key = (folder, _name_key(name))
+            i = self.counters.get(key, 1)
+            while _name_key(f"{stem}({i}){ext}") in taken:
+                i += 1
+            self.counters[key] = i + 1
+            name = f"{stem}({i}){ext}"
+            taken.add(_name_key(name))
+            return name
+
+    # Give back a reserved name that ended up unused
+    def release(self, folder, name):
+        with self.lock:
+            self.folders.get(folder, set()).discard(_name_key(name))
+
+    # Function to make sure a folder exists, creating each folder only once per run
+    # Returns False if the folder could not be created
+    def ensure_folder(self, folder, dry_run=False):
+        with self.lock:
+            if folder in self.created:
+                return True
+            if dry_run:
+                logger.info(f"Would create folder {folder}")
+            else:
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                except OSError as e:
+                    logger.error(f"Unable to create folder {folder}: {e}")
+                    return False
+            self.created.add(folder)
+            return True
+
+# Function to create every folder of a plan up front, parents before children
+def create_folders(folders, dry_run=False):
+    failed = set()
+    for folder in sorted(set(folders)):
+        if dry_run:
+            logger.info(f"Would create folder {folder}")
+            continue
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Unable to create folder {folder}: {e}")
+            failed.add(folder)
+    return failed
+
+# Writes a move plan as JSON Lines: a header with the run's options, then one line per operation
+class PlanWriter:
+    def __init__(self, path, source_folder, dest_folder, move_files, delete_files, rename_files, maintain_metadata):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', encoding='utf-8')
+        header = {"version": PLAN_VERSION, "source_folder": source_folder, "dest_folder": dest_folder, "move_files": move_files, "delete_files": delete_files, "rename_files": rename_files, "maintain_metadata": maintain_metadata}
+        self.file.write(json.dumps(header) + '\n')
+        self.count = 0
+
+    # Function to record one planned operation
+    def add(self, source, target, size, mtime_ns):
+        line = json.dumps({"src": source, "dst": target, "size": size, "mtime_ns": mtime_ns}, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        logger.info(f"Wrote plan with {self.count} operations to {self.path}")
+
+# Function to count the operations in a plan file from its line breaks, without decoding any of them
+def count_plan(path):
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(1024 * 1024)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+# Function to read a plan file, returning its header and a generator of operations
+def read_plan(path):
+    file = open(path, 'r', encoding='utf-8')
+    header = json.loads(file.readline())
+    if header.get("version") != PLAN_VERSION:
+        file.close()
+        raise ValueError(f"Unsupported plan version in {path}: {header.get('version')}")
+
+    def operations():
+        with file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    return header, operations()
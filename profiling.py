@@ -0,0 +1,100 @@
+# Import necessary libraries
+import re
+import sys
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+
+# Modules whose frames at the top of a stack mean the thread is idle, waiting for work
+IDLE_MODULES = ('threading.py', 'queue.py', 'selectors.py', 'connection.py')
+
+# Profiler of this process when it is a metadata worker; see start_worker_profiler
+_worker_profiler = None
+
+# Sampling profiler covering every thread of the process
+# cProfile only sees the thread that enabled it, while a run does its work in pipeline threads;
+# sampling each thread's stack at a fixed interval sees all of them at a small, constant cost
+# Samples are written as collapsed stacks ("frame;frame;frame count"), which flame graph tools read directly
+# Worker processes sample themselves and hand their stacks back with each result (see profiled_call)
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Group by thread name without the pool's numeric suffix
+                thread_name = re.sub(r'_\d+$', '', names.get(ident, str(ident)))
+                with self.lock:
+                    self.stacks[(thread_name,) + tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    # Function to take the stacks sampled so far, leaving the profiler empty
+    def drain(self):
+        with self.lock:
+            stacks, self.stacks = self.stacks, Counter()
+        return stacks
+
+    # Function to add stacks sampled in another process, filed under that process's name
+    def merge(self, stacks, process_name):
+        with self.lock:
+            for stack, count in stacks.items():
+                self.stacks[(process_name,) + stack[1:]] += count
+
+    # Function to count samples per innermost frame, i.e. where time was actually spent, leaving out idle threads
+    def top(self, n=15):
+        own = Counter()
+        for stack, count in self.stacks.items():
+            if not stack[-1].rsplit(':', 1)[0].endswith(IDLE_MODULES):
+                own[stack[-1]] += count
+        return own.most_common(n)
+
+    # Function to write the samples as collapsed stacks, worker processes' included
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{';'.join(stack)} {count}\n")
+        logger.info(f"Wrote {self.samples} profile samples to {path}")
+        for frame, count in self.top():
+            logger.info(f"Profile: {count} samples in {frame}")
+
+# Function run in each metadata worker process when the run is profiled: sample the worker's own threads
+def start_worker_profiler(interval=SAMPLE_INTERVAL):
+    global _worker_profiler
+    _worker_profiler = SamplingProfiler(interval).start()
+
+# Function run in a worker process instead of function(*args) when the run is profiled
+# Returns (function(*args), the stacks the worker sampled since its last call) for the parent to merge
+def profiled_call(function, *args):
+    result = function(*args)
+    return result, _worker_profiler.drain() if _worker_profiler is not None else Counter()
@@ -0,0 +1,127 @@
+# Import necessary libraries
+import os
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# File found by the scanner, carrying the stat data the walk already fetched
+# The st_* field names let an entry stand in for an os.stat_result in the caches and hash engine
+ScanEntry = namedtuple('ScanEntry', 'path st_size st_mtime_ns st_dev st_ino')
+
+# Folders a walk must leave out, matched by (st_dev, st_ino) when they exist
+# A folder that does not exist yet, such as a destination nested in the source that the run is about to
+# create, is matched by its resolved path instead; folders are only resolved when their name matches
+class ExcludedFolders:
+    def __init__(self, folders=()):
+        self.ids = set()
+        self.missing = set()
+        for folder in folders:
+            try:
+                stat = os.stat(folder)
+                self.ids.add((stat.st_dev, stat.st_ino))
+            except FileNotFoundError:
+                self.missing.add(os.path.realpath(folder))
+            except OSError:
+                pass
+        # DirEntry.inode() is free on POSIX, so only stat folders whose inode matches an excluded one
+        self.inodes = {ino for dev, ino in self.ids}
+        self.missing_names = {os.path.basename(folder) for folder in self.missing}
+
+    # Function to check a folder found by os.scandir
+    def excludes_entry(self, entry):
+        if entry.inode() in self.inodes:
+            stat = entry.stat(follow_symlinks=False)
+            if (stat.st_dev, stat.st_ino) in self.ids:
+                return True
+        return entry.name in self.missing_names and os.path.realpath(entry.path) in self.missing
+
+    # Function to check a folder given its path and stat result
+    def excludes(self, path, stat):
+        if (stat.st_dev, stat.st_ino) in self.ids:
+            return True
+        return os.path.basename(path) in self.missing_names and os.path.realpath(path) in self.missing
+
+# Streaming scanner: walks a tree with os.scandir and yields matching files as it finds them
+class Scanner:
+    # file_types: extensions to include (e.g. '.jpg'), or None for every file
+    # ignore_types: suffixes to leave out, matched like str.endswith
+    # exclude: folders never to descend into, such as a destination nested in the source
+    # shard: a shards.Shard; only its files are yielded, and in 'folder' mode only its folders are walked
+    def __init__(self, source_folder, file_types=None, ignore_types=(), exclude=(), shard=None):
+        self.source_folder = source_folder
+        self.shard = shard
+        self.file_types = None if file_types is None else frozenset(t.lower() for t in file_types)
+        self.ignore_types = tuple(t.lower() for t in ignore_types if t)
+        self.excluded = ExcludedFolders(exclude)
+
+        # Progress counters, read by other threads while the scan runs
+        self.files_found = 0
+        self.dirs_scanned = 0
+        self.dirs_pending = 0
+        self.done = False
+
+    # Total number of matching files, extrapolated from the folders scanned so far until the scan ends
+    def estimated_total(self):
+        if self.done or self.dirs_scanned == 0:
+            return self.files_found
+        return self.files_found + round(self.dirs_pending * self.files_found / self.dirs_scanned)
+
+    # Function to check whether a file name should be yielded
+    def _wanted(self, name):
+        lower = name.lower()
+        if self.file_types is not None and os.path.splitext(lower)[1] not in self.file_types:
+            return False
+        return not (self.ignore_types and lower.endswith(self.ignore_types))
+
+    def __iter__(self):
+        stack = [self.source_folder]
+        self.dirs_pending = 1
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.excluded.excludes_entry(entry):
+                                    continue
+                                if self.shard is not None and not self.shard.owns_folder(entry.path):
+                                    continue
+                                stack.append(entry.path)
+                                self.dirs_pending += 1
+                            elif self._wanted(entry.name) and entry.is_file():
+                                if self.shard is not None and not self.shard.owns_path(entry.path):
+                                    continue
+                                stat = entry.stat()
+                                if self.shard is not None and not self.shard.owns(entry.path, stat.st_size):
+                                    continue
+                                self.files_found += 1
+                                yield ScanEntry(entry.path, stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino)
+                        except FileNotFoundError as e:
+                            # Other shards move their files away while this one walks past them
+                            if self.shard is None:
+                                logger.error(f"Unable to scan {entry.path}: {e}")
+                        except OSError as e:
+                            logger.error(f"Unable to scan {entry.path}: {e}")
+            except OSError as e:
+                logger.error(f"Unable to scan folder {folder}: {e}")
+            self.dirs_scanned += 1
+            self.dirs_pending -= 1
+        self.done = True
+
+    # Function to yield the wanted files among the given paths instead of walking the tree, e.g. new arrivals in a watched folder
+    def entries(self, paths):
+        for path in paths:
+            if not self._wanted(os.path.basename(path)) or (self.shard is not None and not self.shard.owns_path(path)):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.error(f"Unable to scan {path}: {e}")
+                continue
+            if self.shard is not None and not self.shard.owns(path, stat.st_size):
+                continue
+            self.files_found += 1
+            yield ScanEntry(path, stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino)
+        self.done = True
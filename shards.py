@@ -0,0 +1,164 @@
+# Import necessary libraries
+import os
+import zlib
+import json
+import logging
+from planner import NameReserver, PlanWriter, read_plan
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# How a source tree is split between shards:
+# 'path' spreads files evenly by the hash of their path, 'folder' keeps each top-level folder together
+# (other shards never even list it), and 'size' keeps files of equal size together, so every duplicate
+# decision is made by a single shard
+SHARD_MODES = ('path', 'folder', 'size')
+
+# Plan header fields that have to agree before plans can be merged
+PLAN_KEYS = ('source_folder', 'dest_folder', 'move_files', 'delete_files', 'rename_files', 'maintain_metadata')
+
+# Run statistics that add up over shards; elapsed_seconds is the longest shard instead
+STATS_TOTALS = ('moved', 'copied', 'renamed', 'deleted', 'processed', 'errors')
+
+# Function to parse a shard given as K/N, with K counted from 1
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text!r}; expected K/N, e.g. 3/8")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {text!r}; K must be between 1 and N")
+    return index, count
+
+# One slice of a run split across processes or machines sharing the same source and destination
+# Every shard computes the same partition on its own: keys are hashed with CRC-32 over the path relative
+# to the source, with '/' separators, so workers on different hosts agree as long as they see the same tree
+class Shard:
+    def __init__(self, index, count, source_folder, mode='path'):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode {mode}; expected one of {', '.join(SHARD_MODES)}")
+        self.index = index
+        self.count = count
+        self.source_folder = source_folder
+        self.mode = mode
+        self.tag = f"shard{index}of{count}"
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    # Function to check whether a key falls in this shard
+    def _owns_key(self, key):
+        return zlib.crc32(key.encode('utf-8', 'surrogateescape')) % self.count == self.index - 1
+
+    # Function to get a path relative to the source, the same on every platform
+    def _relative(self, path):
+        return os.path.relpath(path, self.source_folder).replace(os.sep, '/')
+
+    # Function to check whether a folder has to be listed at all; only 'folder' shards skip any
+    def owns_folder(self, path):
+        if self.mode != 'folder' or os.path.dirname(path) != self.source_folder.rstrip(os.sep):
+            return True
+        return self._owns_key(self._relative(path))
+
+    # Function to check whether a file may belong to this shard by its path alone, before it is stat'ed
+    # In 'folder' mode files below a top-level folder follow it; files at the top are hashed by name
+    def owns_path(self, path):
+        if self.mode == 'size':
+            return True
+        relative = self._relative(path)
+        if self.mode == 'folder':
+            relative = relative.split('/', 1)[0]
+        return self._owns_key(relative)
+
+    # Function to check whether a file belongs to this shard
+    def owns(self, path, size):
+        if self.mode == 'size':
+            return size % self.count == self.index - 1
+        return self.owns_path(path)
+
+    # Function to give a destination sidecar (index, staging folder) a name of its own to this shard,
+    # so shards sharing a destination never write to each other's files
+    def sidecar_name(self, name):
+        stem, extension = os.path.splitext(name)
+        return f"{stem}.{self.tag}{extension}"
+
+# Function to merge the plans written by shards run with --dry-run --plan into a single plan
+# Shards reserve target names independently, so two of them may plan the same target; later ones get
+# the next free '(n)' name. Returns (operations, renamed)
+def merge_plans(plan_paths, out_path):
+    headers = []
+    plans = []
+    for path in plan_paths:
+        header, operations = read_plan(path)
+        headers.append(header)
+        plans.append(operations)
+    for path, header in zip(plan_paths[1:], headers[1:]):
+        for key in PLAN_KEYS:
+            if header.get(key) != headers[0].get(key):
+                raise ValueError(f"Plan {path} has a different {key} than {plan_paths[0]}; only plans of the same run can be merged")
+
+    first = headers[0]
+    writer = PlanWriter(out_path, *(first[key] for key in PLAN_KEYS))
+    reserver = NameReserver()
+    total = 0
+    renamed = 0
+    try:
+        for operations in plans:
+            for operation in operations:
+                folder, name = os.path.split(operation["dst"])
+                reserved = reserver.reserve(folder, name)
+                if reserved != name:
+                    logger.info(f"Planned target {operation['dst']} is taken by another shard; using {reserved}")
+                    renamed += 1
+                writer.add(operation["src"], os.path.join(folder, reserved), operation["size"], operation["mtime_ns"])
+                total += 1
+    finally:
+        writer.close()
+    return total, renamed
+
+# Function to merge the JSON statistics shards print, or the metrics they write with --metrics-json
+# Run statistics add up; stage percentiles become the largest of the shards', an upper bound of the
+# true percentile. Metrics snapshots keep their histograms, so they merge exactly; returns a dict either way
+def merge_stats(documents):
+    if all("extensions" in document for document in documents):
+        merged = Metrics()
+        for snapshot in documents:
+            merged.merge(snapshot)
+        return merged.snapshot()
+    merged = {key: 0 for key in STATS_TOTALS}
+    merged["dry_run"] = False
+    merged["elapsed_seconds"] = 0
+    stages = {}
+    counters = {}
+    for document in documents:
+        for key in STATS_TOTALS:
+            merged[key] += document.get(key, 0)
+        merged["dry_run"] = merged["dry_run"] or document.get("dry_run", False)
+        merged["elapsed_seconds"] = max(merged["elapsed_seconds"], document.get("elapsed_seconds", 0))
+        for stage, values in document.get("stages", {}).items():
+            total = stages.setdefault(stage, {"count": 0, "sum": 0.0, "p50": None, "p99": None, "bytes": 0})
+            for key in ("count", "sum", "bytes"):
+                total[key] += values.get(key) or 0
+            for key in ("p50", "p99"):
+                if values.get(key) is not None:
+                    total[key] = max(total[key] or 0, values[key])
+        for event, count in document.get("counters", {}).items():
+            counters[event] = counters.get(event, 0) + count
+    for values in stages.values():
+        values["sum"] = round(values["sum"], 6)
+    merged["shards"] = len(documents)
+    merged["stages"] = stages
+    merged["counters"] = counters
+    return merged
+
+# Function to read statistics files for merge_stats: JSON documents, or JSON lines such as a shard's saved output
+def read_stats(paths):
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        try:
+            documents.append(json.loads(text))
+        except ValueError:
+            documents += [json.loads(line) for line in text.splitlines() if line.strip()]
+    return documents
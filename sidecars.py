@@ -0,0 +1,77 @@
+# Import necessary libraries
+import os
+import re
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Google Takeout describes photo.jpg in photo.jpg.json, or in newer exports in
+# photo.jpg.supplemental-metadata.json, cut short when the name gets too long (photo.jpg.supplemental-met.json)
+SIDECAR_SUFFIX = '.json'
+SUPPLEMENTAL = '.supplemental-metadata'
+
+# Copies with the same name are numbered: photo(1).jpg is described by photo.jpg(1).json
+COUNTER = re.compile(r'\(\d+\)$')
+
+# Sidecars are small; anything larger is not one
+MAX_SIDECAR_SIZE = 1024 * 1024
+
+# Function to list the sidecar names that may describe a file, most common first
+def sidecar_names(filename):
+    names = [filename + SIDECAR_SUFFIX, filename + SUPPLEMENTAL + SIDECAR_SUFFIX]
+    stem, extension = os.path.splitext(filename)
+    match = COUNTER.search(stem)
+    if match:
+        original = stem[:match.start()] + extension
+        names += [original + match.group() + SIDECAR_SUFFIX, original + SUPPLEMENTAL + match.group() + SIDECAR_SUFFIX]
+    return names
+
+# Function to work out which file a sidecar describes from its name; the inverse of sidecar_names
+# Returns None for names that do not look like sidecars
+def described_name(sidecar_name):
+    if not sidecar_name.lower().endswith(SIDECAR_SUFFIX):
+        return None
+    name = sidecar_name[:-len(SIDECAR_SUFFIX)]
+    counter = ''
+    match = COUNTER.search(name)
+    if match:
+        counter = match.group()
+        name = name[:match.start()]
+    # Drop the supplemental-metadata part, however much of it survived truncation
+    base, last = os.path.splitext(name)
+    if base and len(last) > 2 and SUPPLEMENTAL.startswith(last.lower()):
+        name = base
+    stem, extension = os.path.splitext(name)
+    if not extension:
+        return None
+    return stem + counter + extension
+
+# Function to read the capture date from a sidecar's contents
+# Returns a date in the EXIF format, in local time like modification times, or None
+def sidecar_date(data):
+    try:
+        metadata = json.loads(data)
+        for field in ('photoTakenTime', 'creationTime'):
+            timestamp = int((metadata.get(field) or {}).get('timestamp', 0))
+            if timestamp > 0:
+                return datetime.fromtimestamp(timestamp).strftime('%Y:%m:%d %H:%M:%S')
+    except (ValueError, TypeError, AttributeError, OverflowError, OSError) as e:
+        logger.debug(f"Unable to read sidecar: {e}")
+    return None
+
+# Function to read the capture date of a file from a sidecar next to it, if it has one
+def read_sidecar_date(path):
+    folder, filename = os.path.split(path)
+    for name in sidecar_names(filename):
+        try:
+            with open(os.path.join(folder, name), 'rb') as file:
+                data = file.read(MAX_SIDECAR_SIZE + 1)
+        except OSError:
+            continue
+        if len(data) <= MAX_SIDECAR_SIZE:
+            date_taken = sidecar_date(data)
+            if date_taken is not None:
+                return date_taken
+    return None
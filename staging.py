@@ -0,0 +1,99 @@
+# Import necessary libraries
+import os
+import time
+import shutil
+import logging
+import threading
+from hashing import new_hasher, CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Folder of the destination files are streamed into before they are renamed into place
+# Staging on the destination's file system makes placing a file a rename rather than a second copy
+STAGING_FOLDER = '.pixjinx_ingest'
+
+# Hasher fed a stream as it passes, producing the same full and head+tail hashes as hashing.HashEngine
+class StreamHasher:
+    def __init__(self, algorithm, partial_size):
+        self.algorithm = algorithm
+        self.partial_size = partial_size
+        self.full = new_hasher(algorithm)
+        self.size = 0
+        self.head = b''
+        self.tail = b''
+
+    def update(self, chunk):
+        self.full.update(chunk)
+        self.size += len(chunk)
+        if len(self.head) < self.partial_size:
+            self.head += bytes(chunk[:self.partial_size - len(self.head)])
+        if len(chunk) >= self.partial_size:
+            self.tail = bytes(chunk[-self.partial_size:])
+        else:
+            self.tail = (self.tail + bytes(chunk))[-self.partial_size:]
+
+    # Function to get the (full, partial) hashes of everything seen
+    # Streams no larger than head + tail have a partial hash equal to their full hash, as in hashing.hash_file_partial
+    def digests(self):
+        full = self.full.hexdigest()
+        if self.size <= 2 * self.partial_size:
+            return full, full
+        partial = new_hasher(self.algorithm)
+        partial.update(self.size.to_bytes(8, 'little'))
+        partial.update(self.head)
+        partial.update(self.tail)
+        return full, partial.hexdigest()
+
+# Streams files into the staging folder in one sequential read each
+# With a hash engine, every chunk also feeds the content hashes, which are recorded for the staged copy
+# so duplicate checks and the destination index never read it again
+class Stager:
+    # metrics, a metrics.Metrics, times each streamed file under the stage stage() is given
+    # folder_name lets processes sharing a destination stage apart (see shards.Shard)
+    def __init__(self, dest_folder, hash_engine=None, metrics=None, folder_name=STAGING_FOLDER):
+        self.folder = os.path.join(dest_folder, folder_name)
+        self.hash_engine = hash_engine
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.staged = 0
+
+    # Function to stream an open binary file into the staging folder; returns the staged path
+    # The copy keeps name's extension, so date readers recognize it, and gets mtime_ns as its modification time
+    def stage(self, file, name, mtime_ns, stage='stream'):
+        with self.lock:
+            if self.staged == 0:
+                os.makedirs(self.folder, exist_ok=True)
+            self.staged += 1
+            staged = os.path.join(self.folder, f"{self.staged}_{os.path.basename(name)}")
+        hasher = None
+        if self.hash_engine is not None:
+            hasher = StreamHasher(self.hash_engine.algorithm, self.hash_engine.partial_size)
+        buf = bytearray(CHUNK_SIZE)
+        view = memoryview(buf)
+        nbytes = 0
+        start = time.perf_counter()
+        try:
+            with open(staged, 'wb') as target:
+                while True:
+                    n = file.readinto(buf)
+                    if not n:
+                        break
+                    target.write(view[:n])
+                    if hasher is not None:
+                        hasher.update(view[:n])
+                    nbytes += n
+            os.utime(staged, ns=(mtime_ns, mtime_ns))
+        except BaseException:
+            if os.path.lexists(staged):
+                os.remove(staged)
+            raise
+        if hasher is not None:
+            self.hash_engine.record(os.stat(staged), *hasher.digests())
+        if self.metrics is not None:
+            self.metrics.observe(stage, time.perf_counter() - start, nbytes)
+        logger.debug(f"Streamed {name} to {staged}")
+        return staged
+
+    # Function to remove the staging folder and anything a failed placement left in it
+    def close(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
@@ -0,0 +1,210 @@
+# Import necessary libraries
+import os
+import uuid
+import errno
+import shutil
+import threading
+import logging
+
+# fcntl (for reflinks) only exists on POSIX
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the temporary name a file is written under until it is complete
+PART_SUFFIX = '.pixjinx-part'
+
+# Function to get the temporary name a writer tagged tag writes target under
+# Every Transfer has its own tag, so processes sharing a destination never write to the same part file;
+# journals written before tags existed used the bare suffix
+def part_path(target, tag=None):
+    return f"{target}.{tag}{PART_SUFFIX}" if tag else target + PART_SUFFIX
+
+# ioctl request that clones a file's extents on btrfs, XFS and other copy-on-write file systems
+FICLONE = 0x40049409
+
+# Largest chunk handed to a single copy_file_range/sendfile call
+KERNEL_CHUNK = 1 << 30
+
+# Copy modes, from cheapest to most expensive fallback chain:
+# 'reflink' clones extents when source and target share a copy-on-write file system,
+# 'hardlink' links the target to the source's inode on the same file system,
+# 'copy' always duplicates the bytes, in the kernel where possible
+# Every mode falls back to the next cheaper method that works, ending with a userspace copy
+COPY_MODES = ('reflink', 'hardlink', 'copy')
+
+# Errors meaning a method is not available between two file systems, rather than that the copy failed
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EPERM, errno.EBADF}
+
+# Raised by an exclusive transfer when something else took the target name first
+class TargetExistsError(FileExistsError):
+    pass
+
+# Function to clone a file's extents
+def _reflink(source, target):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+# Function to copy a file in the kernel with copy_file_range
+def _copy_file_range(source, target):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        while os.copy_file_range(src.fileno(), dst.fileno(), KERNEL_CHUNK):
+            pass
+
+# Function to copy a file in the kernel with sendfile
+def _sendfile(source, target):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        offset = 0
+        while True:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, KERNEL_CHUNK)
+            if sent == 0:
+                break
+            offset += sent
+
+# Function to copy a file through userspace; shutil still uses the platform's fast path where it has one
+def _userspace(source, target):
+    shutil.copyfile(source, target)
+
+COPY_METHODS = {
+    'reflink': _reflink,
+    'copy_file_range': _copy_file_range,
+    'sendfile': _sendfile,
+    'userspace': _userspace,
+}
+
+# Transfer strategy: picks the cheapest way to get a file to its target given the devices involved
+# Methods that fail as unsupported between two devices are remembered and not tried again
+# With exclusive=True targets are never replaced, for processes sharing a destination (see shards.Shard):
+# files are linked into place, which fails when the name is taken, and TargetExistsError is raised
+class Transfer:
+    def __init__(self, copy_mode='reflink', exclusive=False):
+        if copy_mode not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode {copy_mode}; expected one of {', '.join(COPY_MODES)}")
+        self.copy_mode = copy_mode
+        self.exclusive = exclusive
+        self.link_unsupported = set()
+        self.lock = threading.Lock()
+        self.unsupported = {}
+        self.folder_devices = {}
+        # Tag of this writer's part files, unique across processes and hosts (see part_path)
+        self.part_tag = uuid.uuid4().hex[:12]
+
+    # Function to get the device a folder lives on, cached per folder
+    def device_of(self, folder):
+        device = self.folder_devices.get(folder)
+        if device is None:
+            device = self.folder_devices[folder] = os.stat(folder).st_dev
+        return device
+
+    # Methods to try, in order, for a copy between two devices
+    def _methods(self, same_device):
+        methods = []
+        if self.copy_mode == 'hardlink' and same_device:
+            methods.append('hardlink')
+        if self.copy_mode in ('reflink', 'hardlink') and same_device:
+            methods.append('reflink')
+        methods += ['copy_file_range', 'sendfile', 'userspace']
+        return methods
+
+    # Function to copy source to target with the first method that works; returns the method used
+    def _copy_data(self, source, target, devices):
+        with self.lock:
+            unsupported = self.unsupported.setdefault(devices, set())
+        for method in self._methods(devices[0] == devices[1]):
+            if method in unsupported:
+                continue
+            try:
+                if method == 'hardlink':
+                    # The claimed part file is in the way of the link
+                    os.remove(target)
+                    os.link(source, target)
+                else:
+                    COPY_METHODS[method](source, target)
+                return method
+            except OSError as e:
+                if method == 'userspace' or e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                with self.lock:
+                    unsupported.add(method)
+                logger.debug(f"{method} unavailable from device {devices[0]} to {devices[1]}: {e}")
+                if os.path.lexists(target):
+                    os.remove(target)
+
+    # Function to put a complete file in place under target, never replacing an existing file
+    # Links are atomic on local and network file systems alike; where there are none, the name is checked first
+    def _place(self, source, target, device):
+        if device not in self.link_unsupported:
+            try:
+                os.link(source, target)
+            except FileExistsError:
+                raise TargetExistsError(errno.EEXIST, "Target exists", target)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                with self.lock:
+                    self.link_unsupported.add(device)
+                logger.debug(f"Links unavailable on device {device}, placing files without them: {e}")
+            else:
+                os.remove(source)
+                return
+        if os.path.lexists(target):
+            raise TargetExistsError(errno.EEXIST, "Target exists", target)
+        os.rename(source, target)
+
+    # Function to rename a file within its device to target, raising TargetExistsError instead of replacing anything
+    def place(self, source, target):
+        self._place(source, target, self.device_of(os.path.dirname(target)))
+
+    # Function to copy a file, writing it under a temporary name until it is complete
+    # Metadata is copied as shutil.copy2 would; hard links share it already
+    # The part file is created exclusively: when it exists, another thread of this writer is copying to the
+    # same target, and the name counts as taken
+    def copy(self, source, target, source_stat=None):
+        if source_stat is None:
+            source_stat = os.stat(source)
+        devices = (source_stat.st_dev, self.device_of(os.path.dirname(target)))
+        part = part_path(target, self.part_tag)
+        try:
+            os.close(os.open(part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        except FileExistsError:
+            raise TargetExistsError(errno.EEXIST, "Target is being written", target)
+        try:
+            method = self._copy_data(source, part, devices)
+            if method != 'hardlink':
+                shutil.copystat(source, part)
+            if self.exclusive:
+                self._place(part, target, devices[1])
+            else:
+                os.replace(part, target)
+        except BaseException:
+            if os.path.lexists(part):
+                os.remove(part)
+            raise
+        return method
+
+    # Function to move a file: a rename on the same device, otherwise a copy followed by removing the source
+    def move(self, source, target, source_stat=None):
+        if source_stat is None:
+            source_stat = os.stat(source)
+        if source_stat.st_dev == self.device_of(os.path.dirname(target)):
+            try:
+                if self.exclusive:
+                    self._place(source, target, source_stat.st_dev)
+                else:
+                    os.rename(source, target)
+                return 'rename'
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        method = self.copy(source, target, source_stat)
+        os.remove(source)
+        return method
@@ -0,0 +1,291 @@
+# Import necessary libraries
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+from scanner import ExcludedFolders
+
+logger = logging.getLogger(__name__)
+
+# Seconds a file's size and modification time must stay put before it is organized, so partly written files are left alone
+SETTLE_SECONDS = 3.0
+
+# Seconds between polls when inotify is not available
+POLL_INTERVAL = 2.0
+
+# Longest a watcher blocks before checking whether it should stop
+STOP_CHECK_INTERVAL = 1.0
+
+# inotify event flags (see inotify(7))
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events a folder is watched for; writes in progress are caught by re-checking files before they settle
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO | IN_ATTRIB | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+# Header of an inotify event: watch descriptor, mask, cookie, length of the name that follows
+EVENT_HEADER = struct.Struct('iIII')
+
+# Minimal inotify binding over libc; raises OSError where inotify is unavailable
+class Inotify:
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify is not available: {e}")
+        self.ctypes = ctypes
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+
+    # Function to watch a folder; returns False when it cannot be watched (it vanished, or the watch limit was hit)
+    def add(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            logger.warning(f"Unable to watch {folder}: {os.strerror(self.ctypes.get_errno())}")
+            return False
+        self.paths[wd] = folder
+        return True
+
+    # Function to wait up to timeout seconds for events; returns [(folder, name, mask)]
+    # A queue overflow is reported as (None, None, IN_Q_OVERFLOW)
+    def read(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            events.append((self.paths.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+# Watches a source folder and hands settled new or changed files to organize(paths) in batches, or yields
+# them from batches() to a caller that organizes them itself
+# Keeps a snapshot of folder modification times and of each file's (size, mtime), so only new or
+# changed files are organized. Changes come from inotify where available, otherwise from polling the
+# folders whose modification time changed. A file is handed over once it has kept the same size and
+# modification time for settle seconds
+class Watcher:
+    # exclude: folders never to watch, such as a destination nested in the source
+    def __init__(self, source_folder, organize=None, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, exclude=(), use_inotify=True):
+        self.source_folder = source_folder
+        self.organize = organize
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.excluded = ExcludedFolders(exclude)
+        # Folder modification times and file (size, mtime_ns) as last seen
+        self.folders = {}
+        self.files = {}
+        # Files waiting to settle: path -> (size, mtime_ns, monotonic time of the last change)
+        self.pending = {}
+        # Files that have settled and wait to be organized
+        self.ready = []
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                logger.info(f"Watching {source_folder} by polling every {poll_interval}s: {e}")
+
+    # Function to record a folder tree in the snapshot, watching its folders
+    # With pend=True the files found are treated as new arrivals
+    def _snapshot(self, folder, pend=False):
+        stack = [folder]
+        now = time.monotonic()
+        while stack:
+            folder = stack.pop()
+            try:
+                stat = os.stat(folder)
+                if self.excluded.excludes(folder, stat):
+                    continue
+                if self.inotify is not None and folder not in self.folders:
+                    self.inotify.add(folder)
+                self.folders[folder] = stat.st_mtime_ns
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            self._seen(entry.path, entry.stat(), pend, now)
+            except OSError as e:
+                logger.debug(f"Unable to scan {folder}: {e}")
+                self.folders.pop(folder, None)
+
+    # Function to note a file; new or changed files start (or restart) settling
+    def _seen(self, path, stat, pend, now):
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if not pend:
+            self.files[path] = signature
+        elif self.files.get(path) != signature and path not in self.pending:
+            if time.time() - stat.st_mtime_ns / 1e9 >= self.settle:
+                # Unchanged for long enough already, like files that were there before the watch began or were renamed into place
+                self.files[path] = signature
+                self.ready.append(path)
+            else:
+                self.pending[path] = signature + (now,)
+
+    # Function to find changes by polling: only folders whose modification time changed are listed again
+    # A file edited in place leaves its folder's modification time alone, so the known files of the other
+    # folders are stat'ed as well
+    def _poll(self):
+        rescanned = set()
+        for folder, mtime_ns in list(self.folders.items()):
+            try:
+                changed = os.stat(folder).st_mtime_ns != mtime_ns
+            except OSError:
+                self.folders.pop(folder, None)
+                continue
+            if changed:
+                self._rescan(folder)
+                rescanned.add(folder)
+        now = time.monotonic()
+        for path, signature in list(self.files.items()):
+            if path in self.pending or os.path.dirname(path) in rescanned:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.files.pop(path, None)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                self._seen(path, stat, True, now)
+
+    # Function to list a folder again, picking up new files and new subfolders
+    def _rescan(self, folder):
+        now = time.monotonic()
+        try:
+            self.folders[folder] = os.stat(folder).st_mtime_ns
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in self.folders:
+                            self._snapshot(entry.path, pend=True)
+                    elif entry.is_file():
+                        self._seen(entry.path, entry.stat(), True, now)
+        except OSError as e:
+            logger.debug(f"Unable to scan {folder}: {e}")
+            self.folders.pop(folder, None)
+
+    # Function to apply inotify events to the snapshot
+    def _events(self, timeout):
+        now = time.monotonic()
+        for folder, name, mask in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                logger.warning(f"Missed changes in {self.source_folder}; listing it again")
+                for known in list(self.folders):
+                    self._rescan(known)
+                continue
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in a new folder before it is watched, so list it right away
+                    self._snapshot(path, pend=True)
+                continue
+            if mask & IN_MOVED_FROM:
+                self.pending.pop(path, None)
+                self.files.pop(path, None)
+                continue
+            try:
+                self._seen(path, os.stat(path), True, now)
+            except OSError:
+                self.pending.pop(path, None)
+
+    # Function to collect the files that have settled; files that changed since they were last seen start over
+    def _settled(self):
+        now = time.monotonic()
+        ready, self.ready = self.ready, []
+        for path, (size, mtime_ns, changed_at) in list(self.pending.items()):
+            if now - changed_at < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != (size, mtime_ns):
+                self.pending[path] = signature + (now,)
+                continue
+            del self.pending[path]
+            if self.files.get(path) != signature:
+                self.files[path] = signature
+                ready.append(path)
+        return ready
+
+    # Function to work out how long to block: until the next file settles, the next poll, or a stop check
+    def _timeout(self):
+        if self.ready:
+            return 0.0
+        timeout = STOP_CHECK_INTERVAL if self.inotify is not None else self.poll_interval
+        if self.pending:
+            next_settled = min(changed_at for _, _, changed_at in self.pending.values()) + self.settle
+            timeout = min(timeout, max(0.0, next_settled - time.monotonic()))
+        return timeout
+
+    # Function to yield the settled files in batches until stop (a threading.Event) is set
+    # Files already in the folder count as new arrivals; those that have already settled make up the first batch
+    # Each batch must be organized before asking for the next one
+    def batches(self, stop=None):
+        stop = stop or threading.Event()
+        self._snapshot(self.source_folder, pend=True)
+        logger.info(f"Watching {self.source_folder} ({len(self.folders)} folders, {'inotify' if self.inotify is not None else 'polling'})")
+        try:
+            ready = self._settled()
+            while True:
+                if ready:
+                    logger.info(f"{len(ready)} new or changed files in {self.source_folder}")
+                    yield ready
+                    # Moved files are gone now; forget them so a file arriving under the same name counts as new
+                    for path in ready:
+                        if not os.path.lexists(path):
+                            self.files.pop(path, None)
+                if stop.is_set():
+                    break
+                timeout = self._timeout()
+                if self.inotify is not None:
+                    self._events(timeout)
+                elif not stop.wait(timeout):
+                    self._poll()
+                ready = self._settled()
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+    # Function to watch until stop is set, handing each batch to organize
+    def run(self, stop=None):
+        for ready in self.batches(stop):
+            self.organize(ready)